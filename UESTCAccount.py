@@ -1,9 +1,23 @@
 import base64
+import json
 import random
+import threading
+import time
 import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
+from login_page_parser import extract_error_tip, extract_login_fields
+from rate_limiter import RateLimiter
+from session_store import SessionStore
+from ticket_cache import ServiceTicketCache
+from transport import build_session, propagate_deadline, remaining_time, request_deadline
+
+
+# concurrent 登录模式使用的共享线程池
+_LOGIN_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="uestc-login")
 
 
 class UESTCAccount:
@@ -18,6 +32,13 @@ class UESTCAccount:
     # 指纹信息 URL
     FINGERPRINT_URL = "https://idas.uestc.edu.cn/authserver/bfp/info?bfp=1AEE9A6A77D6CAA491AFA55B9EF54C34"
     
+    # 会话有效性探测 URL（已登录返回 200，未登录重定向到登录页）
+    PROBE_URL = "https://idas.uestc.edu.cn/authserver/index.do"
+    
+    # IDAS 的会话 Cookie：登录表单的 execution 与此会话绑定
+    IDAS_HOST = "idas.uestc.edu.cn"
+    IDAS_SESSION_COOKIE = "JSESSIONID"
+    
     # HTTP Headers 配置
     DEFAULT_HEADERS = {
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
@@ -37,10 +58,28 @@ class UESTCAccount:
         "sec-ch-ua-platform": '"Windows"'
     }
     
+    # 会话确认有效（探测通过或刚登录）后的免探测时间（秒）
+    SESSION_VALID_TTL = 30
+    
+    # 登录模式：
+    # - full: 依次请求登录页面、验证码检查、指纹信息（与浏览器一致）
+    # - concurrent: 三个请求并发发出
+    # - lean: 跳过验证码检查和指纹信息，遇到验证码拦截时自动回退到 full
+    LOGIN_MODES = ("full", "concurrent", "lean")
+    # lean 模式遇到验证码后，回退到 full 模式的持续时间（秒）
+    LEAN_COOLDOWN = 3600
+    
+    # 登录限流排队的最长等待时间（秒）
+    LOGIN_MAX_WAIT = 120
+    # 单次登录流程（含 lean 回退）的总时限（秒），期间每个请求的超时不超过剩余时间
+    LOGIN_TIMEOUT = 60
+    
     # AES 加密字符集
     AES_CHARS = "ABCDEFGHJKMNPQRSTWXYZabcdefhijkmnprstwxyz2345678"
     
-    def __init__(self, username: str, password: str, log_func=None, multi_factor_fingerprint: str | None = None):
+    def __init__(self, username: str, password: str, log_func=None, multi_factor_fingerprint: str | None = None,
+                 session_store: SessionStore | None = None, login_limiter: RateLimiter | None = None,
+                 login_mode: str = "full"):
         """初始化 UESTC 账户。
 
         Args:
@@ -48,12 +87,122 @@ class UESTCAccount:
             password: 密码
             log_func: 日志函数，默认为 print
             multi_factor_fingerprint: 两步认证信任浏览器指纹，传 None 表示不启用
+            session_store: 会话持久化存储，传 None 表示不启用
+            login_limiter: 登录限流器（多个账户共享），传 None 表示不限流
+            login_mode: 登录模式，见 LOGIN_MODES
         """
+        if login_mode not in self.LOGIN_MODES:
+            raise ValueError(f"不支持的登录模式: {login_mode}")
         self.username = username
         self.password = password
-        self.session = requests.Session()
         self.log = log_func or print
         self.multi_factor_fingerprint = multi_factor_fingerprint
+        self.session_store = session_store
+        self.login_limiter = login_limiter
+        self.login_mode = login_mode
+        # lean 模式被验证码拦截后，在此时间之前使用 full 模式
+        self._lean_disabled_until = 0.0
+        # 最近一次登录各步骤的耗时（秒）
+        self.last_login_timings: Dict[str, float] = {}
+        
+        # 会话按需创建；被账户池回收后，Cookie 暂存于此（或会话存储）等待再次激活
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
+        self._spilled_cookies: Optional[List[dict]] = None
+        # 正在使用会话的调用方数（登录、任务执行），大于 0 时账户池不回收
+        self._session_pins = 0
+        # 会话被访问时的回调（账户池用于维护 LRU 顺序）
+        self.on_session_access: Optional[Callable[['UESTCAccount'], None]] = None
+        
+        # 单飞登录：并发调用方等待同一次登录并共享结果
+        self._login_lock = threading.Lock()
+        self._login_generation = 0
+        self._last_login_ok = False
+        self._validated_at: Optional[float] = None
+        
+        # 各业务系统的服务票据缓存（按 CAS service 区分）
+        self.ticket_cache = ServiceTicketCache()
+    
+    @property
+    def session(self) -> requests.Session:
+        """当前账户的 HTTP 会话，被回收后首次访问时自动重建并恢复 Cookie"""
+        created = False
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._create_session()
+                created = True
+            session = self._session
+        if created:
+            self._rehydrate_cookies(session)
+        if self.on_session_access:
+            self.on_session_access(self)
+        # 返回本次取得的会话：即使随后被回收，调用方拿到的也不会是 None
+        return session
+    
+    @property
+    def has_live_session(self) -> bool:
+        """是否持有活跃的 HTTP 会话（及其连接池）"""
+        return self._session is not None
+    
+    @property
+    def session_in_use(self) -> bool:
+        """会话是否正被使用（见 pinned_session）"""
+        return self._session_pins > 0
+    
+    @contextmanager
+    def pinned_session(self) -> Iterator[None]:
+        """在上下文中占用会话（可嵌套、多线程共用）：期间 release_session() 不回收，账户池只回收空闲会话"""
+        with self._session_lock:
+            self._session_pins += 1
+        try:
+            yield
+        finally:
+            with self._session_lock:
+                self._session_pins -= 1
+    
+    def _create_session(self) -> requests.Session:
+        """创建新的 HTTP 会话（按主机配置连接池、重试与默认超时）"""
+        session = build_session()
+        session.headers.update(self.DEFAULT_HEADERS)
+        return session
+    
+    def _rehydrate_cookies(self, session: requests.Session) -> None:
+        """将回收时暂存的 Cookie 恢复到新建的会话"""
+        try:
+            if self._spilled_cookies is not None:
+                SessionStore.load_cookies(session.cookies, self._spilled_cookies)
+                self._spilled_cookies = None
+            elif self.session_store:
+                self.session_store.restore(self.username, session.cookies)
+        except Exception as e:
+            self.log(f"恢复会话 Cookie 失败: {e}")
+    
+    def release_session(self) -> bool:
+        """回收 HTTP 会话：Cookie 写入会话存储（未启用时暂存于内存），并关闭连接池
+        
+        Returns:
+            已回收（或本就没有会话）返回 True；会话正被使用（见 pinned_session）时不回收，返回 False
+        """
+        with self._session_lock:
+            if self._session_pins:
+                return False
+            session = self._session
+            self._session = None
+        if session is None:
+            return True
+        
+        cookies = SessionStore.dump_cookies(session.cookies)
+        try:
+            if self.session_store:
+                self.session_store.save_cookies(self.username, cookies)
+            else:
+                self._spilled_cookies = cookies
+        except Exception as e:
+            self.log(f"保存会话失败: {e}")
+            self._spilled_cookies = cookies
+        finally:
+            session.close()
+        return True
     
     def _random_string(self, length: int) -> str:
         """生成指定长度的随机字符串，用于 AES 加密前缀和 IV。
@@ -97,78 +246,337 @@ class UESTCAccount:
         
         return base64.b64encode(encrypted_bytes).decode('utf-8')
     
+    def _parse_login_page(self, html: str) -> tuple[str | None, str | None]:
+        """从登录页面提取 execution 和 salt。
+        
+        优先使用正则快速提取，失败时才回退到完整的 BeautifulSoup 解析。
+        
+        Args:
+            html: 登录页面 HTML
+            
+        Returns:
+            (execution, salt) 元组，未找到的字段为 None
+        """
+        return extract_login_fields(html)
+    
+    def _prepare_login(self, html: str) -> dict | None:
+        """解析登录页面并生成登录表单（同步、异步登录共用）。
+        
+        Args:
+            html: 登录页面 HTML
+            
+        Returns:
+            登录表单字典，解析失败返回 None
+        """
+        execution, salt_value = self._parse_login_page(html)
+        
+        if not salt_value:
+            self.log("获取 salt 失败")
+            return None
+        
+        if not execution:
+            self.log("获取 execution 失败")
+            return None
+        
+        # 加密密码
+        encrypted_password = self._encrypt_password(self.password, str(salt_value))
+        self.log(f"密码已加密")
+        
+        return {
+            "username": self.username,
+            "password": encrypted_password,
+            "captcha": "",
+            "rememberMe": "true",
+            "_eventId": "submit",
+            "cllt": "userNameLogin",
+            "dllt": "generalLogin",
+            "lt": "",
+            "execution": execution
+        }
+    
+    def _apply_login_cookies(self) -> None:
+        """更新 Cookie（包含语言偏好和两步认证信任浏览器指纹）"""
+        cookies_to_update = {
+            'org.springframework.web.servlet.i18n.CookieLocaleResolver.LOCALE': 'zh_CN',
+        }
+        if self.multi_factor_fingerprint:
+            cookies_to_update['MULTIFACTOR_BROWSER_FINGERPRINT'] = self.multi_factor_fingerprint
+            self.log("已设置两步认证信任浏览器指纹")
+        self.session.cookies.update(cookies_to_update)
+    
+    def _finish_login(self, status_code: int, text: str) -> bool:
+        """根据登录表单提交结果判断是否登录成功。
+        
+        Args:
+            status_code: 响应状态码
+            text: 响应正文
+            
+        Returns:
+            登录成功返回 True，失败返回 False
+        """
+        if status_code == 200 and "统一身份认证" not in text:
+            self.log("登录成功")
+            self.save_session()
+            return True
+        
+        self.log(f"登录失败 - 状态码: {status_code}")
+        return False
+    
     def login(self) -> bool:
         """登录到 EAMS 系统。
         
         获取登录页面的 salt 值，加密密码，然后提交登录表单。
+        并发调用时只会执行一次登录，等待中的调用方直接共享该次登录的结果。
+        
+        Returns:
+            登录成功返回 True，失败返回 False
+        """
+        generation = self._login_generation
+        with self._login_lock, self.pinned_session():
+            if self._login_generation != generation:
+                # 等锁期间已有其他调用方完成登录，直接复用其结果
+                return self._last_login_ok
+            return self._login_locked()
+    
+    def refresh_login(self) -> bool:
+        """会话可能已过期时调用：先探测会话，确认失效后才重新登录。
+        
+        并发调用方共享同一次探测/登录，保证每次会话过期最多访问一次 IDAS 登录。
+        
+        Returns:
+            会话可用返回 True，否则返回 False
+        """
+        generation = self._login_generation
+        with self._login_lock, self.pinned_session():
+            if self._login_generation != generation:
+                return self._last_login_ok
+            if self._validated_at and time.time() - self._validated_at < self.SESSION_VALID_TTL:
+                return True
+            if self.is_session_valid():
+                self.log("会话仍然有效，无需重新登录")
+                return True
+            return self._login_locked()
+    
+    def invalidate_session(self) -> None:
+        """标记会话可能已失效，下次 refresh_login() 时重新探测"""
+        self._validated_at = None
+    
+    def _record_login_result(self, ok: bool) -> bool:
+        """记录一次登录的结果，供等待中的调用方共享"""
+        self._last_login_ok = ok
+        self._validated_at = time.time() if ok else None
+        self._login_generation += 1
+        if ok:
+            # 新的登录会话下，旧的服务票据不再可靠
+            self.ticket_cache.clear()
+        return ok
+    
+    def _login_locked(self) -> bool:
+        """执行完整登录流程（调用方需持有登录锁）"""
+        max_wait = self.LOGIN_MAX_WAIT
+        remaining = remaining_time()
+        if remaining is not None:
+            # 调用方（如调度任务）设置了截止时间，排队不能超过剩余时间
+            max_wait = min(max_wait, max(remaining, 0))
+        if self.login_limiter and not self.login_limiter.acquire(max_wait=max_wait):
+            self.log("登录限流：排队等待超时，放弃本次登录")
+            return self._record_login_result(False)
+        with request_deadline(self.LOGIN_TIMEOUT):
+            return self._record_login_result(self._do_login())
+    
+    def _effective_login_mode(self) -> str:
+        """获取本次登录实际使用的模式（lean 模式冷却期间使用 full）"""
+        if self.login_mode == "lean" and time.time() < self._lean_disabled_until:
+            return "full"
+        return self.login_mode
+    
+    def _captcha_needed(self, capcheck_text: str) -> bool:
+        """解析验证码检查接口的响应，判断是否需要验证码"""
+        try:
+            return bool(json.loads(capcheck_text).get("isNeed"))
+        except Exception:
+            return False
+    
+    def _is_captcha_challenge(self, status_code: int, text: str) -> bool:
+        """判断登录表单提交结果是否为验证码拦截"""
+        if status_code != 200 or "统一身份认证" not in text:
+            return False
+        tip = extract_error_tip(text)
+        return bool(tip and "验证码" in tip)
+    
+    def _log_login_timings(self, timings: Dict[str, float], mode: str) -> None:
+        """记录并输出登录各步骤耗时"""
+        self.last_login_timings = timings
+        detail = ", ".join(f"{step}={cost * 1000:.0f}ms" for step, cost in timings.items())
+        self.log(f"登录耗时（{mode}）: {detail}")
+    
+    def _timed_get(self, timings: Dict[str, float], step: str, url: str) -> requests.Response:
+        """发送 GET 请求并记录耗时"""
+        start = time.perf_counter()
+        try:
+            return self.session.get(url)
+        finally:
+            timings[step] = time.perf_counter() - start
+    
+    def _has_idas_session(self) -> bool:
+        """CookieJar 中是否已有 IDAS 的会话 Cookie
+        
+        没有时并发请求的登录页面、验证码检查、指纹信息会各自得到新的会话 Cookie，
+        最后写入的不一定与登录页面的 execution 对应，需先单独请求登录页面。
+        """
+        return any(
+            cookie.name == self.IDAS_SESSION_COOKIE and cookie.domain.lstrip(".") == self.IDAS_HOST
+            for cookie in self.session.cookies
+        )
+    
+    def _do_login(self) -> bool:
+        """登录流程的具体实现（lean 模式遇到验证码时回退到完整流程）
         
         Returns:
             登录成功返回 True，失败返回 False
         """
+        mode = self._effective_login_mode()
+        result = self._login_once(mode)
+        if result is None:
+            self.log("精简登录被验证码拦截，回退到完整登录流程")
+            self._lean_disabled_until = time.time() + self.LEAN_COOLDOWN
+            result = self._login_once("full")
+        return bool(result)
+    
+    def _login_once(self, mode: str) -> bool | None:
+        """按指定模式执行一次登录
+        
+        Args:
+            mode: 登录模式
+            
+        Returns:
+            登录成功返回 True，失败返回 False；lean 模式被验证码拦截返回 None
+        """
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
         try:
             self.session.headers.update(self.DEFAULT_HEADERS)
+            capcheck_response = None
             
-            # 获取登录页面，提取 execution 和 salt
-            login_response = self.session.get(self.LOGIN_URL)
-            soup = BeautifulSoup(login_response.text, 'lxml')
+            if mode == "concurrent":
+                # 验证码检查、指纹信息与登录页面互不依赖，并发请求（线程池中沿用本线程的截止时间）；
+                # 尚无 IDAS 会话 Cookie 时先请求登录页面建立会话，其余两个请求再并发
+                timed_get = propagate_deadline(self._timed_get)
+                page_future = None
+                if self._has_idas_session():
+                    page_future = _LOGIN_EXECUTOR.submit(timed_get, timings, "page", self.LOGIN_URL)
+                else:
+                    login_response = self._timed_get(timings, "page", self.LOGIN_URL)
+                capcheck_future = _LOGIN_EXECUTOR.submit(
+                    timed_get, timings, "captcha_check", self.CAPCHECK_URL + self.username
+                )
+                fingerprint_future = _LOGIN_EXECUTOR.submit(
+                    timed_get, timings, "fingerprint", self.FINGERPRINT_URL
+                )
+                if page_future is not None:
+                    login_response = page_future.result()
+                capcheck_response = capcheck_future.result()
+                fingerprint_future.result()
+            else:
+                # 获取登录页面，提取 execution 和 salt
+                login_response = self._timed_get(timings, "page", self.LOGIN_URL)
             
-            execution_element = soup.find(id='execution')
-            salt_element = soup.find('input', attrs={'id': 'pwdEncryptSalt'})
-            
-            if not salt_element:
-                self.log("获取 salt 失败")
-                return False
-            
-            if not execution_element:
-                self.log("获取 execution 失败")
+            payload = self._prepare_login(login_response.text)
+            if payload is None:
                 return False
             
-            salt_value = salt_element['value']
-            execution = execution_element['value']
-            
-            # 加密密码
-            encrypted_password = self._encrypt_password(self.password, str(salt_value))
-            self.log(f"密码已加密")
+            if mode == "full":
+                # 检查是否需要验证码
+                capcheck_response = self._timed_get(timings, "captcha_check", self.CAPCHECK_URL + self.username)
+                # 获取指纹信息
+                self._timed_get(timings, "fingerprint", self.FINGERPRINT_URL)
             
-            # 检查是否需要验证码
-            capcheck_response = self.session.get(self.CAPCHECK_URL + self.username)
-            self.log(f"验证码检查: {capcheck_response.text}")
+            if capcheck_response is not None:
+                self.log(f"验证码检查: {capcheck_response.text}")
+                if self._captcha_needed(capcheck_response.text):
+                    # 无法自动识别验证码，继续提交只会增加失败次数
+                    self.log("登录需要验证码，放弃本次登录")
+                    return False
             
-            # 准备登录请求
-            payload = {
-                "username": self.username,
-                "password": encrypted_password,
-                "captcha": "",
-                "rememberMe": "true",
-                "_eventId": "submit",
-                "cllt": "userNameLogin",
-                "dllt": "generalLogin",
-                "lt": "",
-                "execution": execution
-            }
-            
-            # 获取指纹信息
-            self.session.get(self.FINGERPRINT_URL)
-            
-            # 更新 Cookie（包含语言偏好和两步认证信任浏览器指纹）
-            cookies_to_update = {
-                'org.springframework.web.servlet.i18n.CookieLocaleResolver.LOCALE': 'zh_CN',
-            }
-            if self.multi_factor_fingerprint:
-                cookies_to_update['MULTIFACTOR_BROWSER_FINGERPRINT'] = self.multi_factor_fingerprint
-                self.log("已设置两步认证信任浏览器指纹")
-            self.session.cookies.update(cookies_to_update)
+            self._apply_login_cookies()
             
             # 提交登录请求
+            submit_start = time.perf_counter()
             login_response = self.session.post(self.LOGIN_URL, data=payload)
+            timings["submit"] = time.perf_counter() - submit_start
             
-            if login_response.status_code == 200 and "统一身份认证" not in login_response.text:
-                self.log("登录成功")
-                return True
-            
-            self.log(f"登录失败 - 状态码: {login_response.status_code}")
-            return False
+            if mode == "lean" and self._is_captcha_challenge(login_response.status_code, login_response.text):
+                return None
+            return self._finish_login(login_response.status_code, login_response.text)
             
         except Exception as e:
             self.log(f"登录异常: {e}")
-            return False
\ No newline at end of file
+            return False
+        finally:
+            timings["total"] = time.perf_counter() - start
+            self._log_login_timings(timings, mode)
+    
+    def is_session_valid(self) -> bool:
+        """用一次轻量请求探测当前会话是否仍处于登录状态。
+        
+        Returns:
+            会话有效返回 True，否则返回 False
+        """
+        try:
+            response = self.session.get(self.PROBE_URL, allow_redirects=False, timeout=10)
+            if response.status_code != 200 or "统一身份认证" in response.text:
+                return False
+            self._validated_at = time.time()
+            return True
+        except Exception as e:
+            self.log(f"会话探测异常: {e}")
+            return False
+    
+    def save_session(self) -> None:
+        """将当前会话的 Cookie 加密保存到会话存储（未启用时忽略）"""
+        if not self.session_store:
+            return
+        try:
+            self.session_store.save(self.username, self.session.cookies)
+        except Exception as e:
+            self.log(f"保存会话失败: {e}")
+    
+    def restore_session(self) -> bool:
+        """从会话存储恢复 Cookie，并通过探测确认会话仍然有效。
+        
+        Returns:
+            恢复成功且会话有效返回 True，否则返回 False
+        """
+        if not self.session_store:
+            return False
+        with self.pinned_session():
+            return self._restore_session_pinned()
+    
+    def _restore_session_pinned(self) -> bool:
+        """restore_session() 的实现（调用方需占用会话）"""
+        try:
+            self.session.headers.update(self.DEFAULT_HEADERS)
+            if not self.session_store.restore(self.username, self.session.cookies):
+                return False
+        except Exception as e:
+            self.log(f"恢复会话失败: {e}")
+            return False
+        
+        if self.is_session_valid():
+            self.log("已从会话存储恢复登录状态")
+            return True
+        
+        self.log("保存的会话已失效")
+        self.session.cookies.clear()
+        self.session_store.delete(self.username)
+        return False
+    
+    def restore_or_login(self) -> bool:
+        """优先恢复保存的会话，失败时再执行完整登录。
+        
+        Returns:
+            会话可用返回 True，否则返回 False
+        """
+        if self.restore_session():
+            return True
+        return self.login()
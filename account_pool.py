@@ -0,0 +1,167 @@
+"""UESTC 服务系统 - 账户池
+集中管理大量 UESTCAccount，限制同时存活的 HTTP 会话数量，空闲账户按 LRU 回收
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Type
+from UESTCAccount import UESTCAccount
+from rate_limiter import RateLimiter
+from session_store import SessionStore
+
+
+class UESTCAccountPool:
+    """账户池，最多同时保留 max_live_sessions 个活跃会话。
+
+    账户的 session 被访问时会通知账户池更新 LRU 顺序；活跃会话超过上限时，
+    最久未使用的空闲账户会被回收：Cookie 写入会话存储（未启用时暂存于内存），
+    连接池关闭。正在登录或执行任务的账户（见 UESTCAccount.pinned_session）不会被回收，
+    全部活跃会话都在使用中时暂时超出上限。被回收的账户再次访问 session 时自动重建并恢复 Cookie。
+    """
+
+    def __init__(self, max_live_sessions: int = 64, session_store: Optional[SessionStore] = None, log_func=None,
+                 account_class: Type[UESTCAccount] = UESTCAccount, login_limiter: Optional[RateLimiter] = None,
+                 login_mode: str = "full"):
+        """初始化账户池
+
+        Args:
+            max_live_sessions: 同时存活的 HTTP 会话上限
+            session_store: 会话持久化存储，回收时 Cookie 写入此处
+            log_func: 日志函数，默认为 print
+            account_class: 账户类型（如 AsyncUESTCAccount）
+            login_limiter: 所有账户共享的登录限流器
+            login_mode: 账户的登录模式，见 UESTCAccount.LOGIN_MODES
+        """
+        if max_live_sessions <= 0:
+            raise ValueError("活跃会话上限必须大于 0")
+        self.max_live_sessions = max_live_sessions
+        self.session_store = session_store
+        self.log = log_func or print
+        self.account_class = account_class
+        self.login_limiter = login_limiter
+        self.login_mode = login_mode
+
+        self._accounts: Dict[str, UESTCAccount] = {}
+        # 活跃会话的 LRU 顺序（末尾为最近使用）
+        self._live: "OrderedDict[str, UESTCAccount]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.evictions = 0
+        self.rehydrations = 0
+
+    def add(self, username: str, password: str, multi_factor_fingerprint: Optional[str] = None) -> UESTCAccount:
+        """向账户池添加账户（不会立即创建会话）
+
+        Args:
+            username: 用户名
+            password: 密码
+            multi_factor_fingerprint: 两步认证信任浏览器指纹
+
+        Returns:
+            新建的 UESTCAccount 实例；账户已存在时返回已有实例
+        """
+        with self._lock:
+            if username in self._accounts:
+                return self._accounts[username]
+            account = self.account_class(
+                username=username,
+                password=password,
+                log_func=self.log,
+                multi_factor_fingerprint=multi_factor_fingerprint,
+                session_store=self.session_store,
+                login_limiter=self.login_limiter,
+                login_mode=self.login_mode,
+            )
+            account.on_session_access = self._on_session_access
+            self._accounts[username] = account
+            return account
+
+    def get(self, username: str) -> UESTCAccount:
+        """获取账户
+
+        Args:
+            username: 用户名
+
+        Returns:
+            UESTCAccount 实例
+
+        Raises:
+            KeyError: 账户不存在
+        """
+        with self._lock:
+            if username not in self._accounts:
+                raise KeyError(f"账户 '{username}' 不存在")
+            return self._accounts[username]
+
+    def remove(self, username: str) -> None:
+        """移除账户并释放其会话"""
+        with self._lock:
+            account = self._accounts.pop(username, None)
+            self._live.pop(username, None)
+        if account:
+            account.on_session_access = None
+            account.release_session()
+
+    def _on_session_access(self, account: UESTCAccount) -> None:
+        """账户 session 被访问时更新 LRU，必要时回收最久未使用的空闲会话"""
+        victims: List[UESTCAccount] = []
+        with self._lock:
+            if account.username in self._live:
+                self._live.move_to_end(account.username)
+            else:
+                self._live[account.username] = account
+                self.rehydrations += 1
+            excess = len(self._live) - self.max_live_sessions
+            if excess > 0:
+                for candidate in self._live.values():
+                    if len(victims) == excess:
+                        break
+                    if candidate is not account and not candidate.session_in_use:
+                        victims.append(candidate)
+                for victim in victims:
+                    del self._live[victim.username]
+                    self.evictions += 1
+
+        # 在锁外关闭连接，避免阻塞其他账户
+        for victim in victims:
+            if not victim.release_session():
+                # 选中后又开始使用：放回 LRU 队首，之后的访问再回收
+                with self._lock:
+                    self._live[victim.username] = victim
+                    self._live.move_to_end(victim.username, last=False)
+                    self.evictions -= 1
+
+    def release_all(self) -> None:
+        """回收所有活跃会话（用于程序退出等场景）"""
+        with self._lock:
+            accounts = list(self._live.values())
+            self._live.clear()
+        for account in accounts:
+            if not account.release_session():
+                # 仍在使用的会话（如超时后未退出的任务）保留，不关闭其连接
+                with self._lock:
+                    self._live[account.username] = account
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取账户池统计信息
+
+        Returns:
+            包含账户数、活跃会话数、回收次数、激活次数的字典
+        """
+        with self._lock:
+            return {
+                "accounts": len(self._accounts),
+                "live_sessions": len(self._live),
+                "evictions": self.evictions,
+                "rehydrations": self.rehydrations,
+            }
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._accounts
+
+    def __iter__(self) -> Iterator[UESTCAccount]:
+        with self._lock:
+            return iter(list(self._accounts.values()))
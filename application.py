@@ -2,15 +2,42 @@
 所有应用模块都应继承自 Application 类
 """
 
+import asyncio
 from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Generator, NamedTuple, Optional, Tuple, TypeVar
 from UESTCAccount import UESTCAccount
+from lease import check_fence
 from logger import get_logger
 from operations import get_operation_manager
 
+T = TypeVar("T")
+
+
+class IOStep(NamedTuple):
+    """请求流程中的一步 I/O，同时给出同步与异步两种实现，由驱动方选择"""
+    sync: Callable[[], Any]
+    async_: Callable[[], Awaitable[Any]]
+
+
+# 请求流程：产出 IOStep、接收其结果（或在 yield 处抛出其异常）的生成器，返回值即流程结果
+Flow = Generator[IOStep, Any, T]
+
 
 class Application(ABC):
     """应用基类，所有模块都应继承此类"""
     
+    # 应用访问的主机，调度器据此限制同一主机上同时执行的任务数
+    HOSTS: Tuple[str, ...] = ()
+    
+    # 单次运行的时限（秒），None 表示使用调度器的默认时限
+    TIMEOUT: Optional[float] = None
+    
+    # 通知类别，决定邮件的合并窗口（见 notification_coalescer.py），None 使用默认规则
+    NOTIFY_CATEGORY: Optional[str] = None
+    
+    # 通知邮件的收件人，None 表示使用邮件操作的默认收件人（多账户时为各账户单独设置）
+    email_to: Optional[str] = None
+    
     def __init__(self, name: str, account: UESTCAccount):
         """初始化应用
         
@@ -32,6 +59,60 @@ class Application(ABC):
         """
         pass
     
+    async def run_async(self) -> bool:
+        """异步运行应用
+        
+        默认在线程池中执行 run()；支持异步 HTTP 的应用应重写此方法。
+        
+        Returns:
+            运行成功返回 True，失败返回 False
+        """
+        return await asyncio.to_thread(self.run)
+    
+    def http_get(self, url: str, **kwargs) -> IOStep:
+        """以账户会话发起 GET 请求的一步 I/O（同步走 session，异步走 client）"""
+        return IOStep(
+            lambda: self.account.session.get(url, **kwargs),
+            lambda: self.account.client.get(url, **kwargs),
+        )
+    
+    @staticmethod
+    def run_flow(flow: Flow[T]) -> T:
+        """同步执行请求流程
+        
+        重试、解析等逻辑写在流程中，同步与异步版本共用，驱动方只负责执行 I/O。
+        
+        Args:
+            flow: 请求流程
+            
+        Returns:
+            流程的返回值
+        """
+        send, value = flow.send, None
+        while True:
+            try:
+                step = send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                send, value = flow.send, step.sync()
+            except Exception as e:
+                send, value = flow.throw, e
+    
+    @staticmethod
+    async def arun_flow(flow: Flow[T]) -> T:
+        """异步执行请求流程（见 run_flow）"""
+        send, value = flow.send, None
+        while True:
+            try:
+                step = send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                send, value = flow.send, await step.async_()
+            except Exception as e:
+                send, value = flow.throw, e
+    
     def log_info(self, msg: str) -> None:
         """打印信息日志"""
         self.logger.info(f"[{self.name}] {msg}")
@@ -56,6 +137,10 @@ class Application(ABC):
             content: 邮件内容
             
         Returns:
-            发送成功返回 True，失败返回 False
+            发送成功（启用发送队列时为已写入队列）返回 True，失败返回 False
+            
+        Raises:
+            LeaseLostError: 任务所属分片的租约已由其他节点接管（不再发送）
         """
-        return self.operation_manager.send_email(subject, content)
+        check_fence()
+        return self.operation_manager.send_email(subject, content, to=self.email_to, category=self.NOTIFY_CATEGORY)
@@ -0,0 +1,369 @@
+"""UESTC 服务系统 - 异步账户
+基于 httpx.AsyncClient 的 UESTCAccount 异步版本，单个事件循环即可同时进行大量登录和查询
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+import httpx
+from UESTCAccount import UESTCAccount
+from resilience import CircuitOpenError, get_circuit_breaker
+from transport import HOST_POLICIES, DEFAULT_POLICY, HostPolicy, HostRateLimited, get_host_rate_limiter
+
+
+class _CircuitBreakerTransport(httpx.AsyncHTTPTransport):
+    """按请求主机的熔断器放行并记录结果的异步传输（与同步传输层共用熔断器）"""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        breaker = get_circuit_breaker(request.url.host)
+        if breaker is None:
+            return await super().handle_async_request(request)
+        if not breaker.allow():
+            raise CircuitOpenError(f"主机 {request.url.host} 已熔断，请求被拒绝")
+        recorded = False
+        try:
+            try:
+                response = await super().handle_async_request(request)
+            except httpx.TransportError:
+                breaker.record_failure()
+                recorded = True
+                raise
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            recorded = True
+            return response
+        finally:
+            if not recorded:
+                # 请求被取消等未能判断主机状态的结果：释放探测名额
+                breaker.release()
+
+
+class AsyncUESTCAccount(UESTCAccount):
+    """异步 UESTC 账户。
+
+    与同步版本共用同一个 CookieJar：异步登录后，同步的 session 同样处于登录状态，
+    反之亦然。登录页面解析、密码加密、表单构造等逻辑均复用 UESTCAccount，
+    同步方法 login() 等保持不变。异步登录同时持有同步登录锁，
+    两条路径混用（如在线程中执行的同步应用）时同一时刻仍只有一次登录。
+
+    异步客户端与异步登录锁绑定到创建它们的事件循环，同一时刻只应在一个事件循环中使用；
+    换用新的事件循环（如再次 asyncio.run）时自动重建，旧客户端在其所属的事件循环中关闭。
+    账户池回收会话时一并关闭异步客户端。
+    """
+
+    # 单个账户异步客户端的连接上限
+    MAX_CONNECTIONS = 10
+    REQUEST_TIMEOUT = 15
+    # 同步登录进行中时，异步登录轮询同步登录锁的间隔（秒）
+    LOGIN_LOCK_POLL_INTERVAL = 0.05
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client_lock = threading.Lock()
+        self._alogin_lock: Optional[asyncio.Lock] = None
+        self._alogin_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        # 正在关闭的旧客户端（保留任务引用，避免被垃圾回收）
+        self._closing: Set[asyncio.Task] = set()
+
+    @property
+    def alogin_lock(self) -> asyncio.Lock:
+        """异步单飞登录锁（每个事件循环首次使用时创建）"""
+        loop = asyncio.get_running_loop()
+        if self._alogin_lock is None or self._alogin_lock_loop is not loop:
+            self._alogin_lock = asyncio.Lock()
+            self._alogin_lock_loop = loop
+        return self._alogin_lock
+
+    @asynccontextmanager
+    async def _alogin_guard(self) -> AsyncIterator[None]:
+        """持有异步登录锁与同步登录锁，并占用会话
+
+        协程之间通过异步锁排队；同步登录锁以非阻塞方式轮询获取，等待线程中的同步登录时不阻塞事件循环。
+        """
+        async with self.alogin_lock:
+            while not self._login_lock.acquire(blocking=False):
+                await asyncio.sleep(self.LOGIN_LOCK_POLL_INTERVAL)
+            try:
+                with self.pinned_session():
+                    yield
+            finally:
+                self._login_lock.release()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """异步 HTTP 客户端（与 session 共享 CookieJar，按需在当前事件循环中创建）"""
+        loop = asyncio.get_running_loop()
+        jar = self.session.cookies
+        stale = None
+        with self._client_lock:
+            if self._client is not None and (self._client_loop is not loop or self._client.cookies.jar is not jar):
+                # 换用了新的事件循环，或会话被回收重建后 CookieJar 已更换：关闭旧客户端并重建
+                stale = self._detach_client()
+            if self._client is None:
+                self._client = self._create_client(jar)
+                self._client_loop = loop
+            client = self._client
+        if stale is not None:
+            self._close_client(*stale)
+        return client
+
+    def _detach_client(self) -> Optional[Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]]:
+        """取下当前异步客户端（调用方需持有 _client_lock）"""
+        if self._client is None:
+            return None
+        stale = (self._client, self._client_loop)
+        self._client = self._client_loop = None
+        return stale
+
+    def _close_client(self, client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop) -> None:
+        """在客户端所属的事件循环中关闭客户端（可在任意线程调用）"""
+        if loop.is_closed():
+            # 事件循环已结束，无法再在其中 aclose，直接丢弃
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            task = loop.create_task(client.aclose())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        elif running is None and not loop.is_running():
+            loop.run_until_complete(client.aclose())
+        else:
+            # 循环在其他线程运行（或当前线程正运行另一个循环）：交给所属循环执行
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+    def release_session(self) -> bool:
+        """回收 HTTP 会话，并关闭异步客户端（见 UESTCAccount.release_session）
+
+        Returns:
+            已回收（或本就没有会话）返回 True；会话正被使用时不回收，返回 False
+        """
+        if not super().release_session():
+            return False
+        with self._client_lock:
+            stale = self._detach_client()
+        if stale is not None:
+            self._close_client(*stale)
+        return True
+
+    def _create_client(self, jar) -> httpx.AsyncClient:
+        """创建与 session 共享 CookieJar 的异步客户端"""
+        return httpx.AsyncClient(
+                headers=self.DEFAULT_HEADERS,
+                cookies=jar,
+                follow_redirects=True,
+                timeout=self.REQUEST_TIMEOUT,
+                transport=self._build_transport(DEFAULT_POLICY),
+                mounts={
+                    f"https://{host}": self._build_transport(policy)
+                    for host, policy in HOST_POLICIES.items()
+                },
+                event_hooks={"request": [self._rate_limit_hook]},
+            )
+
+    @staticmethod
+    async def _rate_limit_hook(request: httpx.Request) -> None:
+        """请求发出前按主机限流（与同步传输层共用限流器）"""
+        host = request.url.host
+        limiter = get_host_rate_limiter(host)
+        if limiter is None:
+            return
+        max_wait = HOST_POLICIES.get(host, DEFAULT_POLICY).rate_limit_max_wait
+        if not await limiter.aacquire(max_wait=max_wait):
+            raise HostRateLimited(f"主机 {host} 请求限流排队超时")
+
+    def _build_transport(self, policy: HostPolicy) -> httpx.AsyncHTTPTransport:
+        """按主机策略创建异步传输（连接池上限、连接重试与熔断）"""
+        return _CircuitBreakerTransport(
+            limits=httpx.Limits(
+                max_connections=self.MAX_CONNECTIONS,
+                max_keepalive_connections=policy.pool_maxsize,
+            ),
+            retries=policy.max_retries,
+        )
+
+    async def aclose(self) -> None:
+        """关闭异步客户端（客户端属于其他事件循环时在其所属的循环中关闭）"""
+        with self._client_lock:
+            stale = self._detach_client()
+        if stale is None:
+            return
+        client, loop = stale
+        if loop is asyncio.get_running_loop():
+            await client.aclose()
+        else:
+            self._close_client(client, loop)
+
+    async def alogin(self) -> bool:
+        """异步登录到 EAMS 系统，流程与 login() 相同。
+
+        并发调用时只会执行一次登录，等待中的协程直接共享该次登录的结果。
+
+        Returns:
+            登录成功返回 True，失败返回 False
+        """
+        generation = self._login_generation
+        async with self._alogin_guard():
+            if self._login_generation != generation:
+                return self._last_login_ok
+            return await self._alogin_locked()
+
+    async def arefresh_login(self) -> bool:
+        """异步版本的 refresh_login()：先探测会话，确认失效后才重新登录。
+
+        Returns:
+            会话可用返回 True，否则返回 False
+        """
+        generation = self._login_generation
+        async with self._alogin_guard():
+            if self._login_generation != generation:
+                return self._last_login_ok
+            if self._validated_at and time.time() - self._validated_at < self.SESSION_VALID_TTL:
+                return True
+            if await self.ais_session_valid():
+                self.log("会话仍然有效，无需重新登录")
+                return True
+            return await self._alogin_locked()
+
+    async def _alogin_locked(self) -> bool:
+        """执行完整的异步登录流程（调用方需持有登录锁，见 _alogin_guard）"""
+        if self.login_limiter and not await self.login_limiter.aacquire(max_wait=self.LOGIN_MAX_WAIT):
+            self.log("登录限流：排队等待超时，放弃本次登录")
+            return self._record_login_result(False)
+        try:
+            ok = await asyncio.wait_for(self._ado_login(), self.LOGIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.log(f"登录超时（{self.LOGIN_TIMEOUT} 秒），已取消本次登录")
+            ok = False
+        return self._record_login_result(ok)
+
+    async def _ado_login(self) -> bool:
+        """异步登录流程的具体实现（lean 模式遇到验证码时回退到完整流程）
+
+        Returns:
+            登录成功返回 True，失败返回 False
+        """
+        mode = self._effective_login_mode()
+        result = await self._alogin_once(mode)
+        if result is None:
+            self.log("精简登录被验证码拦截，回退到完整登录流程")
+            self._lean_disabled_until = time.time() + self.LEAN_COOLDOWN
+            result = await self._alogin_once("full")
+        return bool(result)
+
+    async def _atimed_get(self, timings: Dict[str, float], step: str, url: str) -> httpx.Response:
+        """发送异步 GET 请求并记录耗时"""
+        start = time.perf_counter()
+        try:
+            return await self.client.get(url)
+        finally:
+            timings[step] = time.perf_counter() - start
+
+    async def _alogin_once(self, mode: str) -> Optional[bool]:
+        """按指定模式执行一次异步登录
+
+        Args:
+            mode: 登录模式
+
+        Returns:
+            登录成功返回 True，失败返回 False；lean 模式被验证码拦截返回 None
+        """
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        try:
+            capcheck_response = None
+
+            if mode == "concurrent" and self._has_idas_session():
+                # 登录页面、验证码检查、指纹信息互不依赖，并发请求
+                login_response, capcheck_response, _ = await asyncio.gather(
+                    self._atimed_get(timings, "page", self.LOGIN_URL),
+                    self._atimed_get(timings, "captcha_check", self.CAPCHECK_URL + self.username),
+                    self._atimed_get(timings, "fingerprint", self.FINGERPRINT_URL),
+                )
+            elif mode == "concurrent":
+                # 尚无 IDAS 会话 Cookie：先请求登录页面建立会话，其余两个请求再并发（见 _has_idas_session）
+                login_response = await self._atimed_get(timings, "page", self.LOGIN_URL)
+                capcheck_response, _ = await asyncio.gather(
+                    self._atimed_get(timings, "captcha_check", self.CAPCHECK_URL + self.username),
+                    self._atimed_get(timings, "fingerprint", self.FINGERPRINT_URL),
+                )
+            else:
+                # 获取登录页面，提取 execution 和 salt
+                login_response = await self._atimed_get(timings, "page", self.LOGIN_URL)
+
+            payload = self._prepare_login(login_response.text)
+            if payload is None:
+                return False
+
+            if mode == "full":
+                # 检查是否需要验证码
+                capcheck_response = await self._atimed_get(timings, "captcha_check", self.CAPCHECK_URL + self.username)
+                # 获取指纹信息
+                await self._atimed_get(timings, "fingerprint", self.FINGERPRINT_URL)
+
+            if capcheck_response is not None:
+                self.log(f"验证码检查: {capcheck_response.text}")
+                if self._captcha_needed(capcheck_response.text):
+                    self.log("登录需要验证码，放弃本次登录")
+                    return False
+
+            self._apply_login_cookies()
+
+            # 提交登录请求
+            submit_start = time.perf_counter()
+            login_response = await self.client.post(self.LOGIN_URL, data=payload)
+            timings["submit"] = time.perf_counter() - submit_start
+
+            if mode == "lean" and self._is_captcha_challenge(login_response.status_code, login_response.text):
+                return None
+            return self._finish_login(login_response.status_code, login_response.text)
+
+        except Exception as e:
+            self.log(f"登录异常: {e}")
+            return False
+        finally:
+            timings["total"] = time.perf_counter() - start
+            self._log_login_timings(timings, mode)
+
+    async def ais_session_valid(self) -> bool:
+        """异步探测当前会话是否仍处于登录状态。
+
+        Returns:
+            会话有效返回 True，否则返回 False
+        """
+        try:
+            response = await self.client.get(self.PROBE_URL, follow_redirects=False, timeout=10)
+            if response.status_code != 200 or "统一身份认证" in response.text:
+                return False
+            self._validated_at = time.time()
+            return True
+        except Exception as e:
+            self.log(f"会话探测异常: {e}")
+            return False
+
+
+async def login_all(accounts: Iterable[AsyncUESTCAccount], concurrency: int = 100) -> List[bool]:
+    """并发登录多个账户
+
+    Args:
+        accounts: 异步账户列表
+        concurrency: 同时进行的登录数上限
+
+    Returns:
+        与 accounts 顺序对应的登录结果列表
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _login(account: AsyncUESTCAccount) -> bool:
+        async with semaphore:
+            return await account.alogin()
+
+    return list(await asyncio.gather(*(_login(a) for a in accounts)))
@@ -0,0 +1,174 @@
+"""多节点租约协议验证
+启动多个本地进程作为节点，共用一个 SQLite 租约文件协调分片；运行中强制杀死一个节点（不释放租约）、
+再加入一个新节点，核对：
+- 同一分片任意时刻只有一个节点认为自己持有（按防护令牌检查，令牌随时间递增且每个令牌只属于一个节点）
+- 被杀节点的分片在租约过期后由其余节点接管，新节点加入后分到应得的分片
+- 结束时全部分片都有存活节点持有，且分布大致均衡
+
+用法（在项目根目录运行）：
+    python benchmarks/bench_lease.py [--nodes 4] [--shards 200] [--ttl 3] [--seconds 20]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lease import LeaseCoordinator, SQLiteLeaseStore  # noqa: E402
+from logger import get_logger  # noqa: E402
+
+# 各节点检查分片归属的间隔（秒）
+CHECK_INTERVAL = 0.1
+
+
+def _node_main(node_id: str, lease_db: str, record_db: str, shards: int, ttl: float) -> None:
+    """节点进程：维护租约，并定期记录自己认为持有的分片及其令牌"""
+    get_logger().set_record_sink(lambda level, msg: None)
+    coordinator = LeaseCoordinator(SQLiteLeaseStore(lease_db), node_id=node_id, lease_ttl=ttl)
+    for i in range(shards):
+        coordinator.register(f"shard-{i}")
+    coordinator.start()
+    records = sqlite3.connect(record_db, timeout=30, isolation_level=None)
+    try:
+        while True:
+            now = time.time()
+            rows = [
+                (shard, node_id, coordinator.fencing_token(shard), now)
+                for shard in coordinator.owned_shards()
+            ]
+            records.executemany("INSERT INTO records (shard, node, token, at) VALUES (?, ?, ?, ?)", rows)
+            time.sleep(CHECK_INTERVAL)
+    finally:
+        coordinator.stop()
+
+
+def _start_node(node_id: str, args, lease_db: str, record_db: str) -> multiprocessing.Process:
+    process = multiprocessing.Process(
+        target=_node_main, args=(node_id, lease_db, record_db, args.shards, args.ttl), daemon=True
+    )
+    process.start()
+    return process
+
+
+def _check_exclusive(records: sqlite3.Connection) -> list:
+    """检查每个分片的令牌随时间递增且每个令牌只属于一个节点，返回违例"""
+    violations = []
+    last = {}
+    owners = {}
+    for shard, node, token, at in records.execute("SELECT shard, node, token, at FROM records ORDER BY at"):
+        if owners.setdefault((shard, token), node) != node:
+            violations.append(f"{shard} 令牌 {token} 同时属于 {owners[(shard, token)]} 和 {node}")
+        previous = last.get(shard)
+        if previous is not None and token < previous[0] and at > previous[1]:
+            violations.append(f"{shard} 在 {at:.2f} 由 {node} 以旧令牌 {token} 执行（已有令牌 {previous[0]}）")
+        if previous is None or token >= previous[0]:
+            last[shard] = (token, at)
+    return violations
+
+
+def _owners_at(records: sqlite3.Connection, start: float, end: float) -> dict:
+    """统计时间窗口内各节点持有的分片"""
+    owners = {}
+    for shard, node in records.execute(
+        "SELECT DISTINCT shard, node FROM records WHERE at >= ? AND at < ?", (start, end)
+    ):
+        owners.setdefault(node, set()).add(shard)
+    return owners
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="多节点租约协议验证")
+    parser.add_argument("--nodes", type=int, default=4, help="初始节点（进程）数")
+    parser.add_argument("--shards", type=int, default=200, help="分片数")
+    parser.add_argument("--ttl", type=float, default=3, help="租约秒数")
+    parser.add_argument("--seconds", type=float, default=20, help="总运行秒数")
+    args = parser.parse_args()
+    if args.nodes < 2:
+        parser.error("至少需要 2 个节点")
+
+    directory = tempfile.mkdtemp(prefix="bench-lease-")
+    lease_db = os.path.join(directory, "lease.db")
+    record_db = os.path.join(directory, "records.db")
+    records = sqlite3.connect(record_db, timeout=30, isolation_level=None)
+    records.execute("PRAGMA journal_mode=WAL")
+    records.execute("CREATE TABLE records (shard TEXT, node TEXT, token INTEGER, at REAL)")
+    SQLiteLeaseStore(lease_db).close()
+
+    # 阶段 1：初始节点分配；阶段 2：杀死一个节点；阶段 3：加入新节点
+    phase = args.seconds / 3
+    processes = {f"node-{i}": _start_node(f"node-{i}", args, lease_db, record_db) for i in range(args.nodes)}
+    started = time.time()
+    time.sleep(phase)
+    victim = "node-0"
+    killed_at = time.time()
+    processes[victim].kill()
+    processes[victim].join()
+    time.sleep(phase)
+    joined_at = time.time()
+    newcomer = f"node-{args.nodes}"
+    processes[newcomer] = _start_node(newcomer, args, lease_db, record_db)
+    time.sleep(phase)
+    ended = time.time()
+    for name, process in processes.items():
+        if name != victim:
+            process.terminate()
+    for process in processes.values():
+        process.join(timeout=10)
+
+    all_shards = {f"shard-{i}" for i in range(args.shards)}
+    failures = []
+
+    violations = _check_exclusive(records)
+    total = records.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+    print(f"{args.nodes} 个节点，{args.shards} 个分片，租约 {args.ttl:g} 秒，记录 {total} 条")
+    print(f"  独占性违例: {len(violations)}")
+    failures += violations[:5]
+
+    # 被杀节点的分片多久后被接管
+    victim_shards = _owners_at(records, killed_at - 1, killed_at).get(victim, set())
+    takeover = {}
+    for shard, at in records.execute(
+        "SELECT shard, MIN(at) FROM records WHERE node != ? AND at > ? GROUP BY shard", (victim, killed_at)
+    ):
+        if shard in victim_shards:
+            takeover[shard] = at - killed_at
+    slowest = max(takeover.values(), default=0.0)
+    print(f"  被杀节点持有 {len(victim_shards)} 个分片，接管 {len(takeover)} 个，最长接管耗时 {slowest:.2f}s")
+    if len(takeover) != len(victim_shards):
+        failures.append("被杀节点的分片未全部被接管")
+    # 接管上限：租约过期 + 一次续约间隔 + 检查间隔
+    if slowest > args.ttl + args.ttl / 3 + 1:
+        failures.append(f"接管耗时 {slowest:.2f}s 超过预期")
+
+    def report(title: str, owners: dict, live: int) -> None:
+        counts = {node: len(shards) for node, shards in sorted(owners.items())}
+        covered = set().union(*owners.values()) if owners else set()
+        print(f"  {title}: 覆盖 {len(covered)}/{args.shards}，各节点 {counts}")
+        if covered != all_shards:
+            failures.append(f"{title}有分片无人持有")
+        if len(counts) != live or max(counts.values()) > 2 * args.shards / live:
+            failures.append(f"{title}分布不均衡")
+
+    settle = args.ttl * 1.5
+    report("杀死节点前", _owners_at(records, started + settle, killed_at - 0.5), args.nodes)
+    report("杀死节点后", _owners_at(records, joined_at - 1, joined_at), args.nodes - 1)
+    report("新节点加入后", _owners_at(records, ended - 1, ended), args.nodes)
+    newcomer_shards = _owners_at(records, ended - 1, ended).get(newcomer, set())
+    print(f"  新节点 {newcomer} 分得 {len(newcomer_shards)} 个分片")
+
+    if failures:
+        print("  失败:")
+        for failure in failures:
+            print(f"    {failure}")
+        return 1
+    print("  租约协议检查全部通过")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
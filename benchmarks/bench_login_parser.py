@@ -0,0 +1,51 @@
+"""登录页面解析微基准
+对比正则快速路径与完整 BeautifulSoup 解析在已保存登录页面上的单次 CPU 耗时
+
+用法（在项目根目录运行）：
+    python benchmarks/bench_login_parser.py [--number 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from login_page_parser import fast_extract, soup_extract  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def _cpu_time_per_call(func, page: str, number: int) -> float:
+    """测量 func(page) 的平均 CPU 耗时（微秒）"""
+    func(page)  # 预热
+    start = time.process_time()
+    for _ in range(number):
+        func(page)
+    return (time.process_time() - start) / number * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="登录页面解析微基准")
+    parser.add_argument("--number", type=int, default=200, help="每个页面每种解析方式的重复次数")
+    args = parser.parse_args()
+
+    fixtures = sorted(f for f in os.listdir(FIXTURE_DIR) if f.endswith(".html"))
+    print(f"{'fixture':<32}{'soup(us)':>12}{'fast(us)':>12}{'saved(us)':>12}{'speedup':>10}")
+    for name in fixtures:
+        with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+            page = f.read()
+
+        if fast_extract(page) != soup_extract(page):
+            print(f"{name:<32}快速路径与完整解析结果不一致")
+            return 1
+
+        soup_us = _cpu_time_per_call(soup_extract, page, args.number)
+        fast_us = _cpu_time_per_call(fast_extract, page, args.number)
+        print(f"{name:<32}{soup_us:>12.1f}{fast_us:>12.1f}{soup_us - fast_us:>12.1f}{soup_us / fast_us:>9.0f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""通知合并基准
+模拟多个账户在同一时间段内产生大量通知（成绩提醒立即发送，电费提醒与其他通知按窗口合并），
+对比不合并与合并时的 SMTP 发送次数，并核对每条通知都出现在发出的邮件中
+
+用法（在项目根目录运行）：
+    python benchmarks/bench_notification_coalescer.py [--recipients 200] [--per-recipient 6] [--window 1]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logger import get_logger  # noqa: E402
+from notification_coalescer import NotificationCoalescer  # noqa: E402
+from operations import Operation, OperationManager  # noqa: E402
+
+
+class _CountingOperation(Operation):
+    """记录发出的邮件，不连接 SMTP 服务器"""
+
+    def __init__(self):
+        self.sent = []
+
+    def execute(self, subject: str, content: str, to: str | None = None, category: str | None = None) -> bool:
+        self.sent.append((to, subject, content))
+        return True
+
+
+def _workload(recipients: int, per_recipient: int, seed: int = 0) -> list:
+    """生成通知序列 [(类别, 主题, 内容, 收件人)]：每个收件人一条成绩提醒，其余为电费提醒和其他通知"""
+    rng = random.Random(seed)
+    notifications = []
+    for r in range(recipients):
+        to = f"user{r}@example.com"
+        notifications.append(("grades", f"成绩提醒 {r}", f"成绩内容 {r}", to))
+        for i in range(per_recipient - 1):
+            category = "balance" if i % 2 == 0 else None
+            notifications.append((category, f"通知 {r}-{i}", f"通知内容 {r}-{i}", to))
+    rng.shuffle(notifications)
+    return notifications
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="通知合并基准")
+    parser.add_argument("--recipients", type=int, default=200, help="收件人数")
+    parser.add_argument("--per-recipient", type=int, default=6, help="每个收件人的通知数")
+    parser.add_argument("--window", type=float, default=1, help="电费提醒的合并窗口（秒），其他通知为其一半")
+    args = parser.parse_args()
+    get_logger().set_record_sink(lambda level, msg: None)
+    notifications = _workload(args.recipients, args.per_recipient)
+
+    # 不合并：每条通知一封邮件
+    plain = OperationManager()
+    plain_operation = _CountingOperation()
+    plain.register_operation("email", plain_operation)
+    for category, subject, content, to in notifications:
+        plain.send_email(subject, content, to=to, category=category)
+
+    # 合并：成绩立即发送，电费提醒与其他通知按窗口合并
+    manager = OperationManager()
+    operation = _CountingOperation()
+    manager.register_operation("email", operation)
+    coalescer = NotificationCoalescer({"grades": 0, "balance": args.window, "default": args.window / 2})
+    manager.set_coalescer(coalescer)
+    started = time.perf_counter()
+    for category, subject, content, to in notifications:
+        manager.send_email(subject, content, to=to, category=category)
+    submit_us = (time.perf_counter() - started) / len(notifications) * 1e6
+    time.sleep(args.window + 0.5)
+    stats = manager.get_notification_stats()["coalescer"]
+
+    print(f"{len(notifications)} 条通知，{args.recipients} 个收件人，合并窗口 {args.window:g}s")
+    print(f"  不合并: {len(plain_operation.sent)} 次发送")
+    print(f"  合并:   {len(operation.sent)} 次发送，节省 {stats['saved']} 次，提交 {submit_us:.1f}us/条")
+    print(f"  统计: {stats}")
+
+    # 核对：每条通知的内容都出现在发给其收件人的邮件中，且没有暂存残留
+    delivered = {}
+    for to, _, content in operation.sent:
+        delivered.setdefault(to, []).append(content)
+    missing = [
+        subject for _, subject, content, to in notifications
+        if not any(content in sent for sent in delivered.get(to, []))
+    ]
+    expected_sends = 2 * args.recipients if args.per_recipient > 1 else args.recipients
+    if missing or stats["pending"] or len(operation.sent) != expected_sends:
+        print(f"  失败: 缺少 {len(missing)} 条通知，暂存 {stats['pending']} 条，"
+              f"发送 {len(operation.sent)} 次（预期 {expected_sends} 次）")
+        return 1
+    print("  每条通知都已送达，每个收件人一封成绩提醒加一封汇总")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""通知发送队列基准
+对比应用线程同步发送（等待 SMTP）与写入发送队列的耗时，并核对：
+- 队列中的通知全部由后台线程投递
+- 进程重启（未投递时关闭队列再打开）后通知不丢失
+- 持续失败的通知写入死信文件
+--smtp-ms 为模拟的单封邮件发送耗时
+
+用法（在项目根目录运行）：
+    python benchmarks/bench_notification_queue.py [--messages 2000] [--smtp-ms 20] [--workers 4]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logger import get_logger  # noqa: E402
+from notification_queue import NotificationQueue  # noqa: E402
+from resilience import RetryPolicy  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="通知发送队列基准")
+    parser.add_argument("--messages", type=int, default=2000, help="通知数")
+    parser.add_argument("--smtp-ms", type=float, default=20, help="模拟的单封邮件发送耗时（毫秒）")
+    parser.add_argument("--workers", type=int, default=4, help="投递线程数")
+    args = parser.parse_args()
+    get_logger().set_record_sink(lambda level, msg: None)
+    directory = tempfile.mkdtemp(prefix="bench-notify-")
+    smtp_seconds = args.smtp_ms / 1000
+    delivered = []
+
+    def deliver(operation, subject, content, to, category) -> bool:
+        time.sleep(smtp_seconds)
+        delivered.append(subject)
+        return True
+
+    failures = []
+    content = "课程：高等数学\n成绩：95\n\n此为系统自动提醒邮件，请勿回复。"
+
+    # 同步发送：应用线程等待每封邮件发送完成（只测前 100 封，避免耗时过长）
+    sync_count = min(args.messages, 100)
+    started = time.perf_counter()
+    for i in range(sync_count):
+        deliver("email", f"同步 {i}", content, None, None)
+    sync_us = (time.perf_counter() - started) / sync_count * 1e6
+    delivered.clear()
+
+    # 写入队列：先不启动投递线程，关闭后重新打开，模拟进程在投递前重启
+    spool_path = os.path.join(directory, "spool.db")
+    queue = NotificationQueue(spool_path, workers=args.workers)
+    started = time.perf_counter()
+    for i in range(args.messages):
+        queue.enqueue("email", f"通知 {i}", content)
+    enqueue_us = (time.perf_counter() - started) / args.messages * 1e6
+    queue.close()
+
+    queue = NotificationQueue(spool_path, workers=args.workers)
+    recovered = queue.pending
+    started = time.perf_counter()
+    queue.start(deliver)
+    drained = queue.drain(timeout=args.messages * smtp_seconds + 30)
+    drain_seconds = time.perf_counter() - started
+    queue.close()
+    if recovered != args.messages:
+        failures.append(f"重启后恢复 {recovered} 条，预期 {args.messages} 条")
+    if not drained or sorted(delivered) != sorted(f"通知 {i}" for i in range(args.messages)):
+        failures.append(f"投递 {len(delivered)} 条，预期 {args.messages} 条且不重复")
+
+    # 持续失败：重试 3 次后写入死信文件
+    dead_queue = NotificationQueue(
+        os.path.join(directory, "dead.db"), workers=1,
+        retry_policy=RetryPolicy(base_delay=0.01, max_delay=0.05), max_attempts=3,
+    )
+    dead_queue.enqueue("email", "无法投递", content)
+    dead_queue.start(lambda *_: False)
+    deadline = time.monotonic() + 10
+    while dead_queue.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    dead_queue.close()
+    if dead_queue.stats["dead"] != 1 or not os.path.exists(dead_queue.dead_letter_path):
+        failures.append("持续失败的通知未写入死信文件")
+
+    print(f"{args.messages} 条通知，模拟 SMTP {args.smtp_ms:g}ms/封，{args.workers} 个投递线程")
+    print(f"  同步发送: {sync_us:.0f}us/封（应用线程等待）")
+    print(f"  写入队列: {enqueue_us:.1f}us/封（已落盘），加速 {sync_us / enqueue_us:.0f}x")
+    print(f"  重启后恢复 {recovered} 条，后台投递完成耗时 {drain_seconds:.2f}s")
+    print(f"  死信: {dead_queue.stats}")
+    if failures:
+        for failure in failures:
+            print(f"  失败: {failure}")
+        return 1
+    print("  检查全部通过")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""调度器虚拟时间基准
+在虚拟时钟上回放大量任务的调度（默认 10000 个任务、一周），统计调度器每次触发的开销、
+启动延迟，并核对各任务的触发次数是否符合定时策略
+
+用法（在项目根目录运行）：
+    python benchmarks/bench_scheduler_sim.py [--tasks 10000] [--days 7] [--interval 1800] [--task-seconds 0]
+"""
+
+import argparse
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from clock import VirtualClock, get_clock, use_clock  # noqa: E402
+from logger import get_logger  # noqa: E402
+from scheduler import CronPolicy, IntervalPolicy, Scheduler  # noqa: E402
+from simulation import SchedulerSimulation  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="调度器虚拟时间基准")
+    parser.add_argument("--tasks", type=int, default=10000, help="任务数（一半间隔策略，一半每日 Cron）")
+    parser.add_argument("--days", type=float, default=7, help="模拟天数")
+    parser.add_argument("--interval", type=int, default=1800, help="间隔策略的间隔秒数")
+    parser.add_argument("--task-seconds", type=float, default=0, help="每个任务模拟的执行耗时（虚拟秒）")
+    args = parser.parse_args()
+    # 添加任务的日志不输出（模拟期间由 SchedulerSimulation 静默）
+    get_logger().set_record_sink(lambda level, msg: None)
+
+    # 从本地时间零点开始，便于核对每日 Cron 的触发次数
+    start = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    clock = VirtualClock(start)
+    scheduler = Scheduler()
+
+    def task() -> bool:
+        if args.task_seconds:
+            get_clock().sleep(args.task_seconds)
+        return True
+
+    simulation = SchedulerSimulation(scheduler, clock)
+    interval_tasks = args.tasks // 2
+    with use_clock(clock):
+        for i in range(interval_tasks):
+            scheduler.add_task(f"interval-{i}", task, IntervalPolicy(args.interval, spread=True))
+        for i in range(args.tasks - interval_tasks):
+            scheduler.add_task(f"cron-{i}", task, CronPolicy(8, 30, catch_up="skip", spread_seconds=3600))
+
+    duration = args.days * 86400
+    result = simulation.run(duration)
+
+    print(f"模拟 {args.days:g} 天，{args.tasks} 个任务")
+    print(f"  触发次数: {result['fires']}，耗时 {result['wall_seconds']:.2f}s，"
+          f"每次触发 {result['overhead_us_per_fire']:.1f}us")
+    print(f"  每任务触发次数: {result['fires_per_task']}")
+    print(f"  启动延迟（虚拟秒）: {result['latency']}")
+
+    # 核对触发次数：错峰间隔任务每个周期一次；Cron 每天 08:30 后一小时内一次
+    expected_interval = {int(duration // args.interval), int(duration // args.interval) + 1}
+    expected_cron = {int(args.days), int(args.days) + 1} if args.days % 1 else {int(args.days)}
+    mismatched = [
+        name for name, count in simulation.fire_counts.items()
+        if count not in (expected_interval if name.startswith("interval-") else expected_cron)
+    ]
+    mismatched += [name for name in scheduler.tasks if name not in simulation.fire_counts]
+    if mismatched:
+        print(f"  触发次数不符合预期的任务: {len(mismatched)} 个，例如 {mismatched[:5]}")
+        return 1
+    print("  触发次数全部符合预期")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
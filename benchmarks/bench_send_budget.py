@@ -0,0 +1,114 @@
+"""发送额度基准
+不连接 SMTP 服务器（发件账户的连接池替换为模拟发送），核对：
+- 每个发件账户受每分钟上限约束，吞吐量随发件账户数线性增长
+- 每日配额按优先级保留余量：汇总邮件、普通通知用完各自份额后，告警邮件仍能发出
+- least_loaded 按当日配额使用比例分配，各账户使用比例接近
+--smtp-ms 为模拟的单封邮件发送耗时
+
+用法（在项目根目录运行）：
+    python benchmarks/bench_send_budget.py [--senders 1,2,4] [--per-minute 600] [--messages 60] [--smtp-ms 5]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logger import get_logger  # noqa: E402
+from operations import EmailOperation, SMTPSender  # noqa: E402
+from send_budget import SendBudget  # noqa: E402
+
+
+class _FakePool:
+    """模拟 SMTP 连接池：按固定耗时"发送"并记录次数"""
+
+    def __init__(self, smtp_seconds: float):
+        self.smtp_seconds = smtp_seconds
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def sendmail(self, from_addr, recipients, message) -> dict:
+        time.sleep(self.smtp_seconds)
+        with self._lock:
+            self.sent += 1
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+def _operation(count: int, smtp_seconds: float, selection: str = "round_robin", **budget) -> EmailOperation:
+    """创建含 count 个模拟发件账户的邮件操作，每个账户使用相同的额度参数"""
+    senders = [
+        SMTPSender(
+            f"sender{i}@example.com", "password", budget=SendBudget(f"bench:{selection}:{count}:{i}", **budget),
+            pool=_FakePool(smtp_seconds),
+        )
+        for i in range(count)
+    ]
+    return EmailOperation("", "", "to@example.com", senders=senders, selection=selection, max_wait=60)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="发送额度基准")
+    parser.add_argument("--senders", default="1,2,4", help="发件账户数（逗号分隔）")
+    parser.add_argument("--per-minute", type=float, default=600, help="每个账户每分钟发送上限")
+    parser.add_argument("--messages", type=int, default=60, help="每组发送的邮件数")
+    parser.add_argument("--smtp-ms", type=float, default=5, help="模拟的单封邮件发送耗时（毫秒）")
+    args = parser.parse_args()
+    get_logger().set_record_sink(lambda level, msg: None)
+    smtp_seconds = args.smtp_ms / 1000
+    failures = []
+
+    # 吞吐量：突发 1 封，之后每个账户按每分钟上限发送
+    print(f"{args.messages} 封邮件，每个账户每分钟 {args.per_minute:g} 封，模拟 SMTP {args.smtp_ms:g}ms/封")
+    baseline = None
+    for count in [int(n) for n in args.senders.split(",")]:
+        operation = _operation(count, smtp_seconds, per_minute=args.per_minute, burst=1)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=4 * count) as executor:
+            results = list(executor.map(
+                lambda i: operation.execute(f"通知 {i}", "内容", category="grades"), range(args.messages)
+            ))
+        elapsed = time.perf_counter() - started
+        throughput = args.messages / elapsed * 60
+        baseline = baseline or throughput / count
+        per_sender = [sender.pool.sent for sender in operation.senders]
+        print(f"  {count} 个账户: {throughput:.0f} 封/分钟（{throughput / baseline:.1f}x），各账户 {per_sender}")
+        if not all(results):
+            failures.append(f"{count} 个账户时有 {results.count(False)} 封未发送")
+        if throughput > count * args.per_minute * 1.2:
+            failures.append(f"{count} 个账户时吞吐量 {throughput:.0f} 封/分钟超过上限")
+
+    # 优先级余量：每日 100 封，汇总邮件最多 80 封、普通通知最多 90 封，告警可用满 100 封
+    operation = _operation(1, 0, daily_quota=100)
+    sent = {}
+    for category, attempts in (("digest", 120), ("grades", 120), ("alert", 120)):
+        sent[category] = sum(operation.execute(f"{category} {i}", "内容", category=category) for i in range(attempts))
+    print(f"  每日配额 100 封：汇总 {sent['digest']} 封，普通 {sent['grades']} 封，告警 {sent['alert']} 封")
+    if (sent["digest"], sent["grades"], sent["alert"]) != (80, 10, 10):
+        failures.append(f"优先级余量不正确: {sent}（预期汇总 80、普通 10、告警 10）")
+
+    # least_loaded：3 个账户，使用比例应接近
+    operation = _operation(3, 0, selection="least_loaded", daily_quota=100)
+    for i in range(150):
+        operation.execute(f"通知 {i}", "内容")
+    loads = [sender.budget.used_today() for sender in operation.senders]
+    print(f"  least_loaded 150 封分到 3 个账户: {loads}")
+    if max(loads) - min(loads) > 1:
+        failures.append(f"least_loaded 分配不均: {loads}")
+
+    if failures:
+        for failure in failures:
+            print(f"  失败: {failure}")
+        return 1
+    print("  检查全部通过")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""SMTP 连接池基准
+在本地启动 aiosmtpd 作为 SMTP 服务器，对比每封邮件新建连接（原 yagmail.SMTP(...).send 的方式）
+与 EmailOperation 连接池连续发送一批邮件的耗时和连接数，并检查服务器重启后连接池能自动重连。
+--handshake-ms 为每次新连接在 EHLO 时额外等待的毫秒数，模拟远程服务器的 TCP / TLS 握手与 AUTH 往返
+
+需要 aiosmtpd（仅基准使用）：pip install aiosmtpd
+
+用法（在项目根目录运行）：
+    python benchmarks/bench_smtp_pool.py [--messages 100] [--handshake-ms 50] [--threads 1]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import yagmail  # noqa: E402
+from logger import get_logger  # noqa: E402
+from operations import EmailOperation  # noqa: E402
+
+USER = "sender@example.com"
+PASSWORD = "password"
+TO = "receiver@example.com"
+
+
+class _CountingHandler:
+    """aiosmtpd 处理器：统计新连接（EHLO）与收到的邮件，新连接按 handshake 秒数延迟响应"""
+
+    def __init__(self, handshake: float):
+        self.handshake = handshake
+        self.connections = 0
+        self.messages = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        if self.handshake:
+            await asyncio.sleep(self.handshake)
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        return "250 OK"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _send_batch(send, messages: int, threads: int) -> float:
+    """发送一批邮件，返回耗时（秒）"""
+    started = time.perf_counter()
+    subjects = [f"成绩更新 {i}" for i in range(messages)]
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(send, subjects))
+    else:
+        results = [send(subject) for subject in subjects]
+    elapsed = time.perf_counter() - started
+    if not all(results):
+        raise RuntimeError(f"{results.count(False)} 封邮件发送失败")
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="SMTP 连接池基准")
+    parser.add_argument("--messages", type=int, default=100, help="每种方式发送的邮件数")
+    parser.add_argument("--handshake-ms", type=float, default=50, help="模拟每次新连接的握手与认证耗时（毫秒）")
+    parser.add_argument("--threads", type=int, default=1, help="并发发送线程数（连接池最多 2 个连接）")
+    args = parser.parse_args()
+
+    try:
+        from aiosmtpd.controller import Controller
+        from aiosmtpd.smtp import AuthResult
+    except ImportError:
+        print("需要 aiosmtpd：pip install aiosmtpd")
+        return 1
+
+    get_logger().set_record_sink(lambda level, msg: None)
+    # aiosmtpd 处理 AUTH 时输出的弃用提示与基准无关
+    logging.getLogger("mail.log").setLevel(logging.ERROR)
+    handler = _CountingHandler(args.handshake_ms / 1000)
+    port = _free_port()
+
+    def new_controller() -> Controller:
+        return Controller(
+            handler, hostname="127.0.0.1", port=port,
+            authenticator=lambda *_: AuthResult(success=True), auth_require_tls=False,
+        )
+
+    controller = new_controller()
+    controller.start()
+    content = "课程：高等数学\n成绩：95"
+    try:
+        # 原方式：每封邮件新建 yagmail.SMTP 并登录
+        def send_fresh(subject: str) -> bool:
+            yag = yagmail.SMTP(user=USER, password=PASSWORD, host="127.0.0.1", port=port,
+                               smtp_ssl=False, smtp_starttls=False)
+            return yag.send(to=TO, subject=subject, contents=content) == {}
+
+        fresh_seconds = _send_batch(send_fresh, args.messages, args.threads)
+        fresh_connections = handler.connections
+
+        operation = EmailOperation(USER, PASSWORD, TO, host="127.0.0.1", port=port, use_ssl=False)
+
+        def send_pooled(subject: str) -> bool:
+            return operation.execute(subject, content)
+
+        handler.connections = 0
+        pooled_seconds = _send_batch(send_pooled, args.messages, args.threads)
+        pooled_connections = handler.connections
+
+        # 服务器重启后，池中的连接已失效，下一封邮件应自动重连
+        controller.stop()
+        controller = new_controller()
+        controller.start()
+        reconnected = operation.execute("重连检查", content)
+        operation.close()
+    finally:
+        controller.stop()
+
+    print(f"发送 {args.messages} 封邮件（模拟握手 {args.handshake_ms:g}ms，{args.threads} 个线程）")
+    print(f"  每封新建连接: {fresh_seconds:.3f}s，{fresh_seconds / args.messages * 1000:.2f}ms/封，"
+          f"{fresh_connections} 次连接")
+    print(f"  连接池:       {pooled_seconds:.3f}s，{pooled_seconds / args.messages * 1000:.2f}ms/封，"
+          f"{pooled_connections} 次连接，加速 {fresh_seconds / pooled_seconds:.1f}x")
+    print(f"  连接池统计: {operation.pool.stats}")
+    print(f"  服务器重启后重连发送: {'成功' if reconnected else '失败'}")
+    expected = 2 * args.messages + 1
+    if handler.messages != expected or not reconnected:
+        print(f"  服务器收到 {handler.messages} 封，预期 {expected} 封")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Webhook 推送基准
+在本地 http.server 上模拟 Webhook 接口（每个请求固定处理耗时），对比：
+- 每条事件单独 requests.post（每次新建连接）
+- WebhookOperation 不合并（共享 keep-alive 连接池，并发受限）
+- WebhookOperation 合并批次
+并核对：接口前几个请求返回 503 时退避重试后全部送达；OperationManager 多渠道并行发送的耗时接近单个渠道
+--server-ms 为模拟的接口处理耗时，--callers 为同时调用 execute() 的线程数（相当于发送队列的投递线程数）
+
+用法（在项目根目录运行）：
+    python benchmarks/bench_webhook.py [--events 400] [--server-ms 10] [--callers 16] [--concurrency 4]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logger import get_logger  # noqa: E402
+from operations import OperationManager, WebhookOperation  # noqa: E402
+from resilience import RetryPolicy  # noqa: E402
+
+
+class _WebhookServer(ThreadingHTTPServer):
+    """记录收到的事件、请求数与连接数；前 fail_first 个请求返回 503"""
+
+    daemon_threads = True
+    # 逐条新建连接时并发连接较多，默认的监听队列（5）会导致连接被重置
+    request_queue_size = 256
+
+    def __init__(self, server_seconds: float, fail_first: int = 0):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.server_seconds = server_seconds
+        self.fail_first = fail_first
+        self.lock = threading.Lock()
+        self.subjects = []
+        self.requests = 0
+        self.connections = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/hook"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 才能保持连接
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.server_seconds)
+        with self.server.lock:
+            self.server.requests += 1
+            failing = self.server.requests <= self.server.fail_first
+            if not failing:
+                self.server.subjects.extend(event["subject"] for event in json.loads(body)["events"])
+        status = 503 if failing else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(server_seconds: float, fail_first: int = 0) -> _WebhookServer:
+    server = _WebhookServer(server_seconds, fail_first)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _run(send, events: int, callers: int) -> float:
+    """用 callers 个线程发送 events 条事件，返回耗时（秒）"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        results = list(executor.map(send, range(events)))
+    elapsed = time.perf_counter() - started
+    if not all(results):
+        raise RuntimeError(f"{results.count(False)} 条事件发送失败")
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Webhook 推送基准")
+    parser.add_argument("--events", type=int, default=400, help="事件数")
+    parser.add_argument("--server-ms", type=float, default=10, help="模拟的接口处理耗时（毫秒）")
+    parser.add_argument("--callers", type=int, default=16, help="同时调用的线程数")
+    parser.add_argument("--concurrency", type=int, default=4, help="WebhookOperation 的并发请求数")
+    args = parser.parse_args()
+    get_logger().set_record_sink(lambda level, msg: None)
+    server_seconds = args.server_ms / 1000
+    failures = []
+    expected = sorted(f"事件 {i}" for i in range(args.events))
+    print(f"{args.events} 条事件，接口处理 {args.server_ms:g}ms/请求，{args.callers} 个调用线程")
+
+    # 每条事件单独 requests.post：每次新建连接
+    server = _serve(server_seconds)
+    elapsed = _run(
+        lambda i: requests.post(server.url, json={"events": [{"subject": f"事件 {i}"}]}, timeout=10).ok,
+        args.events, args.callers,
+    )
+    print(f"  逐条 requests.post: {args.events / elapsed:.0f} 条/秒，{server.requests} 个请求，{server.connections} 个连接")
+    server.shutdown()
+
+    cases = (
+        ("连接池，不合并", dict(batch_size=1)),
+        ("连接池，合并", dict(batch_size=50, batch_window=0.02)),
+    )
+    for label, options in cases:
+        server = _serve(server_seconds)
+        operation = WebhookOperation(server.url, max_concurrency=args.concurrency, session=requests.Session(), **options)
+        elapsed = _run(lambda i: operation.execute(f"事件 {i}", "内容"), args.events, args.callers)
+        print(f"  {label}: {args.events / elapsed:.0f} 条/秒，{server.requests} 个请求，{server.connections} 个连接"
+              f"（并发上限 {args.concurrency}）")
+        if sorted(server.subjects) != expected:
+            failures.append(f"{label}: 收到 {len(server.subjects)} 条事件，预期 {args.events} 条且不重复")
+        if server.connections > args.concurrency:
+            failures.append(f"{label}: 新建 {server.connections} 个连接，超过并发上限 {args.concurrency}")
+        server.shutdown()
+
+    # 接口前 3 个请求返回 503：退避重试后全部送达
+    server = _serve(0, fail_first=3)
+    operation = WebhookOperation(
+        server.url, batch_size=10, batch_window=0.02, max_attempts=5, session=requests.Session(),
+        retry_policy=RetryPolicy(base_delay=0.05, max_delay=0.5),
+    )
+    _run(lambda i: operation.execute(f"事件 {i}", "内容"), 50, 10)
+    print(f"  503 重试: {operation.stats}")
+    if sorted(server.subjects) != sorted(f"事件 {i}" for i in range(50)) or operation.stats["retries"] < 3:
+        failures.append(f"503 重试后收到 {len(server.subjects)} 条事件，预期 50 条")
+    server.shutdown()
+
+    # 多渠道：3 个 Webhook 并行发送
+    servers = [_serve(0.2) for _ in range(3)]
+    manager = OperationManager()
+    for index, channel_server in enumerate(servers, 1):
+        manager.register_operation(
+            f"webhook{index}", WebhookOperation(channel_server.url, batch_size=1, session=requests.Session())
+        )
+    manager.set_channels(["webhook1", "webhook2", "webhook3"])
+    started = time.perf_counter()
+    sent = manager.send_email("事件 多渠道", "内容")
+    elapsed = time.perf_counter() - started
+    received = sum(len(channel_server.subjects) for channel_server in servers)
+    print(f"  3 个渠道并行发送（各 200ms）: {elapsed * 1000:.0f}ms，{received} 个渠道收到")
+    if not sent or received != 3 or elapsed > 0.5:
+        failures.append(f"多渠道并行发送耗时 {elapsed:.2f}s，{received} 个渠道收到")
+    manager.close()
+    for channel_server in servers:
+        channel_server.shutdown()
+
+    if failures:
+        for failure in failures:
+            print(f"  失败: {failure}")
+        return 1
+    print("  检查全部通过")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
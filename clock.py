@@ -0,0 +1,111 @@
+"""UESTC 服务系统 - 时钟
+调度器、定时策略、熔断器和日志告警聚合通过 get_clock() 读取当前时间。默认使用系统时钟；
+替换为虚拟时钟后，可以在几秒内回放数天的调度（见 simulation.py）
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class Clock(ABC):
+    """时钟基类"""
+
+    @abstractmethod
+    def time(self) -> float:
+        """当前时间戳（秒），与 time.time() 含义相同"""
+        pass
+
+    @abstractmethod
+    def sleep(self, seconds: float) -> None:
+        """等待指定秒数"""
+        pass
+
+
+class SystemClock(Clock):
+    """系统时钟"""
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """虚拟时钟：时间只在调用 advance() / advance_to() / sleep() 时前进（线程安全）"""
+
+    def __init__(self, start: Optional[float] = None):
+        """初始化虚拟时钟
+
+        Args:
+            start: 起始时间戳，默认为当前系统时间
+        """
+        self._now = time.time() if start is None else float(start)
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        """虚拟等待：直接把时间向前推进，用于模拟任务耗时"""
+        self.advance(seconds)
+
+    def advance(self, seconds: float) -> float:
+        """将时间向前推进指定秒数
+
+        Returns:
+            推进后的时间戳
+        """
+        if seconds < 0:
+            raise ValueError("虚拟时间不能倒退")
+        with self._lock:
+            self._now += seconds
+            return self._now
+
+    def advance_to(self, timestamp: float) -> float:
+        """将时间推进到指定时间戳（早于当前时间时不变）
+
+        Returns:
+            推进后的时间戳
+        """
+        with self._lock:
+            if timestamp > self._now:
+                self._now = timestamp
+            return self._now
+
+
+# 全局时钟实例
+_global_clock: Clock = SystemClock()
+
+
+def get_clock() -> Clock:
+    """获取全局时钟实例
+
+    Returns:
+        Clock 实例，默认为系统时钟
+    """
+    return _global_clock
+
+
+def set_clock(clock: Optional[Clock]) -> None:
+    """替换全局时钟
+
+    Args:
+        clock: 新的时钟，传 None 恢复系统时钟
+    """
+    global _global_clock
+    _global_clock = clock or SystemClock()
+
+
+@contextmanager
+def use_clock(clock: Clock) -> Iterator[Clock]:
+    """在上下文内临时使用指定时钟，退出时恢复原时钟"""
+    previous = get_clock()
+    set_clock(clock)
+    try:
+        yield clock
+    finally:
+        set_clock(previous)
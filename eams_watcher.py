@@ -1,87 +1,182 @@
 """UESTC 成绩监控应用"""
 
+import asyncio
 import hashlib
 import json
+import os
 import urllib.parse
 from typing import List, Set, Dict, Optional
-from application import Application
+from application import Application, Flow, IOStep
+from lease import LeaseLostError, current_fence
+from sent_history import SentHistoryStore
 from UESTCAccount import UESTCAccount
 
 
 class EamsWatcherApp(Application):
     """EAMS 成绩监控应用，当有新成绩发布时发送邮件提醒"""
     
+    HOSTS = ("idas.uestc.edu.cn", "eamsapp.uestc.edu.cn")
+    NOTIFY_CATEGORY = "grades"
     API_URL = "https://eamsapp.uestc.edu.cn/api/ydzc-app/grade/student"
+    AUTH_URL = "https://idas.uestc.edu.cn/authserver/login?service=https%3A%2F%2Feamsapp.uestc.edu.cn%2Fapi%2Fblade-auth%2Fcas-login%3FredirectUrl%3Dhttps%3A%2F%2Feamsapp.uestc.edu.cn"
     HISTORY_FILE = "sent_grades.json"
+    # bearer token 缓存有效期（秒），期间成绩查询只需一次 API 请求
+    TOKEN_TTL = 30 * 60
     
-    def __init__(self, account: UESTCAccount, history_file: Optional[str] = None):
+    def __init__(self, account: UESTCAccount, history_file: Optional[str] = None,
+                 history_store: Optional[SentHistoryStore] = None):
         """初始化成绩监控应用
         
         Args:
             account: 共享的 UESTCAccount 实例
-            history_file: 历史记录文件路径（可选）
+            history_file: 历史记录文件路径（可选；提供 history_store 时仅用于首次导入旧记录）
+            history_store: 已发送记录存储（可选），多节点共用时接管账户的节点据此不重复发送
         """
         super().__init__("EamsWatcher", account)
         self.history_file = history_file or self.HISTORY_FILE
+        self.history_store = history_store
+        self.history_scope = f"EamsWatcher:{account.username}"
         self.sent_grades: Set[str] = self._load_sent_grades()
     
-    def _get_bearer_token(self) -> Optional[str]:
-        """获取 EAMS API 的 Bearer Token
+    def _extract_bearer_token(self, final_url: str) -> Optional[str]:
+        """从 CAS 重定向链的最终 URL 中提取 Bearer Token
+        
+        Args:
+            final_url: 重定向完成后的 URL
+            
+        Returns:
+            Bearer token 字符串，提取失败返回 None
+        """
+        parsed = urllib.parse.urlparse(final_url)
+        params = urllib.parse.parse_qs(parsed.query)
+        
+        jsessionid = None
+        if 'jsessionid' in params:
+            jsessionid = params['jsessionid'][0]
+        elif 'jsessionid' in parsed.path:
+            jsessionid = parsed.path.split('jsessionid=')[-1].split('&')[0]
+        
+        if jsessionid:
+            return f"bearer {jsessionid}"
+        else:
+            self.log_warning(f"未能在最终URL中提取jsessionid: {final_url}")
+            return None
+    
+    def _parse_grades_response(self, data: Dict) -> List[Dict]:
+        """解析成绩 API 的响应
+        
+        Args:
+            data: API 返回的 JSON 数据
+            
+        Returns:
+            成绩数据列表，响应异常返回空列表
+        """
+        if data.get("code") == 200 and data.get("success"):
+            return data.get("data", [])
+        else:
+            self.log_warning(f"API 返回异常: {data}")
+            return []
+    
+    def _is_auth_failure(self, status_code: int, data: Optional[Dict]) -> bool:
+        """判断成绩 API 的响应是否为鉴权失败（token 过期）"""
+        if status_code == 401:
+            return True
+        return isinstance(data, dict) and data.get("code") == 401
+    
+    def _request_bearer_token(self) -> Optional[str]:
+        """走完整的 CAS 重定向链获取 Bearer Token
         
         Returns:
             Bearer token 字符串，获取失败返回 None
         """
         try:
-            auth_url = "https://idas.uestc.edu.cn/authserver/login?service=https%3A%2F%2Feamsapp.uestc.edu.cn%2Fapi%2Fblade-auth%2Fcas-login%3FredirectUrl%3Dhttps%3A%2F%2Feamsapp.uestc.edu.cn"
-            
-            resp = self.account.session.get(auth_url, allow_redirects=True, timeout=15)
-            final_url = resp.url
-            
-            parsed = urllib.parse.urlparse(final_url)
-            params = urllib.parse.parse_qs(parsed.query)
-            
-            jsessionid = None
-            if 'jsessionid' in params:
-                jsessionid = params['jsessionid'][0]
-            elif 'jsessionid' in parsed.path:
-                jsessionid = parsed.path.split('jsessionid=')[-1].split('&')[0]
-            
-            if jsessionid:
-                return f"bearer {jsessionid}"
-            else:
-                self.log_warning(f"未能在最终URL中提取jsessionid: {final_url}")
-                return None
+            resp = self.account.session.get(self.AUTH_URL, allow_redirects=True, timeout=15)
+            return self._extract_bearer_token(resp.url)
         
         except Exception as e:
             self.log_error(f"获取 bearer token 失败: {e}")
             return None
     
+    def _get_bearer_token(self) -> Optional[str]:
+        """获取 EAMS API 的 Bearer Token（优先使用账户的服务票据缓存）
+        
+        Returns:
+            Bearer token 字符串，获取失败返回 None
+        """
+        return self.account.ticket_cache.get(self.AUTH_URL, self._request_bearer_token, ttl=self.TOKEN_TTL)
+    
+    def _grades_flow(self) -> Flow[List[Dict]]:
+        """成绩查询流程（同步与异步版本共用）
+        
+        缓存的 token 被服务端拒绝（401）时作废缓存，重新获取 token 后重试一次。
+        
+        Returns:
+            成绩数据列表，获取失败返回空列表
+        """
+        for attempt in range(2):
+            blade_auth = yield IOStep(self._get_bearer_token, self._aget_bearer_token)
+            if not blade_auth:
+                self.log_warning("无法获取 blade-auth，跳过本次查询")
+                return []
+            
+            headers = {"blade-auth": blade_auth}
+            try:
+                resp = yield self.http_get(self.API_URL, headers=headers, timeout=10)
+                data = None
+                if resp.status_code != 401:
+                    resp.raise_for_status()
+                    data = resp.json()
+                if self._is_auth_failure(resp.status_code, data):
+                    self.account.ticket_cache.invalidate(self.AUTH_URL)
+                    if attempt == 0:
+                        self.log_info("blade-auth 已失效，重新获取")
+                        continue
+                    self.log_warning("重新获取的 blade-auth 仍被拒绝")
+                    return []
+                return self._parse_grades_response(data)
+            
+            except Exception as e:
+                self.log_error(f"请求成绩 API 失败: {e}")
+                return []
+        return []
+    
     def _fetch_grades(self) -> List[Dict]:
-        """从 EAMS API 获取成绩数据
+        """从 EAMS API 获取成绩数据（见 _grades_flow）
         
         Returns:
             成绩数据列表，获取失败返回空列表
         """
-        blade_auth = self._get_bearer_token()
-        if not blade_auth:
-            self.log_warning("无法获取 blade-auth，跳过本次查询")
-            return []
+        return self.run_flow(self._grades_flow())
+    
+    async def _arequest_bearer_token(self) -> Optional[str]:
+        """异步走完整的 CAS 重定向链获取 Bearer Token
         
-        headers = {"blade-auth": blade_auth}
+        Returns:
+            Bearer token 字符串，获取失败返回 None
+        """
         try:
-            resp = self.account.session.get(self.API_URL, headers=headers, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-            
-            if data.get("code") == 200 and data.get("success"):
-                return data.get("data", [])
-            else:
-                self.log_warning(f"API 返回异常: {data}")
-                return []
+            resp = await self.account.client.get(self.AUTH_URL, follow_redirects=True, timeout=15)
+            return self._extract_bearer_token(str(resp.url))
         
         except Exception as e:
-            self.log_error(f"请求成绩 API 失败: {e}")
-            return []
+            self.log_error(f"获取 bearer token 失败: {e}")
+            return None
+    
+    async def _aget_bearer_token(self) -> Optional[str]:
+        """异步获取 EAMS API 的 Bearer Token（优先使用账户的服务票据缓存）
+        
+        Returns:
+            Bearer token 字符串，获取失败返回 None
+        """
+        return await self.account.ticket_cache.aget(self.AUTH_URL, self._arequest_bearer_token, ttl=self.TOKEN_TTL)
+    
+    async def _afetch_grades(self) -> List[Dict]:
+        """异步从 EAMS API 获取成绩数据（见 _grades_flow）
+        
+        Returns:
+            成绩数据列表，获取失败返回空列表
+        """
+        return await self.arun_flow(self._grades_flow())
     
     def _generate_grade_checksum(self, grade: Dict) -> str:
         """生成成绩记录的校验值
@@ -101,12 +196,23 @@ class EamsWatcherApp(Application):
         return hashlib.md5(checksum_str.encode()).hexdigest()
     
     def _load_sent_grades(self) -> Set[str]:
-        """从历史文件中加载已发送的成绩校验值
+        """加载已发送的成绩校验值（优先从已发送记录存储读取）
         
         Returns:
             已发送成绩校验值的集合
         """
-        import os
+        if self.history_store is None:
+            return self._read_history_file()
+        sent = self.history_store.load(self.history_scope)
+        if not sent:
+            # 首次使用共享存储：导入旧的历史文件
+            sent = self._read_history_file()
+            if sent:
+                self.history_store.add(self.history_scope, sent)
+        return sent
+    
+    def _read_history_file(self) -> Set[str]:
+        """从历史文件中读取已发送的成绩校验值"""
         if not os.path.exists(self.history_file):
             return set()
         
@@ -117,8 +223,19 @@ class EamsWatcherApp(Application):
             self.log_warning(f"读取历史文件失败: {e}")
             return set()
     
-    def _save_sent_grades(self) -> None:
-        """保存已发送的成绩校验值到历史文件"""
+    def _save_sent_grades(self, checksums: Set[str]) -> None:
+        """保存已发送的成绩校验值（已发送记录存储中追加本次发送的记录，否则整体写入历史文件）
+        
+        Args:
+            checksums: 本次发送的成绩校验值
+            
+        Raises:
+            LeaseLostError: 写入记录存储时账户所属分片的租约已易主
+        """
+        if self.history_store is not None:
+            if not self.history_store.add(self.history_scope, checksums, fence=current_fence()):
+                raise LeaseLostError(f"账户 {self.account.username} 的分片租约已易主，成绩记录未写入")
+            return
         try:
             with open(self.history_file, "w", encoding="utf-8") as f:
                 json.dump(list(self.sent_grades), f, ensure_ascii=False, indent=2)
@@ -152,25 +269,31 @@ class EamsWatcherApp(Application):
         lines.append("\n\n此为系统自动提醒邮件，请勿回复。")
         return "\n".join(lines)
     
-    def run(self) -> bool:
-        """运行成绩监控应用
+    def _process_grades(self, grades: List[Dict]) -> bool:
+        """识别新成绩并发送提醒
         
+        Args:
+            grades: 获取到的成绩列表
+            
         Returns:
-            运行成功返回 True，失败返回 False
+            处理成功返回 True，失败返回 False
         """
-        self.log_info("开始检查成绩...")
-        
-        grades = self._fetch_grades()
         if not grades:
             self.log_info("未获取到成绩数据")
             return False
         
+        if self.history_store is not None:
+            # 其他节点（接管前的持有者）可能已写入新的记录
+            self.sent_grades = self._load_sent_grades()
+        
         # 识别新成绩
         new_grades = []
+        new_checksums = set()
         for grade in grades:
             grade_checksum = self._generate_grade_checksum(grade)
             if grade_checksum not in self.sent_grades:
                 new_grades.append(grade)
+                new_checksums.add(grade_checksum)
                 self.sent_grades.add(grade_checksum)
         
         if new_grades:
@@ -179,7 +302,7 @@ class EamsWatcherApp(Application):
             content = self._build_email_content(new_grades)
             
             if self.send_email(subject, content):
-                self._save_sent_grades()
+                self._save_sent_grades(new_checksums)
                 self.log_success("成绩提醒已发送")
                 return True
             else:
@@ -190,3 +313,26 @@ class EamsWatcherApp(Application):
         else:
             self.log_info("暂无新成绩")
             return True
+    
+    def run(self) -> bool:
+        """运行成绩监控应用
+        
+        Returns:
+            运行成功返回 True，失败返回 False
+        """
+        self.log_info("开始检查成绩...")
+        return self._process_grades(self._fetch_grades())
+    
+    async def run_async(self) -> bool:
+        """异步运行成绩监控应用（账户需为 AsyncUESTCAccount）
+        
+        Returns:
+            运行成功返回 True，失败返回 False
+        """
+        if not hasattr(self.account, "client"):
+            return await super().run_async()
+        
+        self.log_info("开始检查成绩...")
+        grades = await self._afetch_grades()
+        # 发送邮件、写历史文件为阻塞操作，放到线程池执行
+        return await asyncio.to_thread(self._process_grades, grades)
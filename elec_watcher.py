@@ -1,8 +1,9 @@
 """UESTC 宿舍用电监控应用"""
 
+import asyncio
 import json
 from datetime import date, datetime
-from application import Application
+from application import Application, Flow, IOStep
 from UESTCAccount import UESTCAccount
 
 
@@ -11,6 +12,11 @@ class ElecWatcherApp(Application):
     失败提醒策略：只有在一天内一次也没有成功获取数据时，才发送邮件告警
     """
 
+    HOSTS = ("idas.uestc.edu.cn", "online.uestc.edu.cn")
+    NOTIFY_CATEGORY = "balance"
+    # 会话刷新结果的缓存有效期（秒），期间查询电费无需再走 CAS 重定向
+    REFRESH_TTL = 10 * 60
+
     def __init__(self, account: UESTCAccount, threshold: float = 10.0):
         """初始化电费监控应用
 
@@ -28,50 +34,128 @@ class ElecWatcherApp(Application):
         self._daily_failure_alert_sent_date: date | None = None  # 当天已发送失败告警的日期
         self._daily_alert_cutoff_hour: int = 20  # 每天超过此时间(20点)仍未成功则发送告警
     
-    def _refresh_session(self) -> bool:
-        """刷新会话令牌
+    def _request_session_refresh(self) -> bool:
+        """走 CAS 重定向刷新 online.uestc.edu.cn 的会话
         失败时使用 log_info 而非 log_error/log_warning，避免每次失败都触发邮件告警
 
         Returns:
-            刷新成功返回 True，失败返回 False
+            刷新成功返回 True（票据缓存记录为已刷新），失败返回 False
         """
         try:
-            refresh_response = self.account.session.get(self.refresh_url)
+            refresh_response = self.account.session.get(self.refresh_url, timeout=15)
             if refresh_response.status_code != 200:
                 self.log_info("会话刷新失败，尝试重新登录")
-                if not self.account.login():
+                if not self.account.refresh_login():
                     self.log_info("重新登录失败")
                     return False
             return True
         except Exception as e:
             self.log_info(f"刷新会话异常: {e}")
             return False
+
+    def _refresh_session(self) -> bool:
+        """刷新会话令牌（有效期内复用账户服务票据缓存中的刷新结果）
+
+        Returns:
+            刷新成功返回 True，失败返回 False
+        """
+        return bool(self.account.ticket_cache.get(self.refresh_url, self._request_session_refresh, ttl=self.REFRESH_TTL))
+
+    def _is_session_expired(self, status_code: int, text: str) -> bool:
+        """判断用电数据接口的响应是否表明会话已失效（被重定向到统一身份认证）"""
+        return status_code in (401, 403) or "统一身份认证" in text
     
-    def _fetch_power_data(self) -> dict:
-        """获取宿舍用电数据
+    def _parse_power_response(self, status_code: int, text: str) -> dict:
+        """解析用电数据接口的响应
         失败时使用 log_info 而非 log_error，避免每次失败都触发邮件告警
 
+        Args:
+            status_code: 响应状态码
+            text: 响应正文
+
         Returns:
-            包含电费数据的字典，获取失败返回空字典
+            包含电费数据的字典，解析失败返回空字典
         """
-        try:
-            if not self._refresh_session():
-                return {}
-
-            response = self.account.session.get(self.power_url, timeout=10)
-            if response.status_code != 200:
-                self.log_info(f"请求失败，状态码: {response.status_code}")
-                return {}
+        if status_code != 200:
+            self.log_info(f"请求失败，状态码: {status_code}")
+            return {}
 
-            data = json.loads(response.text)
-            print(data)
-            return data
+        try:
+            data = json.loads(text)
         except json.JSONDecodeError as e:
             self.log_info(f"JSON 解析失败: {e}")
             return {}
+        print(data)
+        return data
+
+    def _power_flow(self) -> Flow[dict]:
+        """用电数据查询流程（同步与异步版本共用）
+        失败时使用 log_info 而非 log_error，避免每次失败都触发邮件告警
+        缓存的会话被拒绝时作废缓存，重新刷新会话后重试一次。
+
+        Returns:
+            包含电费数据的字典，获取失败返回空字典
+        """
+        try:
+            for attempt in range(2):
+                if not (yield IOStep(self._refresh_session, self._arefresh_session)):
+                    return {}
+
+                response = yield self.http_get(self.power_url, timeout=10)
+                if self._is_session_expired(response.status_code, response.text):
+                    self.account.ticket_cache.invalidate(self.refresh_url)
+                    if attempt == 0:
+                        self.log_info("会话已失效，重新刷新会话")
+                        continue
+                return self._parse_power_response(response.status_code, response.text)
+            return {}
         except Exception as e:
             self.log_info(f"获取用电数据异常: {e}")
             return {}
+
+    def _fetch_power_data(self) -> dict:
+        """获取宿舍用电数据（见 _power_flow）
+
+        Returns:
+            包含电费数据的字典，获取失败返回空字典
+        """
+        return self.run_flow(self._power_flow())
+
+    async def _arequest_session_refresh(self) -> bool:
+        """异步刷新 online.uestc.edu.cn 的会话
+
+        Returns:
+            刷新成功返回 True，失败返回 False
+        """
+        try:
+            refresh_response = await self.account.client.get(self.refresh_url)
+            if refresh_response.status_code != 200:
+                self.log_info("会话刷新失败，尝试重新登录")
+                if not await self.account.arefresh_login():
+                    self.log_info("重新登录失败")
+                    return False
+            return True
+        except Exception as e:
+            self.log_info(f"刷新会话异常: {e}")
+            return False
+
+    async def _arefresh_session(self) -> bool:
+        """异步刷新会话令牌（有效期内复用账户服务票据缓存中的刷新结果）
+
+        Returns:
+            刷新成功返回 True，失败返回 False
+        """
+        return bool(await self.account.ticket_cache.aget(
+            self.refresh_url, self._arequest_session_refresh, ttl=self.REFRESH_TTL
+        ))
+
+    async def _afetch_power_data(self) -> dict:
+        """异步获取宿舍用电数据（见 _power_flow）
+
+        Returns:
+            包含电费数据的字典，获取失败返回空字典
+        """
+        return await self.arun_flow(self._power_flow())
     
     def _check_and_alert(self, data: dict) -> None:
         """检查余额并发送提醒
@@ -168,18 +252,15 @@ class ElecWatcherApp(Application):
             self.log_success("每日失败告警邮件已发送")
             self._daily_failure_alert_sent_date = date.today()
 
-    def run(self) -> bool:
-        """运行电费监控应用
+    def _handle_power_data(self, data: dict) -> bool:
+        """处理获取结果：成功时检查余额，失败时按需发送每日失败告警
 
-        成功时更新上次成功日期；失败时检查是否需要发送每日失败告警。
-        始终返回 True 以避免调度器层面发送额外的告警邮件。
+        Args:
+            data: 用电数据，获取失败时为空字典
 
         Returns:
             始终返回 True（告警逻辑已内部处理）
         """
-        self.log_info("开始检查宿舍用电...")
-
-        data = self._fetch_power_data()
         if not data:
             # 检查是否需要发送每日失败告警
             if self._should_send_daily_failure_alert():
@@ -191,3 +272,29 @@ class ElecWatcherApp(Application):
         self._last_success_date = date.today()
         self._check_and_alert(data)
         return True
+
+    def run(self) -> bool:
+        """运行电费监控应用
+
+        成功时更新上次成功日期；失败时检查是否需要发送每日失败告警。
+        始终返回 True 以避免调度器层面发送额外的告警邮件。
+
+        Returns:
+            始终返回 True（告警逻辑已内部处理）
+        """
+        self.log_info("开始检查宿舍用电...")
+        return self._handle_power_data(self._fetch_power_data())
+
+    async def run_async(self) -> bool:
+        """异步运行电费监控应用（账户需为 AsyncUESTCAccount）
+
+        Returns:
+            始终返回 True（告警逻辑已内部处理）
+        """
+        if not hasattr(self.account, "client"):
+            return await super().run_async()
+
+        self.log_info("开始检查宿舍用电...")
+        data = await self._afetch_power_data()
+        # 发送邮件为阻塞操作，放到线程池执行
+        return await asyncio.to_thread(self._handle_power_data, data)
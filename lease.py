@@ -0,0 +1,465 @@
+"""UESTC 服务系统 - 租约协调
+多个节点（进程或机器）共用同一组账户时，每个分片（通常为一个账户）由持有租约的节点独占执行。
+节点定期心跳并续约；分片按最高随机权重（rendezvous）哈希分配到存活节点，
+节点离开（心跳过期）后其分片由其余节点接管，新节点加入时原持有者等待分片上正在执行的任务结束后交出。
+任务执行期间的发送与状态写入以防护令牌（Fence）为条件，租约易主后旧节点的写入被拒绝
+"""
+
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from logger import get_logger
+
+
+class LeaseLostError(RuntimeError):
+    """分片租约已不由本节点以原防护令牌持有（已被其他节点接管或已交出）"""
+
+
+def ensure_lease_tables(conn: sqlite3.Connection) -> None:
+    """创建租约表（在同一文件中以防护令牌为条件写入的存储也需调用，见 Fence.SQL_CONDITION）"""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS leases ("
+        "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL, token INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS lease_nodes (node TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+
+class LeaseStore(ABC):
+    """租约存储基类。
+
+    所有时间均取存储所在机器的 time.time()；各节点的时钟偏差应远小于租约时长。
+    """
+
+    @abstractmethod
+    def acquire(self, key: str, owner: str, ttl: float) -> Optional[int]:
+        """获取租约（空闲、已过期或已由自己持有时成功，后者等同续约）
+
+        Args:
+            key: 分片名
+            owner: 节点 ID
+            ttl: 租约时长（秒）
+
+        Returns:
+            成功返回防护令牌（每次易主递增），失败返回 None
+        """
+        pass
+
+    @abstractmethod
+    def check(self, key: str, owner: str, token: int) -> bool:
+        """租约是否仍由 owner 以防护令牌 token 持有且未过期"""
+        pass
+
+    @abstractmethod
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        """续约（仅当租约仍由自己持有且未过期时成功）"""
+        pass
+
+    @abstractmethod
+    def release(self, key: str, owner: str) -> None:
+        """释放租约（仅释放自己持有的租约）"""
+        pass
+
+    @abstractmethod
+    def heartbeat(self, node: str, ttl: float) -> None:
+        """记录节点心跳，ttl 秒内未再次心跳视为离开"""
+        pass
+
+    @abstractmethod
+    def leave(self, node: str) -> None:
+        """节点主动离开：删除心跳并释放其全部租约"""
+        pass
+
+    @abstractmethod
+    def live_nodes(self) -> List[str]:
+        """获取心跳未过期的节点"""
+        pass
+
+    @abstractmethod
+    def holders(self) -> Dict[str, Tuple[str, float, int]]:
+        """获取未过期的租约 {分片: (持有节点, 到期时间戳, 防护令牌)}"""
+        pass
+
+
+class SQLiteLeaseStore(LeaseStore):
+    """基于 SQLite 文件的租约存储，同一台机器上的多个进程共享（也可放在支持文件锁的共享存储上）"""
+
+    def __init__(self, db_path: str):
+        """初始化租约存储
+
+        Args:
+            db_path: SQLite 数据库文件路径
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        ensure_lease_tables(self._conn)
+
+    def _transaction(self, func):
+        """在写事务中执行 func(cursor, now)（BEGIN IMMEDIATE 保证跨进程的读-改-写是原子的）"""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(cursor, time.time())
+                cursor.execute("COMMIT")
+                return result
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def acquire(self, key: str, owner: str, ttl: float) -> Optional[int]:
+        def _acquire(cursor, now):
+            row = cursor.execute("SELECT owner, expires_at, token FROM leases WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                token = 1
+            elif row[0] == owner and row[1] > now:
+                token = row[2]
+            elif row[1] <= now:
+                token = row[2] + 1
+            else:
+                return None
+            cursor.execute(
+                "INSERT OR REPLACE INTO leases (key, owner, expires_at, token) VALUES (?, ?, ?, ?)",
+                (key, owner, now + ttl, token),
+            )
+            return token
+        return self._transaction(_acquire)
+
+    def check(self, key: str, owner: str, token: int) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {Fence.SQL_CONDITION}", (key, owner, token, time.time())
+            ).fetchone()
+        return bool(row[0])
+
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        def _renew(cursor, now):
+            cursor.execute(
+                "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ? AND expires_at > ?",
+                (now + ttl, key, owner, now),
+            )
+            return cursor.rowcount == 1
+        return self._transaction(_renew)
+
+    def release(self, key: str, owner: str) -> None:
+        # 保留令牌计数：把租约标记为已过期，而不是删除记录
+        self._transaction(lambda cursor, now: cursor.execute(
+            "UPDATE leases SET expires_at = 0 WHERE key = ? AND owner = ?", (key, owner)
+        ))
+
+    def heartbeat(self, node: str, ttl: float) -> None:
+        self._transaction(lambda cursor, now: cursor.execute(
+            "INSERT OR REPLACE INTO lease_nodes (node, expires_at) VALUES (?, ?)", (node, now + ttl)
+        ))
+
+    def leave(self, node: str) -> None:
+        def _leave(cursor, now):
+            cursor.execute("DELETE FROM lease_nodes WHERE node = ?", (node,))
+            cursor.execute("UPDATE leases SET expires_at = 0 WHERE owner = ?", (node,))
+        self._transaction(_leave)
+
+    def live_nodes(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT node FROM lease_nodes WHERE expires_at > ? ORDER BY node", (time.time(),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def holders(self) -> Dict[str, Tuple[str, float, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, owner, expires_at, token FROM leases WHERE expires_at > ?", (time.time(),)
+            ).fetchall()
+        return {key: (owner, expires_at, token) for key, owner, expires_at, token in rows}
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        self._conn.close()
+
+
+class Fence:
+    """一次任务执行所依据的分片租约（分片、节点、防护令牌）。
+
+    任务在 fenced() 上下文中执行；发送通知前调用 check_fence()，
+    与租约同一 SQLite 文件中的写入以 SQL_CONDITION 为条件，租约易主后旧执行的写入不生效。
+    """
+
+    # 参数依次为 params() 的返回值
+    SQL_CONDITION = "EXISTS (SELECT 1 FROM leases WHERE key = ? AND owner = ? AND token = ? AND expires_at > ?)"
+
+    def __init__(self, store: LeaseStore, shard: str, owner: str, token: int):
+        self.store = store
+        self.shard = shard
+        self.owner = owner
+        self.token = token
+
+    def params(self) -> Tuple[str, str, int, float]:
+        """SQL_CONDITION 的参数"""
+        return self.shard, self.owner, self.token, time.time()
+
+    def valid(self) -> bool:
+        """租约是否仍由本节点以同一令牌持有"""
+        return self.store.check(self.shard, self.owner, self.token)
+
+    def check(self) -> None:
+        """租约已易主时抛出 LeaseLostError"""
+        if not self.valid():
+            raise LeaseLostError(f"分片 {self.shard} 的租约（令牌 {self.token}）已不由节点 {self.owner} 持有")
+
+
+# 当前执行所依据的租约（ContextVar：asyncio 任务与 asyncio.to_thread 中同样可见）
+_current_fence: ContextVar[Optional[Fence]] = ContextVar("lease_fence", default=None)
+
+
+def current_fence() -> Optional[Fence]:
+    """获取当前执行所依据的租约，不属于任何分片时返回 None"""
+    return _current_fence.get()
+
+
+@contextmanager
+def fenced(fence: Optional[Fence]) -> Iterator[None]:
+    """在上下文中以 fence 为当前执行所依据的租约（None 表示不受租约约束）"""
+    reset_token = _current_fence.set(fence)
+    try:
+        yield
+    finally:
+        _current_fence.reset(reset_token)
+
+
+def check_fence() -> None:
+    """发送或写入前核对当前租约，已易主时抛出 LeaseLostError（不受租约约束时直接返回）"""
+    fence = current_fence()
+    if fence is not None:
+        fence.check()
+
+
+def rendezvous_owner(shard: str, nodes: Iterable[str]) -> Optional[str]:
+    """按最高随机权重哈希选出分片的目标节点
+
+    节点增减时只有原属于该节点（或应迁往新节点）的分片改变归属。
+
+    Args:
+        shard: 分片名
+        nodes: 候选节点
+
+    Returns:
+        目标节点，没有候选节点时返回 None
+    """
+    best, best_weight = None, b""
+    for node in nodes:
+        weight = hashlib.blake2b(f"{node}\x1f{shard}".encode("utf-8"), digest_size=8).digest()
+        if best is None or weight > best_weight:
+            best, best_weight = node, weight
+    return best
+
+
+def default_node_id() -> str:
+    """默认节点 ID：主机名-进程号"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseCoordinator:
+    """分片租约协调器。
+
+    后台线程每 renew_interval 秒：心跳 → 按存活节点计算各分片的目标节点 →
+    获取/续约应由自己持有的分片，释放应迁往其他节点的分片。
+    owns() 只在本地记录的租约剩余时间超过 safety_margin 时返回 True，
+    因此续约线程停滞时节点会先停止执行任务，之后租约才会被其他节点接管。
+
+    应迁出的分片上还有正在执行的任务（in_flight 返回 True）时，先停止开始新任务并继续续约，
+    任务结束（或等待超过 drain_timeout）后再交出；交出前触发 on_change，此时防护令牌仍然有效。
+    """
+
+    def __init__(self, store: LeaseStore, node_id: Optional[str] = None, lease_ttl: float = 30,
+                 renew_interval: Optional[float] = None, safety_margin: Optional[float] = None,
+                 on_change: Optional[Callable[[str, bool], None]] = None,
+                 in_flight: Optional[Callable[[str], bool]] = None, drain_timeout: Optional[float] = None):
+        """初始化协调器
+
+        Args:
+            store: 租约存储
+            node_id: 本节点 ID，默认为主机名-进程号
+            lease_ttl: 租约与心跳时长（秒）
+            renew_interval: 续约间隔（秒），默认为 lease_ttl 的 1/3
+            safety_margin: 租约剩余时间低于此值时视为不再持有（秒），默认为 lease_ttl 的 1/3
+            on_change: 分片归属变化回调 (分片, 是否由本节点持有)
+            in_flight: 分片上是否有正在执行的任务，交出分片前据此等待
+            drain_timeout: 交出分片前等待任务结束的最长时间（秒），默认为 lease_ttl
+        """
+        if lease_ttl <= 0:
+            raise ValueError("租约时长必须大于 0")
+        self.store = store
+        self.node_id = node_id or default_node_id()
+        self.lease_ttl = lease_ttl
+        self.renew_interval = renew_interval or lease_ttl / 3
+        self.safety_margin = lease_ttl / 3 if safety_margin is None else safety_margin
+        if self.renew_interval + self.safety_margin >= lease_ttl:
+            raise ValueError("续约间隔与安全余量之和必须小于租约时长")
+        self.on_change = on_change
+        self.in_flight = in_flight
+        self.drain_timeout = lease_ttl if drain_timeout is None else drain_timeout
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self._shards: Set[str] = set()
+        # 本节点持有的租约 {分片: (本地到期时间 monotonic, 防护令牌)}
+        self._owned: Dict[str, Tuple[float, int]] = {}
+        # 等待任务结束后交出的分片 {分片: 最迟交出时间 monotonic}
+        self._draining: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, shard: str) -> None:
+        """登记需要协调的分片（下一轮 tick 时参与分配）"""
+        with self._lock:
+            self._shards.add(shard)
+
+    def unregister(self, shard: str) -> None:
+        """取消登记分片，已持有时释放租约"""
+        with self._lock:
+            self._shards.discard(shard)
+            owned = shard in self._owned
+        if owned:
+            self._hand_over(shard)
+
+    def owns(self, shard: str) -> bool:
+        """本节点当前是否持有分片（租约剩余时间需超过安全余量）"""
+        owned = self._owned.get(shard)
+        return (owned is not None and shard not in self._draining
+                and owned[0] - time.monotonic() > self.safety_margin)
+
+    def fencing_token(self, shard: str) -> Optional[int]:
+        """本节点持有分片的防护令牌（等待交出期间仍返回），未持有返回 None"""
+        owned = self._owned.get(shard)
+        return owned[1] if owned is not None else None
+
+    def fence(self, shard: str) -> Optional[Fence]:
+        """本节点持有分片的租约，用于限定一次任务执行的发送与写入，未持有返回 None"""
+        token = self.fencing_token(shard)
+        return Fence(self.store, shard, self.node_id, token) if token is not None else None
+
+    def owned_shards(self) -> List[str]:
+        """本节点当前持有的分片"""
+        return sorted(shard for shard in list(self._owned) if self.owns(shard))
+
+    def _notify(self, shard: str, owned: bool) -> None:
+        """触发归属变化回调并记录日志"""
+        self.logger.info(f"节点 {self.node_id} {'获得' if owned else '交出'}分片 {shard}")
+        if self.on_change:
+            try:
+                self.on_change(shard, owned)
+            except Exception as e:
+                self.logger.warning(f"分片归属变化回调异常: {e}")
+
+    def _busy(self, shard: str) -> bool:
+        """分片上是否有正在执行的任务"""
+        if self.in_flight is None:
+            return False
+        try:
+            return self.in_flight(shard)
+        except Exception as e:
+            self.logger.warning(f"检查分片 {shard} 的任务状态失败: {e}")
+            return False
+
+    def _hand_over(self, shard: str) -> None:
+        """交出分片：先触发回调（此时令牌仍有效，可写入最终状态），再释放租约"""
+        self._draining[shard] = time.monotonic()
+        self._notify(shard, False)
+        self._owned.pop(shard, None)
+        self._draining.pop(shard, None)
+        self.store.release(shard, self.node_id)
+
+    def tick(self) -> None:
+        """执行一轮心跳、分配与续约"""
+        # 先记录本地时间再访问存储，本地到期时间只会早于存储中的到期时间
+        started = time.monotonic()
+        self.store.heartbeat(self.node_id, self.lease_ttl)
+        nodes = self.store.live_nodes()
+        if self.node_id not in nodes:
+            nodes.append(self.node_id)
+        with self._lock:
+            shards = sorted(self._shards)
+
+        for shard in shards:
+            target = rendezvous_owner(shard, nodes)
+            held = shard in self._owned
+            if target == self.node_id:
+                if held and self.store.renew(shard, self.node_id, self.lease_ttl):
+                    self._owned[shard] = (started + self.lease_ttl, self._owned[shard][1])
+                    # 等待交出期间分片又归回本节点：恢复执行
+                    self._draining.pop(shard, None)
+                    continue
+                token = self.store.acquire(shard, self.node_id, self.lease_ttl)
+                if token is not None:
+                    self._owned[shard] = (started + self.lease_ttl, token)
+                    if not held:
+                        self._notify(shard, True)
+                elif held:
+                    # 续约与获取都失败：租约已被其他节点接管，正在执行的任务之后的写入会被防护令牌拒绝
+                    self._owned.pop(shard, None)
+                    self._draining.pop(shard, None)
+                    self._notify(shard, False)
+            elif held:
+                # 分片应迁往其他节点（新节点加入）：不再开始新任务，正在执行的任务结束后再交出
+                deadline = self._draining.setdefault(shard, started + self.drain_timeout)
+                if self._busy(shard) and started < deadline:
+                    if self.store.renew(shard, self.node_id, self.lease_ttl):
+                        self._owned[shard] = (started + self.lease_ttl, self._owned[shard][1])
+                    else:
+                        self._owned.pop(shard, None)
+                        self._draining.pop(shard, None)
+                        self._notify(shard, False)
+                    continue
+                self._hand_over(shard)
+
+    def _run(self) -> None:
+        """后台续约循环"""
+        while not self._stop.wait(self.renew_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                # 存储暂时不可用：不续约，owns() 会在租约剩余时间不足时自动返回 False
+                self.logger.warning(f"租约续约失败: {e}")
+
+    def start(self) -> None:
+        """立即执行一轮分配，然后在后台线程定期续约"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        try:
+            self.tick()
+        except Exception as e:
+            self.logger.warning(f"租约初次分配失败: {e}")
+        self._thread = threading.Thread(target=self._run, name="lease-coordinator", daemon=True)
+        self._thread.start()
+        self.logger.info(f"租约协调已启动（节点: {self.node_id}，租约 {self.lease_ttl:g} 秒）")
+
+    def stop(self) -> None:
+        """停止续约并主动离开，其他节点可立即接管本节点的分片
+
+        调用方应先等待分片上的任务结束；各分片的回调在离开前触发，此时防护令牌仍然有效。
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        owned = list(self._owned)
+        for shard in owned:
+            self._draining[shard] = time.monotonic()
+        for shard in owned:
+            self._notify(shard, False)
+        self._owned.clear()
+        self._draining.clear()
+        try:
+            self.store.leave(self.node_id)
+        except Exception as e:
+            self.logger.warning(f"租约释放失败: {e}")
@@ -4,10 +4,12 @@
 
 import time
 import os
+import threading
 from contextlib import contextmanager
 from typing import Optional, Callable, List, Dict
 from datetime import datetime
 from typing import Any
+from clock import get_clock
 
 
 class _AlertSuppression:
@@ -32,10 +34,11 @@ class _AlertSuppression:
         """将被抑制的告警释放到 Logger 的聚合管道（任务最终失败）。"""
         if not self._resolved:
             if self.buffer:
-                logger.pending_alerts.extend(self.buffer)
-                self.buffer.clear()
-                if logger._should_send_aggregated_alerts():
-                    logger._send_aggregated_alerts()
+                with logger._alert_lock:
+                    logger.pending_alerts.extend(self.buffer)
+                    self.buffer.clear()
+                    if logger._should_send_aggregated_alerts():
+                        logger._send_aggregated_alerts()
             self._resolved = True
 
 
@@ -54,19 +57,31 @@ class Logger:
         self.log_dir = log_dir
         self.error_alert_handler: Optional[Callable[[str, str], None]] = None
         self.warning_alert_handler: Optional[Callable[[str, str], None]] = None
+        # 日志记录转发（多进程模式下工作进程把日志交给主进程输出）
+        self.record_sink: Optional[Callable[[str, str], Any]] = None
 
         # 告警聚合（error + warning 统一管道）
         self.aggregate_window = error_aggregate_window
         self.pending_alerts: List[Dict[str, str]] = []
         self.last_alert_send_time: Optional[float] = None
+        # 调度器并发执行任务时，多个线程共享聚合队列
+        self._alert_lock = threading.RLock()
 
-        # 告警抑制栈（嵌套 suppress_alerts 调用时内层收集到栈顶）
-        self._suppression_stack: List[_AlertSuppression] = []
+        # 告警抑制栈按线程隔离（嵌套 suppress_alerts 调用时内层收集到栈顶）
+        self._local = threading.local()
 
         # 创建日志文件夹
         if not os.path.exists(self.log_dir):
             os.makedirs(self.log_dir)
 
+    @property
+    def _suppression_stack(self) -> List[_AlertSuppression]:
+        """当前线程的告警抑制栈"""
+        stack = getattr(self._local, 'suppression_stack', None)
+        if stack is None:
+            stack = self._local.suppression_stack = []
+        return stack
+
     # ------------------------------------------------------------------
     # 告警抑制 API（产业级可复用方案）
     # ------------------------------------------------------------------
@@ -111,6 +126,10 @@ class Logger:
         """设置错误告警处理器。"""
         self.error_alert_handler = handler
 
+    def set_record_sink(self, sink: Optional[Callable[[str, str], Any]]) -> None:
+        """设置日志记录转发：设置后日志以 (级别, 消息) 交给 sink，不再本地输出和写文件。"""
+        self.record_sink = sink
+
     def set_warning_alert_handler(self, handler: Callable[[str, str], Any]) -> None:
         """设置警告告警处理器。"""
         self.warning_alert_handler = handler
@@ -121,7 +140,7 @@ class Logger:
 
     def _get_log_file_path(self) -> str:
         """获取今天的日志文件路径。"""
-        today = datetime.now().strftime('%Y-%m-%d')
+        today = datetime.fromtimestamp(get_clock().time()).strftime('%Y-%m-%d')
         return os.path.join(self.log_dir, f"{today}.log")
 
     def _write_to_file(self, msg: str) -> None:
@@ -139,7 +158,10 @@ class Logger:
 
     def log(self, msg: str, level: str = "INFO") -> None:
         """打印带时间戳和级别的日志，同时写入文件。"""
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        if self.record_sink:
+            self.record_sink(level, msg)
+            return
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(get_clock().time()))
         level_str = f"[{level}]"
         formatted_msg = f"[{timestamp}] {level_str} {msg}"
 
@@ -173,11 +195,12 @@ class Logger:
         if not self.error_alert_handler and not self.warning_alert_handler:
             return
 
+        now = get_clock().time()
         alert_record = {
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'timestamp': datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S'),
             'level': level,
             'message': msg,
-            '_time': time.time(),
+            '_time': now,
         }
 
         # 路由到最内层未决的抑制上下文
@@ -187,19 +210,25 @@ class Logger:
                 return
 
         # 无活跃抑制 → 进入全局聚合队列
-        self.pending_alerts.append(alert_record)
-        if self._should_send_aggregated_alerts():
-            self._send_aggregated_alerts()
+        with self._alert_lock:
+            self.pending_alerts.append(alert_record)
+            if self._should_send_aggregated_alerts():
+                self._send_aggregated_alerts()
 
     def _should_send_aggregated_alerts(self) -> bool:
         """基于最早待发告警的等待时间判断是否应发送聚合邮件。"""
         if not self.pending_alerts:
             return False
         oldest_time = min(a['_time'] for a in self.pending_alerts)
-        return time.time() - oldest_time >= self.aggregate_window
+        return get_clock().time() - oldest_time >= self.aggregate_window
 
     def _send_aggregated_alerts(self) -> None:
         """发送聚合告警邮件。"""
+        with self._alert_lock:
+            self._send_aggregated_alerts_locked()
+
+    def _send_aggregated_alerts_locked(self) -> None:
+        """发送聚合告警邮件（调用方需持有 self._alert_lock）。"""
         if not self.pending_alerts:
             return
 
@@ -242,7 +271,7 @@ class Logger:
             handler(subject, content)
 
             self.pending_alerts.clear()
-            self.last_alert_send_time = time.time()
+            self.last_alert_send_time = get_clock().time()
 
         except Exception as e:
             print(f"[WARNING] 聚合告警邮件发送失败: {e}")
@@ -252,13 +281,15 @@ class Logger:
 
         供调度器空闲循环等场景周期性调用，确保告警不会因无后续事件而无限滞留。
         """
-        if self.pending_alerts and self._should_send_aggregated_alerts():
-            self._send_aggregated_alerts()
+        with self._alert_lock:
+            if self.pending_alerts and self._should_send_aggregated_alerts():
+                self._send_aggregated_alerts()
 
     def flush_errors(self) -> None:
         """立即发送所有待聚合的告警（用于程序退出等场景）。"""
-        if self.pending_alerts:
-            self._send_aggregated_alerts()
+        with self._alert_lock:
+            if self.pending_alerts:
+                self._send_aggregated_alerts()
 
 
 # ------------------------------------------------------------------
@@ -0,0 +1,102 @@
+"""UESTC 服务系统 - 登录页面解析
+从 IDAS 登录页面提取 execution 和 pwdEncryptSalt。优先使用预编译正则直接定位两个 <input>，
+仅在快速路径失败时才构建完整的 BeautifulSoup 文档树
+"""
+
+import html
+import re
+from typing import Optional, Tuple
+
+# 匹配 id 为指定值的 <input> 标签（属性顺序、引号风格不限）
+_EXECUTION_TAG_RE = re.compile(r"""<input\b[^>]*?(?<![\w-])id\s*=\s*["']?execution(?=["'\s/>])[^>]*>""", re.IGNORECASE)
+_SALT_TAG_RE = re.compile(r"""<input\b[^>]*?(?<![\w-])id\s*=\s*["']?pwdEncryptSalt(?=["'\s/>])[^>]*>""", re.IGNORECASE)
+# 从标签中提取 value 属性
+_VALUE_ATTR_RE = re.compile(r"""(?<![\w-])value\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>/]+))""", re.IGNORECASE)
+
+# 登录失败页面中的错误提示
+_ERROR_TIP_RE = re.compile(r"""<span\b[^>]*?(?<![\w-])id\s*=\s*["']?showErrorTip(?=["'\s/>])[^>]*>(.*?)</span>""", re.IGNORECASE | re.DOTALL)
+
+# 解析统计：快速路径命中次数 / 回退到完整解析的次数
+stats = {"fast": 0, "fallback": 0}
+
+
+def _tag_value(tag: str) -> Optional[str]:
+    """提取 <input> 标签的 value 属性值（已反转义 HTML 实体）"""
+    match = _VALUE_ATTR_RE.search(tag)
+    if not match:
+        return None
+    value = next(group for group in match.groups() if group is not None)
+    return html.unescape(value)
+
+
+def fast_extract(page: str) -> Tuple[Optional[str], Optional[str]]:
+    """快速路径：用预编译正则直接提取 execution 和 salt
+
+    Args:
+        page: 登录页面 HTML
+
+    Returns:
+        (execution, salt) 元组，未找到的字段为 None
+    """
+    execution_tag = _EXECUTION_TAG_RE.search(page)
+    salt_tag = _SALT_TAG_RE.search(page)
+    execution = _tag_value(execution_tag.group(0)) if execution_tag else None
+    salt = _tag_value(salt_tag.group(0)) if salt_tag else None
+    return execution, salt
+
+
+def soup_extract(page: str) -> Tuple[Optional[str], Optional[str]]:
+    """完整解析：构建 BeautifulSoup 文档树后查找字段
+
+    Args:
+        page: 登录页面 HTML
+
+    Returns:
+        (execution, salt) 元组，未找到的字段为 None
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page, 'lxml')
+
+    execution_element = soup.find(id='execution')
+    salt_element = soup.find('input', attrs={'id': 'pwdEncryptSalt'})
+
+    execution = execution_element.get('value') if execution_element else None
+    salt = salt_element.get('value') if salt_element else None
+    return execution, salt
+
+
+def extract_login_fields(page: str) -> Tuple[Optional[str], Optional[str]]:
+    """提取登录表单所需的 execution 和 salt
+
+    快速路径未能同时取得两个字段时，回退到完整的 BeautifulSoup 解析。
+
+    Args:
+        page: 登录页面 HTML
+
+    Returns:
+        (execution, salt) 元组，未找到的字段为 None
+    """
+    execution, salt = fast_extract(page)
+    if execution and salt:
+        stats["fast"] += 1
+        return execution, salt
+
+    stats["fallback"] += 1
+    return soup_extract(page)
+
+
+def extract_error_tip(page: str) -> Optional[str]:
+    """提取登录失败页面中的错误提示文本
+
+    Args:
+        page: 登录表单提交后返回的页面 HTML
+
+    Returns:
+        错误提示文本，不存在返回 None
+    """
+    match = _ERROR_TIP_RE.search(page)
+    if not match:
+        return None
+    text = html.unescape(re.sub(r"<[^>]+>", "", match.group(1))).strip()
+    return text or None
@@ -2,17 +2,69 @@
 集中管理和运行所有应用模块
 """
 
+import os
 import sys
 import time
 from service_system import UESTCServiceSystem
+from supervisor import Supervisor
+from UESTCAccount import UESTCAccount
 from elec_watcher import ElecWatcherApp
 from eams_watcher import EamsWatcherApp
-from scheduler import IntervalPolicy, CronPolicy
+from scheduler import IntervalPolicy
+
+
+def register_applications(system: UESTCServiceSystem, account: UESTCAccount, email_to: str | None = None) -> None:
+    """为多账户模式下的单个账户注册应用模块及定时策略（在工作进程中调用）
+
+    应用名称按用户名区分，成绩记录保存在共享的已发送记录存储中（未设置调度状态文件时为按用户名区分的本地文件），
+    通知邮件发送到该账户的收件邮箱。
+    """
+    apps = [
+        ElecWatcherApp(account, threshold=10.0),
+        EamsWatcherApp(
+            account, history_file=f"sent_grades_{account.username}.json", history_store=system.history_store
+        ),
+    ]
+    # 多账户时按任务名错峰，避免所有账户在同一时刻请求同一主机
+    policies = {
+        # ElecWatcher：每 30 分钟检查一次电费
+        "ElecWatcher": IntervalPolicy(30 * 60, spread=True, jitter=0.05),
+        # EamsWatcher：每 1 小时检查一次成绩
+        "EamsWatcher": IntervalPolicy(1 * 3600, spread=True, jitter=0.05),
+    }
+    for app in apps:
+        policy = policies[app.name]
+        app.name = f"{app.name}@{account.username}"
+        app.email_to = email_to
+        system.register_application(app)
+        system.set_app_schedule(app.name, policy)
+
+
+def run_supervisor() -> int:
+    """多进程模式：按 ACCOUNTS_FILE 中的账户启动 WORKER_PROCESSES 个工作进程"""
+    print("=" * 60)
+    print("UESTC 定时服务系统启动（多进程模式）")
+    print("=" * 60)
+    
+    supervisor = Supervisor.from_environment(register_applications, check_interval=30)
+    for worker_name, accounts in supervisor.assignments.items():
+        print(f"  - {worker_name}: {len(accounts)} 个账户")
+    
+    print("\n工作进程启动中，按 Ctrl+C 停止程序...")
+    print("=" * 60)
+    supervisor.run_forever()
+    return 0
 
 
 def main():
     """主程序入口"""
     try:
+        from dotenv import load_dotenv
+        
+        load_dotenv()
+        if int(os.getenv('WORKER_PROCESSES', '') or 0) > 0:
+            return run_supervisor()
+
         # 第一层：账户层 + 操作层 + 日志模块
         print("=" * 60)
         print("UESTC 定时服务系统启动")
@@ -23,7 +75,7 @@ def main():
         # 第二层：应用层 - 注册应用模块
         print("\n注册应用模块...")
         system.register_application(ElecWatcherApp(system.account, threshold=10.0))
-        system.register_application(EamsWatcherApp(system.account))
+        system.register_application(EamsWatcherApp(system.account, history_store=system.history_store))
         
         # 配置各应用的定时策略
         print("\n配置定时策略...")
@@ -34,7 +86,7 @@ def main():
         
         # 第一步：账户登录
         print("\n执行账户认证...")
-        if not system.login():
+        if not system.restore_or_login():
             print("❌ 账户登录失败，退出程序")
             return 1
         
@@ -52,7 +104,7 @@ def main():
             print(f"  - {app_name}: {policy.get_description()}")
         
         # 启动调度器
-        system.start_scheduler(check_interval=30)  # 每 30 秒检查一次
+        system.start_scheduler(check_interval=30)  # 失败任务 30 秒后重试
         
         print("\n调度器已启动，按 Ctrl+C 停止程序...")
         print("=" * 60)
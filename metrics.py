@@ -0,0 +1,102 @@
+"""UESTC 服务系统 - 运行指标
+固定分桶的直方图，用于统计调度任务的启动延迟和运行耗时。
+分桶固定，内存占用与样本数无关，快照可直接序列化为 JSON
+"""
+
+import bisect
+import math
+import threading
+from typing import Dict, Sequence
+
+# 默认分桶上界（秒）：覆盖毫秒级到小时级
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class Histogram:
+    """固定分桶直方图（线程安全）"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """初始化直方图
+
+        Args:
+            buckets: 递增的分桶上界，超过最后一个上界的样本计入 +Inf 桶
+        """
+        if list(buckets) != sorted(buckets) or not buckets:
+            raise ValueError("分桶上界必须非空且递增")
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """记录一个样本（负值按 0 计）"""
+        value = max(value, 0.0)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, fraction: float) -> float:
+        """估算分位数：返回累计计数达到该比例的分桶上界（落在 +Inf 桶时返回最大值）
+
+        Args:
+            fraction: 分位比例（0 ~ 1）
+
+        Returns:
+            分位数估计值（秒），没有样本时返回 0
+        """
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = math.ceil(fraction * self.count)
+            cumulative = 0
+            for index, count in enumerate(self._counts):
+                cumulative += count
+                if cumulative >= target and count:
+                    return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+            return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """获取摘要：count、mean、p50、p99、max"""
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 3) if self.count else 0.0,
+            "p50": round(self.percentile(0.5), 3),
+            "p99": round(self.percentile(0.99), 3),
+            "max": round(self.max, 3),
+        }
+
+    def snapshot(self) -> dict:
+        """获取完整快照（摘要 + 各分桶计数），可直接序列化为 JSON
+
+        Returns:
+            摘要字段加上 sum 和 buckets（{分桶上界: 该桶样本数}，不累计）
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self.sum
+        result = self.summary()
+        result["sum"] = round(total, 3)
+        labels = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        result["buckets"] = dict(zip(labels, counts))
+        return result
+
+    def merge(self, other: 'Histogram') -> None:
+        """累加另一个分桶相同的直方图"""
+        if other.buckets != self.buckets:
+            raise ValueError("只能合并分桶相同的直方图")
+        with other._lock:
+            counts = list(other._counts)
+            count, total, maximum = other.count, other.sum, other.max
+        with self._lock:
+            for index, value in enumerate(counts):
+                self._counts[index] += value
+            self.count += count
+            self.sum += total
+            if maximum > self.max:
+                self.max = maximum
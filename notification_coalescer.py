@@ -0,0 +1,334 @@
+"""UESTC 服务系统 - 通知合并
+按收件人合并一段时间内的通知为一封汇总邮件，减少 SMTP 发送次数（163 邮箱对频繁发送会限流）。
+每个通知类别有各自的合并窗口，如成绩提醒立即发送、电费提醒每小时汇总一次
+"""
+
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from logger import get_logger
+from resilience import RetryPolicy
+from send_budget import PRIORITY_HIGH, PRIORITY_NORMAL, priority_for
+
+if TYPE_CHECKING:
+    from notification_queue import NotificationQueue
+
+# 汇总发送函数：(主题, 内容, 收件人, 通知类别) -> 是否成功
+# 汇总邮件的类别取其中优先级最高的通知的类别（如含告警时为 "alert"），只含普通通知时为 "digest"（低优先级）
+SendFunc = Callable[[str, str, Optional[str], Optional[str]], bool]
+
+# 优先级排序，用于确定汇总邮件的类别
+_PRIORITY_RANK = {PRIORITY_HIGH: 2, PRIORITY_NORMAL: 1}
+
+# 汇总邮件的类别（低优先级，见 send_budget.CATEGORY_PRIORITIES）
+DIGEST_CATEGORY = "digest"
+# 含这些类别的通知时，汇总邮件不降为低优先级
+URGENT_CATEGORIES = frozenset({"grades"})
+
+# 暂存的通知：(类别, 主题, 内容, 加入时间, 持久化记录 ID)，未持久化时 ID 为 None
+_Item = Tuple[str, str, str, float, Optional[int]]
+
+
+def parse_rules(text: str) -> Dict[str, float]:
+    """解析合并规则字符串
+
+    Args:
+        text: 形如 "balance=3600,grades=0,default=300" 的规则，值为合并窗口秒数，
+              default 对应未单独配置的类别
+
+    Returns:
+        {类别: 窗口秒数}
+
+    Raises:
+        ValueError: 格式不正确
+    """
+    rules = {}
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        category, sep, window = item.partition("=")
+        if not sep or not category.strip():
+            raise ValueError(f"合并规则格式应为 类别=秒数: {item}")
+        rules[category.strip()] = float(window)
+    return rules
+
+
+class _Digest:
+    """某个收件人待合并的通知"""
+
+    def __init__(self):
+        self.items: List[_Item] = []
+        # 最早应发送的时间（各类别首条通知的加入时间 + 该类别窗口，取最小值）
+        self.deadline = float("inf")
+        self.timer: Optional[threading.Timer] = None
+        # 发送失败的次数（失败后重新暂存，按退避时间重试）
+        self.attempts = 0
+
+
+class NotificationCoalescer:
+    """通知合并器（线程安全）。
+
+    窗口为 0 的类别立即发送（不经过合并）；其余类别的通知按收件人暂存，
+    到达最早的截止时间时与该收件人的其他待发通知一起发送一封汇总邮件，
+    只有一条时原样发送。flush() 时立即发送全部暂存的通知（OperationManager.close() 会调用）。
+    设置了持久化存储（发送队列，见 set_store）时，暂存的通知先落盘再返回，进程崩溃或重启后
+    重新载入并按原截止时间发送；汇总邮件写入发送队列与删除暂存记录之间崩溃时，重启后会再发送一次。
+    未设置时暂存的通知只在内存中。
+    汇总邮件发送失败时重新暂存，按 retry_policy 退避重试，连续失败 max_attempts 次后放弃并记录日志。
+    """
+
+    def __init__(self, rules: Dict[str, float], send: Optional[SendFunc] = None,
+                 retry_policy: Optional[RetryPolicy] = None, max_attempts: int = 5):
+        """初始化合并器
+
+        Args:
+            rules: {类别: 合并窗口秒数}，"default" 对应未单独配置的类别，均未配置时立即发送
+            send: 发送函数 (主题, 内容, 收件人, 通知类别) -> 是否成功，可在加入 OperationManager 时设置
+            retry_policy: 汇总邮件发送失败后的重试退避策略，默认首次 60 秒、最长 30 分钟
+            max_attempts: 汇总邮件最多发送次数
+        """
+        if any(window < 0 for window in rules.values()):
+            raise ValueError("合并窗口不能为负数")
+        if max_attempts <= 0:
+            raise ValueError("最多发送次数必须大于 0")
+        self.rules = dict(rules)
+        self.send = send
+        self.retry_policy = retry_policy or RetryPolicy(base_delay=60, max_delay=1800)
+        self.max_attempts = max_attempts
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self._digests: Dict[Optional[str], _Digest] = {}
+        self.store: Optional['NotificationQueue'] = None
+        # submitted: 提交的通知数；coalesced: 进入合并的通知数；sent: 实际发送的邮件数；saved: 节省的发送次数；
+        # retried: 发送失败后重新暂存的次数；dropped: 多次发送失败后放弃的通知数
+        self.stats: Dict[str, int] = {
+            "submitted": 0, "immediate": 0, "coalesced": 0, "digests": 0, "sent": 0, "saved": 0,
+            "retried": 0, "dropped": 0,
+        }
+
+    @staticmethod
+    def from_environment() -> Optional['NotificationCoalescer']:
+        """根据环境变量创建合并器（可选功能）
+
+        需要的环境变量：
+        - NOTIFY_COALESCE: 合并规则，如 "balance=3600,grades=0"，未设置则不合并
+
+        Returns:
+            NotificationCoalescer 实例，未启用时返回 None
+        """
+        text = os.getenv('NOTIFY_COALESCE', '')
+        if not text:
+            return None
+        return NotificationCoalescer(parse_rules(text))
+
+    def window(self, category: Optional[str]) -> float:
+        """获取类别的合并窗口（秒），0 表示立即发送"""
+        if category is not None and category in self.rules:
+            return self.rules[category]
+        return self.rules.get("default", 0)
+
+    def set_store(self, store: Optional['NotificationQueue']) -> None:
+        """设置暂存通知的持久化存储，并载入上次未发送的暂存通知
+
+        Args:
+            store: 发送队列，None 表示只在内存中暂存
+        """
+        self.store = store
+        if store is None:
+            return
+        now = time.time()
+        with self._lock:
+            known = {item[4] for digest in self._digests.values() for item in digest.items}
+            # 设置存储之前暂存在内存中的通知同样落盘
+            for to, digest in self._digests.items():
+                for index, (category, subject, content, added, held_id) in enumerate(digest.items):
+                    if held_id is None:
+                        held_id = store.hold(category, subject, content, to, added, digest.deadline)
+                        digest.items[index] = (category, subject, content, added, held_id)
+            restored = 0
+            for held_id, to, category, subject, content, added, not_before in store.held():
+                if held_id in known:
+                    continue
+                digest = self._digests.get(to)
+                if digest is None:
+                    digest = self._digests[to] = _Digest()
+                digest.items.append((category, subject, content, added, held_id))
+                self.stats["coalesced"] += 1
+                restored += 1
+                if not_before < digest.deadline:
+                    digest.deadline = not_before
+                    self._schedule(to, digest, max(not_before - now, 0))
+        if restored:
+            self.logger.info(f"载入 {restored} 条上次未发送的待合并通知")
+
+    def submit(self, category: Optional[str], subject: str, content: str, to: Optional[str] = None) -> bool:
+        """提交一条通知
+
+        Args:
+            category: 通知类别（如 "grades"、"balance"），None 使用 default 规则
+            subject: 主题
+            content: 内容
+            to: 收件人，None 表示默认收件人
+
+        Returns:
+            立即发送时返回发送结果；进入合并（设置了持久化存储时为已落盘）时返回 True
+        """
+        window = self.window(category)
+        if window <= 0:
+            with self._lock:
+                self.stats["submitted"] += 1
+                self.stats["immediate"] += 1
+                self.stats["sent"] += 1
+            return self.send(subject, content, to, category)
+
+        category = category or "default"
+        now = time.time()
+        held_id = None
+        if self.store is not None:
+            try:
+                held_id = self.store.hold(category, subject, content, to, now, now + window)
+            except Exception as e:
+                # 无法落盘时不再暂存，直接发送，避免崩溃后丢失
+                self.logger.warning(f"暂存通知写入失败: {e}，改为直接发送")
+                with self._lock:
+                    self.stats["submitted"] += 1
+                    self.stats["immediate"] += 1
+                    self.stats["sent"] += 1
+                return self.send(subject, content, to, category)
+        with self._lock:
+            self.stats["submitted"] += 1
+            self.stats["coalesced"] += 1
+            digest = self._digests.get(to)
+            if digest is None:
+                digest = self._digests[to] = _Digest()
+            # 同一类别的截止时间由该类别的首条通知决定，后续通知不推迟发送
+            if not any(item[0] == category for item in digest.items):
+                deadline = now + window
+                if deadline < digest.deadline:
+                    digest.deadline = deadline
+                    self._schedule(to, digest, window)
+            digest.items.append((category, subject, content, now, held_id))
+        return True
+
+    def _schedule(self, to: Optional[str], digest: _Digest, delay: float) -> None:
+        """安排汇总发送（调用方需持有 self._lock）"""
+        if digest.timer is not None:
+            digest.timer.cancel()
+        digest.timer = threading.Timer(delay, self._flush_recipient, args=(to, digest))
+        digest.timer.daemon = True
+        digest.timer.start()
+
+    def _flush_recipient(self, to: Optional[str], digest: _Digest) -> bool:
+        """发送某个收件人的汇总邮件，失败时重新暂存"""
+        with self._lock:
+            if self._digests.get(to) is not digest:
+                return True
+            del self._digests[to]
+            if digest.timer is not None:
+                digest.timer.cancel()
+        items = digest.items
+        category = self._digest_category(items)
+        if len(items) == 1:
+            _, subject, content, _, _ = items[0]
+        else:
+            subject, content = self._build_digest(items)
+        try:
+            sent = bool(self.send(subject, content, to, category))
+        except Exception as e:
+            self.logger.error(f"汇总通知发送失败: {e}")
+            sent = False
+        if sent:
+            self._release(items)
+            with self._lock:
+                self.stats["sent"] += 1
+                self.stats["saved"] += len(items) - 1
+                if len(items) > 1:
+                    self.stats["digests"] += 1
+        else:
+            self._requeue(to, digest)
+        return sent
+
+    def _release(self, items: List[_Item]) -> None:
+        """删除已发送或已放弃的通知的持久化记录"""
+        if self.store is None:
+            return
+        try:
+            self.store.release([item[4] for item in items if item[4] is not None])
+        except Exception as e:
+            # 记录留在暂存表中，重启后会再发送一次
+            self.logger.warning(f"删除暂存通知记录失败: {e}")
+
+    @staticmethod
+    def _digest_category(items: List[_Item]) -> Optional[str]:
+        """汇总邮件的类别
+
+        单条通知沿用其类别；多条时取优先级最高的通知的类别，含告警时汇总邮件同样按告警优先发送；
+        不含告警和成绩提醒的汇总为 "digest"，按低优先级占用每日额度。
+        """
+        category = max((item[0] for item in items), key=lambda c: _PRIORITY_RANK.get(priority_for(c), 0))
+        if (len(items) > 1 and priority_for(category) != PRIORITY_HIGH
+                and not any(item[0] in URGENT_CATEGORIES for item in items)):
+            return DIGEST_CATEGORY
+        return None if category == "default" else category
+
+    def _requeue(self, to: Optional[str], digest: _Digest) -> None:
+        """发送失败的通知重新暂存，按退避时间重试；超过最多发送次数时放弃"""
+        attempts = digest.attempts + 1
+        if attempts >= self.max_attempts:
+            self._release(digest.items)
+            with self._lock:
+                self.stats["dropped"] += len(digest.items)
+            # 不触发告警邮件：告警同样经过合并器，发送不可用时只会产生更多无法发送的通知
+            with self.logger.suppress_alerts() as suppression:
+                self.logger.error(f"收件人 {to or '默认收件人'} 的 {len(digest.items)} 条通知发送 {attempts} 次均失败，已放弃")
+                suppression.discard()
+            return
+        delay = self.retry_policy.delay(attempts)
+        with self._lock:
+            self.stats["retried"] += 1
+            current = self._digests.get(to)
+            if current is None:
+                current = self._digests[to] = _Digest()
+            # 失败的通知排在新通知之前，保持原有顺序
+            current.items = digest.items + current.items
+            current.attempts = max(current.attempts, attempts)
+            deadline = time.time() + delay
+            if deadline < current.deadline:
+                current.deadline = deadline
+                self._schedule(to, current, delay)
+        self.logger.info(f"收件人 {to or '默认收件人'} 的 {len(digest.items)} 条通知发送失败，{delay:.0f} 秒后重试")
+
+    @staticmethod
+    def _build_digest(items: List[_Item]) -> Tuple[str, str]:
+        """把多条通知合成一封汇总邮件"""
+        subject = f"【通知汇总】{len(items)} 条通知：{items[0][1]} 等"
+        lines = [f"以下 {len(items)} 条通知合并为一封邮件发送：", ""]
+        for index, (_, item_subject, item_content, added, _) in enumerate(items, 1):
+            lines.append("=" * 60)
+            lines.append(f"{index}. {item_subject}（{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(added))}）")
+            lines.append("=" * 60)
+            lines.append(item_content.strip())
+            lines.append("")
+        return subject, "\n".join(lines)
+
+    @property
+    def pending(self) -> int:
+        """暂存待合并的通知数"""
+        with self._lock:
+            return sum(len(digest.items) for digest in self._digests.values())
+
+    def flush(self) -> None:
+        """立即发送所有暂存的通知（发送失败的仍按退避时间重试）"""
+        with self._lock:
+            digests = list(self._digests.items())
+        for to, digest in digests:
+            self._flush_recipient(to, digest)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取发送统计（含当前暂存数 pending）"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["pending"] = sum(len(digest.items) for digest in self._digests.values())
+        return stats
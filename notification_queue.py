@@ -0,0 +1,361 @@
+"""UESTC 服务系统 - 通知发送队列
+应用和告警发送的通知先写入磁盘上的 SQLite 暂存队列再返回，由后台线程投递；
+投递失败按指数退避重试，超过最大次数后写入死信文件。进程重启后未投递的通知继续发送
+"""
+
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from logger import get_logger
+from resilience import RetryPolicy
+
+# 投递函数：(操作名, 主题, 内容, 收件人, 通知类别) -> 是否成功
+DeliverFunc = Callable[[str, str, str, Optional[str], Optional[str]], bool]
+
+
+class NotificationQueue:
+    """持久化的通知发送队列（线程安全）。
+
+    enqueue() 在一个 SQLite 事务中写入暂存队列后即返回（WAL + NORMAL 同步，进程崩溃不丢失，
+    只在写入磁盘的检查点 fsync），调用方不再等待 SMTP 服务器。
+    后台线程按到期时间取出通知投递：成功后删除，失败后按 retry_policy 推迟，
+    连续失败 max_attempts 次后追加到死信文件（JSON Lines）并从队列删除。
+    投递成功与删除记录之间进程崩溃时，重启后会再发送一次（至少一次投递）。
+
+    同一文件还保存合并器暂存待合并的通知（hold/held/release，见 NotificationCoalescer），
+    合并窗口未到时进程退出，重启后继续合并发送。
+    """
+
+    def __init__(self, spool_path: str, workers: int = 2, retry_policy: Optional[RetryPolicy] = None,
+                 max_attempts: int = 8, dead_letter_path: Optional[str] = None):
+        """初始化发送队列，并载入上次未投递的通知
+
+        Args:
+            spool_path: 暂存队列的 SQLite 文件路径，所在目录不存在时自动创建
+            workers: 投递线程数
+            retry_policy: 投递失败的重试退避策略，默认首次 30 秒、最长 1 小时
+            max_attempts: 最多投递次数，超过后写入死信文件
+            dead_letter_path: 死信文件路径，默认为暂存队列文件名加 .dead.jsonl
+        """
+        if workers <= 0 or max_attempts <= 0:
+            raise ValueError("投递线程数和最多投递次数必须大于 0")
+        self.spool_path = spool_path
+        self.workers = workers
+        self.retry_policy = retry_policy or RetryPolicy(base_delay=30, max_delay=3600)
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path or f"{os.path.splitext(spool_path)[0]}.dead.jsonl"
+        self.logger = get_logger()
+
+        directory = os.path.dirname(os.path.abspath(spool_path))
+        os.makedirs(directory, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(spool_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, operation TEXT NOT NULL, subject TEXT NOT NULL, "
+            "content TEXT NOT NULL, recipient TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, created_at REAL NOT NULL, last_error TEXT, category TEXT)"
+        )
+        # 旧版本的暂存队列没有 category 列
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")]
+        if "category" not in columns:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN category TEXT")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS held ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, recipient TEXT, category TEXT NOT NULL, subject TEXT NOT NULL, "
+            "content TEXT NOT NULL, added_at REAL NOT NULL, not_before REAL NOT NULL)"
+        )
+
+        # 待投递的通知 {ID: [操作名, 主题, 内容, 收件人, 已投递次数, 入队时间, 通知类别]}
+        self._messages: Dict[int, list] = {}
+        # (下次投递时间, ID)
+        self._heap: List[Tuple[float, int]] = []
+        for row in self._conn.execute(
+            "SELECT id, operation, subject, content, recipient, attempts, next_attempt_at, created_at, category "
+            "FROM outbox"
+        ):
+            self._messages[row[0]] = [row[1], row[2], row[3], row[4], row[5], row[7], row[8]]
+            self._heap.append((row[6], row[0]))
+        heapq.heapify(self._heap)
+
+        self._cond = threading.Condition()
+        self._deliver: Optional[DeliverFunc] = None
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._in_flight = 0
+        self.stats: Dict[str, int] = {"enqueued": 0, "delivered": 0, "retried": 0, "dead": 0}
+        if self._messages:
+            self.logger.info(f"发送队列中有 {len(self._messages)} 条上次未投递的通知")
+
+    @staticmethod
+    def from_environment() -> Optional['NotificationQueue']:
+        """根据环境变量创建发送队列（可选功能）
+
+        需要的环境变量：
+        - NOTIFY_SPOOL_DB: 暂存队列文件，未设置则不启用（通知同步发送）
+        - NOTIFY_WORKERS: 投递线程数（可选，默认 2）
+        - NOTIFY_MAX_ATTEMPTS: 最多投递次数（可选，默认 8）
+        - NOTIFY_DEAD_LETTER_FILE: 死信文件（可选）
+
+        Returns:
+            NotificationQueue 实例，未启用时返回 None
+        """
+        spool_path = os.getenv('NOTIFY_SPOOL_DB', '')
+        if not spool_path:
+            return None
+        return NotificationQueue(
+            spool_path,
+            workers=int(os.getenv('NOTIFY_WORKERS', '') or 2),
+            max_attempts=int(os.getenv('NOTIFY_MAX_ATTEMPTS', '') or 8),
+            dead_letter_path=os.getenv('NOTIFY_DEAD_LETTER_FILE', '') or None,
+        )
+
+    def enqueue(self, operation: str, subject: str, content: str, to: Optional[str] = None,
+                category: Optional[str] = None) -> int:
+        """将通知写入暂存队列（返回时已落盘）
+
+        Args:
+            operation: 投递使用的操作名（如 "email"）
+            subject: 主题
+            content: 内容
+            to: 收件人，None 表示操作的默认收件人
+            category: 通知类别（如 "alert"、"digest"），投递时用于选择发送优先级
+
+        Returns:
+            通知 ID
+        """
+        now = time.time()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (operation, subject, content, recipient, attempts, next_attempt_at, created_at, "
+                "category) VALUES (?, ?, ?, ?, 0, ?, ?, ?)",
+                (operation, subject, content, to, now, now, category),
+            )
+            message_id = cursor.lastrowid
+        with self._cond:
+            self._messages[message_id] = [operation, subject, content, to, 0, now, category]
+            heapq.heappush(self._heap, (now, message_id))
+            self.stats["enqueued"] += 1
+            self._cond.notify()
+        return message_id
+
+    def hold(self, category: str, subject: str, content: str, to: Optional[str], added_at: float,
+             not_before: float) -> int:
+        """保存一条暂存待合并的通知（返回时已落盘）
+
+        Args:
+            category: 通知类别
+            subject: 主题
+            content: 内容
+            to: 收件人
+            added_at: 加入合并的时间
+            not_before: 合并窗口结束的时间
+
+        Returns:
+            暂存记录 ID
+        """
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "INSERT INTO held (recipient, category, subject, content, added_at, not_before) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (to, category, subject, content, added_at, not_before),
+            )
+            return cursor.lastrowid
+
+    def held(self) -> List[Tuple[int, Optional[str], str, str, str, float, float]]:
+        """读取暂存待合并的通知
+
+        Returns:
+            [(ID, 收件人, 类别, 主题, 内容, 加入时间, 窗口结束时间)]，按加入顺序排列
+        """
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT id, recipient, category, subject, content, added_at, not_before FROM held ORDER BY id"
+            ).fetchall()
+
+    def release(self, ids: List[int]) -> None:
+        """删除已发送（已写入发送队列）或已放弃的暂存通知"""
+        if not ids:
+            return
+        with self._db_lock:
+            self._conn.executemany("DELETE FROM held WHERE id = ?", [(i,) for i in ids])
+
+    @property
+    def pending(self) -> int:
+        """待投递（含等待重试）的通知数"""
+        return len(self._messages)
+
+    @property
+    def running(self) -> bool:
+        """投递线程是否在运行"""
+        return bool(self._threads)
+
+    def start(self, deliver: DeliverFunc) -> None:
+        """启动投递线程
+
+        Args:
+            deliver: 投递函数 (操作名, 主题, 内容, 收件人, 通知类别) -> 是否成功
+        """
+        if self._threads:
+            return
+        self._deliver = deliver
+        self._stopping = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"notify-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10) -> None:
+        """停止投递线程（等待正在进行的投递结束）。未投递的通知留在暂存队列，下次启动时继续发送
+
+        Args:
+            timeout: 等待正在进行的投递的时间（秒）
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+
+    def drain(self, timeout: float) -> bool:
+        """等待当前已到期的通知全部投递完成（投递失败、等待重试的不计）
+
+        Args:
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            已全部完成返回 True，超时返回 False
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight or (self._heap and self._heap[0][0] <= time.time()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 0.1))
+            return True
+
+    def _next_due(self) -> Optional[int]:
+        """等待并取出一个到期的通知 ID，停止时返回 None（调用方需持有 self._cond）"""
+        while not self._stopping:
+            if self._heap:
+                due, message_id = self._heap[0]
+                wait = due - time.time()
+                if wait <= 0:
+                    heapq.heappop(self._heap)
+                    return message_id
+                self._cond.wait(wait)
+            else:
+                self._cond.wait()
+        return None
+
+    def _worker(self) -> None:
+        """投递线程主循环"""
+        while True:
+            with self._cond:
+                message_id = self._next_due()
+                if message_id is None:
+                    return
+                self._in_flight += 1
+            try:
+                self._deliver_one(message_id)
+            except Exception as e:
+                self.logger.warning(f"通知 {message_id} 投递异常: {e}")
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _deliver_one(self, message_id: int) -> None:
+        """投递一条通知，并按结果删除、推迟重试或写入死信"""
+        message = self._messages[message_id]
+        operation, subject, content, to, attempts, _, category = message
+        # 投递过程中的错误日志（如 SMTP 失败）不再触发告警邮件，由本队列重试并在最终失败时记录
+        with self.logger.suppress_alerts() as suppression:
+            try:
+                delivered = bool(self._deliver(operation, subject, content, to, category))
+                error = "" if delivered else "投递失败"
+            except Exception as e:
+                delivered, error = False, str(e)
+            suppression.discard()
+
+        if delivered:
+            self._delete(message_id)
+            with self._cond:
+                self.stats["delivered"] += 1
+            return
+
+        attempts += 1
+        if attempts >= self.max_attempts:
+            self._dead_letter(message_id, message, attempts, error)
+            return
+
+        delay = self.retry_policy.delay(attempts)
+        next_attempt = time.time() + delay
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, next_attempt, error, message_id),
+            )
+        with self._cond:
+            message[4] = attempts
+            heapq.heappush(self._heap, (next_attempt, message_id))
+            self.stats["retried"] += 1
+        self.logger.info(f"通知「{subject}」第 {attempts} 次投递失败（{error}），{delay:.0f} 秒后重试")
+
+    def _delete(self, message_id: int) -> None:
+        """从暂存队列删除通知"""
+        with self._db_lock:
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+        with self._cond:
+            self._messages.pop(message_id, None)
+
+    def _dead_letter(self, message_id: int, message: list, attempts: int, error: str) -> None:
+        """写入死信文件后从队列删除（先写文件，崩溃时最多重复一条死信而不会丢失）"""
+        operation, subject, content, to, _, created_at, category = message
+        record = {
+            "id": message_id,
+            "operation": operation,
+            "category": category,
+            "subject": subject,
+            "content": content,
+            "to": to,
+            "attempts": attempts,
+            "created_at": created_at,
+            "failed_at": time.time(),
+            "last_error": error,
+        }
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            # 死信文件不可写时保留在队列中，按最长间隔继续重试
+            self._log_without_alert(f"写入死信文件失败: {e}，通知「{subject}」保留在发送队列中")
+            with self._cond:
+                heapq.heappush(self._heap, (time.time() + self.retry_policy.max_delay, message_id))
+            return
+        self._delete(message_id)
+        with self._cond:
+            self.stats["dead"] += 1
+        self._log_without_alert(f"通知「{subject}」投递 {attempts} 次均失败，已写入死信文件 {self.dead_letter_path}")
+
+    def _log_without_alert(self, msg: str) -> None:
+        """记录错误日志但不触发告警邮件：告警邮件也经过本队列，
+        SMTP 不可用时每条死信产生的告警最终又会成为死信，形成无止境的循环"""
+        with self.logger.suppress_alerts() as suppression:
+            self.logger.error(msg)
+            suppression.discard()
+
+    def close(self) -> None:
+        """停止投递线程并关闭数据库连接"""
+        self.stop()
+        with self._db_lock:
+            self._conn.close()
@@ -1,9 +1,23 @@
 """UESTC 服务系统 - 操作层
-提供通用操作接口，如发邮件等
+提供通用操作接口，如发邮件、推送 Webhook 等
 """
 
+import json
+import os
+import smtplib
+import threading
+import time
+import urllib.parse
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import requests
 from logger import get_logger
+from notification_coalescer import NotificationCoalescer
+from notification_queue import NotificationQueue
+from resilience import RetryPolicy
+from send_budget import SendBudget, get_provider_limits, priority_for
+from transport import CountingHTTPAdapter, HostPolicy, get_transport_stats
 import yagmail
 
 
@@ -19,54 +33,730 @@ class Operation(ABC):
         """
         pass
 
+    def close(self) -> None:
+        """释放操作持有的资源（如网络连接），之后仍可继续使用"""
+        pass
+
+
+class _DataTrackingMixin:
+    """记录当前邮件事务是否已发出 DATA（之后连接出错时服务器可能已接收邮件）"""
+
+    data_started = False
+
+    def mail(self, *args, **kwargs):
+        self.data_started = False
+        return super().mail(*args, **kwargs)
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+class _SMTP(_DataTrackingMixin, smtplib.SMTP):
+    pass
+
+
+class _SMTP_SSL(_DataTrackingMixin, smtplib.SMTP_SSL):
+    pass
+
+
+class SMTPConnectionPool:
+    """SMTP 长连接池（线程安全）。
+
+    发送完成的连接放回池中复用，连续发送多封邮件只需一次 TCP 连接、TLS 握手和 AUTH。
+    空闲超过 keepalive_interval 的连接在复用前先发送 NOOP 确认仍可用；
+    空闲超过 idle_timeout 的连接由后台定时器发送 QUIT 关闭（服务器通常数分钟后会主动断开空闲连接）。
+    复用的连接在发出 DATA 之前已断开时丢弃该连接，重新连接后再发送一次；
+    DATA 之后出错（如等待服务器确认时超时）时服务器可能已接收邮件，不再重发，由调用方（发送队列）决定是否重试。
+    """
+
+    # 表示连接已不可用、需要重新连接的异常
+    CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, OSError)
+
+    def __init__(self, host: str, user: str, password: str, port: int = 465, use_ssl: bool = True,
+                 max_connections: int = 2, keepalive_interval: float = 30, idle_timeout: float = 120,
+                 timeout: float = 30):
+        """初始化连接池
+
+        Args:
+            host: SMTP 服务器
+            user: 登录用户名，为空时不登录
+            password: 登录密码（授权码）
+            port: 端口
+            use_ssl: 是否使用 SMTP over SSL（否则为明文连接，仅用于本地测试）
+            max_connections: 同时打开的连接数上限，已满时发送方等待其他发送完成
+            keepalive_interval: 连接空闲超过此秒数后，复用前先发送 NOOP 检查
+            idle_timeout: 连接空闲超过此秒数后关闭
+            timeout: 连接与每条 SMTP 命令的超时（秒）
+        """
+        if max_connections <= 0:
+            raise ValueError("连接数上限必须大于 0")
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        # 空闲连接 [(连接, 放回时间 monotonic)]，后放回的在末尾，优先复用
+        self._idle: List[Tuple[smtplib.SMTP, float]] = []
+        self._reaper: Optional[threading.Timer] = None
+        self.stats: Dict[str, int] = {"connects": 0, "reuses": 0, "noops": 0, "reconnects": 0, "idle_closed": 0}
+
+    def _connect(self) -> smtplib.SMTP:
+        """新建连接并登录"""
+        if self.use_ssl:
+            conn = _SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = _SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.ehlo()
+            if self.user:
+                conn.login(self.user, self.password)
+        except Exception:
+            self._quit(conn)
+            raise
+        with self._lock:
+            self.stats["connects"] += 1
+        return conn
+
+    @staticmethod
+    def _quit(conn: smtplib.SMTP) -> None:
+        """关闭连接，忽略连接已断开等错误"""
+        try:
+            conn.quit()
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _checkout(self) -> Tuple[smtplib.SMTP, bool]:
+        """取出一个可用的空闲连接，没有时新建（调用方需已占用连接名额）
+
+        Returns:
+            (连接, 是否为复用的连接)
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, released = self._idle.pop()
+            idle = time.monotonic() - released
+            if idle >= self.idle_timeout:
+                self._quit(conn)
+                continue
+            if idle >= self.keepalive_interval:
+                with self._lock:
+                    self.stats["noops"] += 1
+                try:
+                    if conn.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected("NOOP 未返回 250")
+                except Exception:
+                    self._quit(conn)
+                    continue
+            with self._lock:
+                self.stats["reuses"] += 1
+            return conn, True
+        return self._connect(), False
+
+    def _checkin(self, conn: smtplib.SMTP) -> None:
+        """放回连接，并确保空闲回收定时器在运行"""
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+            if self._reaper is None:
+                self._schedule_reaper(self.idle_timeout)
+
+    def _schedule_reaper(self, delay: float) -> None:
+        """安排空闲回收（调用方需持有 self._lock）"""
+        self._reaper = threading.Timer(delay, self._reap)
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def _reap(self) -> None:
+        """关闭空闲超时的连接；仍有空闲连接时按最早到期时间再次安排"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [conn for conn, released in self._idle if now - released >= self.idle_timeout]
+            self._idle = [(conn, released) for conn, released in self._idle if now - released < self.idle_timeout]
+            self.stats["idle_closed"] += len(expired)
+            self._reaper = None
+            if self._idle:
+                oldest = min(released for _, released in self._idle)
+                self._schedule_reaper(max(oldest + self.idle_timeout - now, 0.1))
+        for conn in expired:
+            self._quit(conn)
+
+    def sendmail(self, from_addr: str, recipients: List[str], message: str) -> dict:
+        """通过池中的连接发送一封邮件
+
+        Args:
+            from_addr: 发件地址
+            recipients: 收件地址列表
+            message: 完整的邮件文本
+
+        Returns:
+            被拒绝的收件地址 {地址: (状态码, 响应)}，与 smtplib.SMTP.sendmail 相同
+
+        Raises:
+            smtplib.SMTPException: 服务器拒绝邮件，或重新连接后仍发送失败
+            OSError: 发出 DATA 之后连接出错（邮件可能已送达，不重发）
+        """
+        with self._slots:
+            conn, reused = self._checkout()
+            conn.data_started = False
+            try:
+                refused = conn.sendmail(from_addr, recipients, message)
+            except self.CONNECTION_ERRORS as e:
+                self._quit(conn)
+                if not reused or conn.data_started:
+                    raise
+                # 复用的连接在 DATA 之前已被服务器断开，邮件未发出：重新连接再发送一次
+                self.logger.info(f"SMTP 连接已断开（{e}），重新连接后重试")
+                with self._lock:
+                    self.stats["reconnects"] += 1
+                conn = self._connect()
+                try:
+                    refused = conn.sendmail(from_addr, recipients, message)
+                except Exception:
+                    self._quit(conn)
+                    raise
+            except smtplib.SMTPException:
+                # 服务器拒绝了这封邮件，连接本身仍可用
+                try:
+                    conn.rset()
+                except Exception:
+                    self._quit(conn)
+                    raise
+                self._checkin(conn)
+                raise
+            except Exception:
+                self._quit(conn)
+                raise
+            self._checkin(conn)
+            return refused
+
+    def close(self) -> None:
+        """关闭全部空闲连接（正在发送的连接发送完成后照常放回，之后仍可继续发送）"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            if self._reaper is not None:
+                self._reaper.cancel()
+                self._reaper = None
+        for conn, _ in idle:
+            self._quit(conn)
+
+
+class SMTPSender:
+    """一个发件账户：SMTP 连接池、发送额度与邮件构造"""
+
+    def __init__(self, user: str, password: str, host: str = 'smtp.163.com', port: int = 465,
+                 use_ssl: bool = True, budget: Optional[SendBudget] = None,
+                 pool: Optional[SMTPConnectionPool] = None):
+        """初始化发件账户
+
+        Args:
+            user: 发件邮箱
+            password: 邮箱授权码
+            host: SMTP 服务器
+            port: SMTP 端口
+            use_ssl: 是否使用 SMTP over SSL
+            budget: 发送额度，传 None 表示不限
+            pool: SMTP 连接池，默认按上述参数创建
+        """
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.budget = budget
+        self.pool = pool or SMTPConnectionPool(host, user, password, port=port, use_ssl=use_ssl)
+        # yagmail 只用于构造邮件（不连接服务器），首次发送时创建；发送走连接池
+        self._composer: Optional[yagmail.SMTP] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.stats: Dict[str, int] = {"sent": 0, "failed": 0}
+
+    @staticmethod
+    def from_config(config: dict, db_path: Optional[str] = None) -> 'SMTPSender':
+        """根据配置字典创建发件账户
+
+        Args:
+            config: 包含 user、password 键，可选 host、port、use_ssl、per_minute、daily_quota；
+                    未配置额度时使用 SMTP 服务器的默认额度，额度为 0 表示不限
+            db_path: 发送额度的 SQLite 文件，提供时多个进程共享额度
+
+        Returns:
+            SMTPSender 实例
+        """
+        host = config.get('host') or 'smtp.163.com'
+        default_per_minute, default_daily_quota = get_provider_limits(host)
+        per_minute = config.get('per_minute', default_per_minute)
+        daily_quota = config.get('daily_quota', default_daily_quota)
+        budget = None
+        if per_minute or daily_quota:
+            budget = SendBudget(
+                f"{host}:{config['user']}", per_minute=per_minute or None, daily_quota=daily_quota or None,
+                db_path=db_path,
+            )
+        return SMTPSender(
+            config['user'], config['password'], host=host, port=int(config.get('port') or 465),
+            use_ssl=bool(config.get('use_ssl', True)), budget=budget,
+        )
+
+    @property
+    def load(self) -> float:
+        """当前负载：当日配额使用比例，未设置每日配额时为正在发送的邮件数"""
+        if self.budget is not None and self.budget.daily_quota is not None:
+            return self.budget.load()
+        return float(self._in_flight)
+
+    def send(self, subject: str, content: str, to: str) -> None:
+        """发送一封邮件（不检查发送额度）
+
+        Raises:
+            Exception: 构造或发送失败
+        """
+        with self._lock:
+            if self._composer is None:
+                self._composer = yagmail.SMTP(
+                    user=self.user, password=self.password, host=self.host, port=self.port, smtp_ssl=self.use_ssl
+                )
+            self._in_flight += 1
+        try:
+            recipients, message = self._composer.prepare_send(to=to, subject=subject, contents=content)
+            refused = self.pool.sendmail(self._composer.user, recipients, message)
+            if refused:
+                get_logger().warning(f"部分收件人被拒绝: {', '.join(refused)}")
+        except Exception:
+            with self._lock:
+                self.stats["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        with self._lock:
+            self.stats["sent"] += 1
+
+    def snapshot(self) -> dict:
+        """获取发送统计与额度状态"""
+        with self._lock:
+            snapshot = dict(self.stats, user=self.user, host=self.host)
+        if self.budget is not None:
+            snapshot["budget"] = self.budget.snapshot()
+        return snapshot
+
+    def close(self) -> None:
+        """关闭空闲的 SMTP 连接"""
+        self.pool.close()
+
 
 class EmailOperation(Operation):
-    """邮件发送操作"""
-    
-    def __init__(self, email_user: str, email_pass: str, email_to: str):
+    """邮件发送操作。
+
+    可配置多个发件账户，按 selection 选择（round_robin 轮询 / least_loaded 当日配额使用比例最低），
+    发送吞吐量随发件账户数增长。选中的账户额度不足或发送失败时依次尝试其他账户；
+    全部账户都无额度时最多等待 max_wait 秒，仍无额度则返回 False（设置了发送队列时稍后重试）。
+    """
+
+    SELECTIONS = ("round_robin", "least_loaded")
+
+    def __init__(self, email_user: str, email_pass: str, email_to: str, host: str = 'smtp.163.com',
+                 port: int = 465, use_ssl: bool = True, pool: Optional[SMTPConnectionPool] = None,
+                 senders: Optional[List[SMTPSender]] = None, selection: str = "round_robin",
+                 max_wait: float = 30):
         """初始化邮件操作
         
         Args:
             email_user: 发件邮箱
             email_pass: 邮箱授权码
             email_to: 收件邮箱
+            host: SMTP 服务器
+            port: SMTP 端口
+            use_ssl: 是否使用 SMTP over SSL
+            pool: SMTP 连接池，默认按上述参数创建
+            senders: 发件账户列表，提供时代替上述发件邮箱配置
+            selection: 发件账户选择方式（round_robin / least_loaded）
+            max_wait: 所有账户都达到每分钟上限时最长等待时间（秒）
         """
+        if selection not in self.SELECTIONS:
+            raise ValueError(f"未知的发件账户选择方式: {selection}")
         self.email_user = email_user
         self.email_pass = email_pass
         self.email_to = email_to
         self.logger = get_logger()
-    
-    def execute(self, subject: str, content: str) -> bool:
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.senders = senders or [SMTPSender(email_user, email_pass, host=host, port=port, use_ssl=use_ssl, pool=pool)]
+        self.pool = self.senders[0].pool
+        self.selection = selection
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._next = 0
+
+    @staticmethod
+    def from_environment(email_user: str, email_pass: str, email_to: str) -> 'EmailOperation':
+        """根据环境变量创建邮件操作
+
+        可选的环境变量：
+        - EMAIL_SMTP_HOST / EMAIL_SMTP_PORT: 发件邮箱的 SMTP 服务器及端口（默认 smtp.163.com:465）
+        - EMAIL_RATE_PER_MINUTE / EMAIL_DAILY_QUOTA: 发件邮箱每分钟及每日发送上限（默认按 SMTP 服务器，0 表示不限）
+        - EMAIL_SENDERS_FILE: 其他发件账户（JSON 数组，元素含 user、password，可选 host、port、per_minute、daily_quota）
+        - EMAIL_SENDER_SELECTION: 发件账户选择方式（round_robin / least_loaded，默认 round_robin）
+        - RATE_LIMIT_DB: 限流状态文件，设置后多个进程共享发送额度
+
+        Args:
+            email_user: 发件邮箱
+            email_pass: 邮箱授权码
+            email_to: 收件邮箱
+
+        Returns:
+            EmailOperation 实例
+        """
+        db_path = os.getenv('RATE_LIMIT_DB', '') or None
+        primary = {
+            'user': email_user,
+            'password': email_pass,
+            'host': os.getenv('EMAIL_SMTP_HOST', '') or 'smtp.163.com',
+            'port': int(os.getenv('EMAIL_SMTP_PORT', '') or 465),
+        }
+        if os.getenv('EMAIL_RATE_PER_MINUTE', ''):
+            primary['per_minute'] = float(os.getenv('EMAIL_RATE_PER_MINUTE', ''))
+        if os.getenv('EMAIL_DAILY_QUOTA', ''):
+            primary['daily_quota'] = int(os.getenv('EMAIL_DAILY_QUOTA', ''))
+        configs = [primary]
+        senders_file = os.getenv('EMAIL_SENDERS_FILE', '')
+        if senders_file:
+            with open(senders_file, 'r', encoding='utf-8') as f:
+                configs.extend(json.load(f))
+        operation = EmailOperation(
+            email_user, email_pass, email_to, host=primary['host'], port=primary['port'],
+            senders=[SMTPSender.from_config(config, db_path) for config in configs],
+            selection=os.getenv('EMAIL_SENDER_SELECTION', '') or 'round_robin',
+        )
+        if len(operation.senders) > 1:
+            get_logger().info(f"已配置 {len(operation.senders)} 个发件账户（{operation.selection}）")
+        return operation
+
+    def _candidates(self) -> List[SMTPSender]:
+        """按选择方式排列的发件账户"""
+        if self.selection == "least_loaded":
+            return sorted(self.senders, key=lambda sender: sender.load)
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.senders)
+        return self.senders[start:] + self.senders[:start]
+
+    def execute(self, subject: str, content: str, to: str | None = None, category: str | None = None) -> bool:
         """发送邮件
         
         Args:
             subject: 邮件主题
             content: 邮件内容
+            to: 收件邮箱，默认为初始化时的收件邮箱
+            category: 通知类别，决定发送优先级（"alert" 为高，"digest" 为低）
             
         Returns:
             发送成功返回 True，失败返回 False
         """
-        try:
-            yag = yagmail.SMTP(
-                user=self.email_user,
-                password=self.email_pass,
-                host='smtp.163.com'
+        priority = priority_for(category)
+        candidates = self._candidates()
+        last_error: Optional[Exception] = None
+        # 先找立即有额度的账户，都没有时再等待每分钟额度恢复
+        for max_wait in (0, self.max_wait):
+            for sender in list(candidates):
+                if sender.budget is not None and not sender.budget.acquire(priority, max_wait=max_wait):
+                    continue
+                candidates.remove(sender)
+                try:
+                    sender.send(subject, content, to or self.email_to)
+                except Exception as e:
+                    if sender.budget is not None:
+                        sender.budget.refund()
+                    last_error = e
+                    if candidates:
+                        self.logger.warning(f"发件账户 {sender.user} 发送失败: {e}，改用其他账户")
+                    continue
+                self.logger.success(f"邮件已发送: {subject}")
+                return True
+            if not self.max_wait:
+                break
+        if last_error is not None:
+            self.logger.error(f"发送邮件失败: {last_error}")
+        elif candidates:
+            # 用 info 而非 warning：告警邮件同样需要额度，额度用完时触发告警只会产生更多无法发送的邮件
+            self.logger.info(f"所有发件账户的发送额度已用完，邮件暂未发送（设置了发送队列时稍后重试）: {subject}")
+        return False
+
+    def get_stats(self) -> List[dict]:
+        """获取各发件账户的发送统计与额度状态"""
+        return [sender.snapshot() for sender in self.senders]
+
+    def close(self) -> None:
+        """关闭空闲的 SMTP 连接"""
+        for sender in self.senders:
+            sender.close()
+
+
+# Webhook 请求体格式：事件列表 -> JSON 请求体
+WebhookFormatter = Callable[[List[dict]], dict]
+
+
+def _json_payload(events: List[dict]) -> dict:
+    """通用 JSON 格式：{"events": [{subject, content, to, category, timestamp}, ...]}"""
+    return {"events": events}
+
+
+def _text_payload(events: List[dict]) -> dict:
+    """群聊机器人文本消息格式（企业微信 / 钉钉），多条事件合并为一条消息"""
+    text = "\n\n".join(f"{event['subject']}\n{event['content'].strip()}" for event in events)
+    return {"msgtype": "text", "text": {"content": text}}
+
+
+WEBHOOK_FORMATTERS: Dict[str, WebhookFormatter] = {"json": _json_payload, "text": _text_payload}
+
+# 所有 Webhook 操作共享的 HTTP 会话（按 Webhook 主机挂载连接池）
+_webhook_session: Optional[requests.Session] = None
+_webhook_session_lock = threading.Lock()
+
+
+def get_webhook_session() -> requests.Session:
+    """获取 Webhook 共享的 HTTP 会话（keep-alive 连接在各 Webhook 操作间复用）
+
+    Returns:
+        requests.Session 实例
+    """
+    global _webhook_session
+    with _webhook_session_lock:
+        if _webhook_session is None:
+            _webhook_session = requests.Session()
+        return _webhook_session
+
+
+class _WebhookBatch:
+    """等待一起发送的一批事件"""
+
+    def __init__(self):
+        self.events: List[dict] = []
+        self.done = threading.Event()
+        self.result = False
+        self.timer: Optional[threading.Timer] = None
+
+
+class WebhookOperation(Operation):
+    """Webhook 推送操作（HTTP POST 到群聊机器人或其他 HTTP 接口）。
+
+    batch_window 内并发调用 execute() 的事件合并为一个请求（最多 batch_size 条），
+    各调用方等待所在批次的结果；同时进行的请求数不超过 max_concurrency，连接来自共享会话的 keep-alive 连接池。
+    连接错误、超时、429 和 5xx 按 retry_policy 退避重试（优先使用 Retry-After），
+    退避期间该 Webhook 的其他批次也等待，其他 4xx 不重试。
+    """
+
+    def __init__(self, url: str, formatter: str | WebhookFormatter = "json", headers: Optional[Dict[str, str]] = None,
+                 batch_size: int = 20, batch_window: float = 0.2, max_concurrency: int = 4,
+                 retry_policy: Optional[RetryPolicy] = None, max_attempts: int = 3,
+                 connect_timeout: float = 5, read_timeout: float = 10,
+                 session: Optional[requests.Session] = None):
+        """初始化 Webhook 操作
+
+        Args:
+            url: Webhook 地址
+            formatter: 请求体格式（"json" / "text"）或自定义函数 (事件列表) -> 请求体
+            headers: 附加的请求头（如鉴权）
+            batch_size: 单个请求最多包含的事件数，1 表示不合并
+            batch_window: 等待合并的最长时间（秒），0 表示不等待
+            max_concurrency: 同时进行的请求数上限（也是连接池大小）
+            retry_policy: 失败重试的退避策略，默认首次 0.5 秒、最长 30 秒
+            max_attempts: 单个批次最多请求次数
+            connect_timeout: 连接超时（秒）
+            read_timeout: 读取超时（秒）
+            session: HTTP 会话，默认使用共享会话
+        """
+        if batch_size <= 0 or max_concurrency <= 0 or max_attempts <= 0:
+            raise ValueError("批次大小、并发数和最多请求次数必须大于 0")
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https") or not parsed.netloc:
+            raise ValueError(f"无效的 Webhook 地址: {url}")
+        self.url = url
+        self.host = parsed.hostname or parsed.netloc
+        self.formatter = WEBHOOK_FORMATTERS[formatter] if isinstance(formatter, str) else formatter
+        self.headers = dict(headers or {})
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.retry_policy = retry_policy or RetryPolicy(base_delay=0.5, max_delay=30)
+        self.max_attempts = max_attempts
+        self.timeout = (connect_timeout, read_timeout)
+        self.logger = get_logger()
+        self.session = session or get_webhook_session()
+        # 该主机的连接池与并发数一致；同一主机的多个 Webhook 共用先挂载的连接池
+        prefix = f"{parsed.scheme}://{parsed.netloc}/"
+        if prefix not in self.session.adapters:
+            policy = HostPolicy(pool_maxsize=max_concurrency, max_retries=0, connect_timeout=connect_timeout,
+                                read_timeout=read_timeout, pool_block=True)
+            self.session.mount(prefix, CountingHTTPAdapter(self.host, policy, get_transport_stats()))
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._batch: Optional[_WebhookBatch] = None
+        # 连续失败次数与退避结束时间（monotonic），成功后清零
+        self._failures = 0
+        self._backoff_until = 0.0
+        self.stats: Dict[str, int] = {"events": 0, "batches": 0, "requests": 0, "retries": 0, "failed": 0}
+
+    @staticmethod
+    def from_environment() -> Dict[str, 'WebhookOperation']:
+        """根据环境变量创建 Webhook 操作（可选功能）
+
+        需要的环境变量：
+        - WEBHOOK_URLS: Webhook 地址，多个用逗号分隔，未设置则不启用
+        - WEBHOOK_FORMAT: 请求体格式 json / text（可选，默认 json）
+        - WEBHOOK_BATCH_SIZE / WEBHOOK_BATCH_WINDOW: 单个请求最多事件数及合并等待秒数（可选，默认 20 / 0.2）
+        - WEBHOOK_CONCURRENCY: 每个 Webhook 同时进行的请求数（可选，默认 4）
+
+        Returns:
+            {操作名: WebhookOperation}，操作名依次为 webhook1、webhook2……，未启用时为空字典
+        """
+        urls = [url.strip() for url in os.getenv('WEBHOOK_URLS', '').split(',') if url.strip()]
+        return {
+            f"webhook{index}": WebhookOperation(
+                url,
+                formatter=os.getenv('WEBHOOK_FORMAT', '') or 'json',
+                batch_size=int(os.getenv('WEBHOOK_BATCH_SIZE', '') or 20),
+                batch_window=float(os.getenv('WEBHOOK_BATCH_WINDOW', '') or 0.2),
+                max_concurrency=int(os.getenv('WEBHOOK_CONCURRENCY', '') or 4),
             )
-            yag.send(to=self.email_to, subject=subject, contents=content)
-            self.logger.success(f"邮件已发送: {subject}")
-            return True
+            for index, url in enumerate(urls, 1)
+        }
+
+    def execute(self, subject: str, content: str, to: str | None = None, category: str | None = None) -> bool:
+        """推送一条事件（与同时到达的其他事件合并为一个请求）
+
+        Args:
+            subject: 主题
+            content: 内容
+            to: 收件人（写入事件，由接收方决定如何使用）
+            category: 通知类别
+
+        Returns:
+            所在批次推送成功返回 True，失败返回 False
+        """
+        event = {"subject": subject, "content": content, "to": to, "category": category, "timestamp": time.time()}
+        with self._lock:
+            self.stats["events"] += 1
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _WebhookBatch()
+                if self.batch_size > 1 and self.batch_window > 0:
+                    batch.timer = threading.Timer(self.batch_window, self._flush, args=(batch,))
+                    batch.timer.daemon = True
+                    batch.timer.start()
+            batch.events.append(event)
+            full = len(batch.events) >= self.batch_size or batch.timer is None
+            if full:
+                self._batch = None
+        if full:
+            if batch.timer is not None:
+                batch.timer.cancel()
+            self._send_batch(batch)
+        else:
+            batch.done.wait()
+        return batch.result
+
+    def _flush(self, batch: _WebhookBatch) -> None:
+        """合并等待时间到：发送尚未发送的批次"""
+        with self._lock:
+            if self._batch is not batch:
+                return
+            self._batch = None
+        self._send_batch(batch)
+
+    def _send_batch(self, batch: _WebhookBatch) -> None:
+        """发送一个批次，并通知等待的调用方"""
+        try:
+            with self._slots:
+                batch.result = self._post(batch.events)
         except Exception as e:
-            self.logger.error(f"发送邮件失败: {e}")
-            return False
+            self.logger.error(f"Webhook {self.host} 推送异常: {e}")
+            batch.result = False
+        finally:
+            with self._lock:
+                self.stats["batches"] += 1
+                if not batch.result:
+                    self.stats["failed"] += len(batch.events)
+            batch.done.set()
+
+    def _post(self, events: List[dict]) -> bool:
+        """发送请求，可重试的失败按退避策略重试"""
+        payload = self.formatter(events)
+        error = ""
+        for attempt in range(1, self.max_attempts + 1):
+            wait = self._backoff_until - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            retry_after = None
+            try:
+                response = self.session.post(self.url, json=payload, headers=self.headers, timeout=self.timeout)
+                with self._lock:
+                    self.stats["requests"] += 1
+                if response.status_code < 300:
+                    with self._lock:
+                        self._failures = 0
+                        self._backoff_until = 0.0
+                    return True
+                error = f"HTTP {response.status_code}"
+                if response.status_code != 429 and response.status_code < 500:
+                    break
+                retry_after = self._retry_after(response)
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            with self._lock:
+                self._failures += 1
+                delay = retry_after if retry_after is not None else self.retry_policy.delay(self._failures)
+                self._backoff_until = max(self._backoff_until, time.monotonic() + delay)
+                if attempt < self.max_attempts:
+                    self.stats["retries"] += 1
+        self.logger.error(f"Webhook {self.host} 推送 {len(events)} 条事件失败: {error}")
+        return False
+
+    def _retry_after(self, response: requests.Response) -> Optional[float]:
+        """解析 Retry-After（秒数形式），不超过退避上限"""
+        try:
+            return min(float(response.headers.get("Retry-After", "")), self.retry_policy.max_delay)
+        except ValueError:
+            return None
+
+    def close(self) -> None:
+        """立即发送等待合并的事件"""
+        with self._lock:
+            batch, self._batch = self._batch, None
+        if batch is not None:
+            if batch.timer is not None:
+                batch.timer.cancel()
+            self._send_batch(batch)
 
 
 class OperationManager:
-    """操作管理器，统一管理所有操作"""
+    """操作管理器，统一管理所有操作。
+
+    send_email() 发出的通知送往所有通知渠道（默认只有 email，可用 set_channels() 加入 Webhook 等操作）；
+    设置合并器后，按通知类别的合并窗口把同一收件人的邮件合并为汇总邮件；
+    设置发送队列后，每个渠道各写入一条队列记录即返回，由队列的后台线程调用 deliver() 投递并各自重试，
+    未设置队列时各渠道并行发送。
+    """
     
     def __init__(self):
         """初始化操作管理器"""
         self.operations = {}
         self.logger = get_logger()
+        self.delivery_queue: Optional[NotificationQueue] = None
+        self.coalescer: Optional[NotificationCoalescer] = None
+        self.channels: List[str] = ["email"]
+        self._fan_out_executor: Optional[ThreadPoolExecutor] = None
+        self._fan_out_lock = threading.Lock()
     
     def register_operation(self, name: str, operation: Operation) -> None:
         """注册操作
@@ -94,22 +784,185 @@ class OperationManager:
             raise KeyError(f"操作 '{name}' 不存在")
         return self.operations[name]
     
-    def send_email(self, subject: str, content: str) -> bool:
-        """便捷方法：发送邮件
+    def set_delivery_queue(self, queue: Optional[NotificationQueue]) -> None:
+        """设置通知发送队列并启动投递线程
         
         Args:
-            subject: 邮件主题
-            content: 邮件内容
+            queue: 发送队列，传 None 恢复同步发送（原队列停止投递，未投递的通知留在暂存文件中）
+        """
+        if self.delivery_queue is not None and self.delivery_queue is not queue:
+            self.delivery_queue.stop()
+        self.delivery_queue = queue
+        if self.coalescer is not None:
+            self.coalescer.set_store(queue)
+        if queue is not None:
+            queue.start(self.deliver)
+            self.logger.info(f"通知发送队列已启用（{queue.spool_path}，{queue.workers} 个投递线程）")
+    
+    def set_coalescer(self, coalescer: Optional[NotificationCoalescer]) -> None:
+        """设置通知合并器
+        
+        Args:
+            coalescer: 合并器，传 None 表示不合并（原合并器暂存的通知立即发送）
+        """
+        if self.coalescer is not None and self.coalescer is not coalescer:
+            self.coalescer.flush()
+        self.coalescer = coalescer
+        if coalescer is not None:
+            coalescer.send = self._dispatch
+            # 暂存待合并的通知与发送队列保存在同一文件中，重启后不丢失
+            coalescer.set_store(self.delivery_queue)
+            rules = "，".join(f"{category} {window:g} 秒" for category, window in coalescer.rules.items())
+            self.logger.info(f"通知合并已启用（{rules}）")
+    
+    def set_channels(self, channels: List[str]) -> None:
+        """设置通知渠道
+        
+        Args:
+            channels: 操作名称列表（如 ["email", "webhook1"]），均需已注册
+            
+        Raises:
+            KeyError: 操作不存在
+        """
+        for name in channels:
+            self.get_operation(name)
+        self.channels = list(channels)
+        self.logger.info(f"通知渠道: {', '.join(self.channels)}")
+    
+    def start(self) -> None:
+        """启动发送队列的投递线程（close() 之后再次使用时调用）"""
+        if self.delivery_queue is not None and not self.delivery_queue.running:
+            self.delivery_queue.start(self.deliver)
+    
+    def deliver(self, operation: str, subject: str, content: str, to: str | None = None,
+                category: str | None = None) -> bool:
+        """立即通过指定操作发送通知（发送队列的投递函数）
+        
+        Args:
+            operation: 操作名称
+            subject: 主题
+            content: 内容
+            to: 收件人，默认使用操作配置的收件人
+            category: 通知类别，决定发送优先级
             
         Returns:
             发送成功返回 True，失败返回 False
         """
         try:
-            email_op = self.get_operation("email")
-            return email_op.execute(subject, content)
+            return self.get_operation(operation).execute(subject, content, to=to, category=category)
         except KeyError:
-            self.logger.error("邮件操作未注册")
+            self.logger.error(f"{operation} 操作未注册")
             return False
+    
+    def send_email(self, subject: str, content: str, to: str | None = None, category: str | None = None) -> bool:
+        """便捷方法：发送通知到所有通知渠道（设置了合并器时可能暂存合并，设置了发送队列时写入队列即返回）
+        
+        Args:
+            subject: 邮件主题
+            content: 邮件内容
+            to: 收件邮箱，默认使用邮件操作配置的收件邮箱
+            category: 通知类别（如 "grades"、"balance"），决定合并窗口；"alert" 为告警，发送时优先占用额度
+            
+        Returns:
+            至少一个渠道发送成功、已暂存合并或已写入发送队列返回 True，失败返回 False
+        """
+        if self.coalescer is not None:
+            return self.coalescer.submit(category, subject, content, to)
+        return self._dispatch(subject, content, to, category)
+    
+    def _dispatch(self, subject: str, content: str, to: str | None = None, category: str | None = None) -> bool:
+        """发送到所有通知渠道：写入发送队列，未设置队列或写入失败的渠道直接并行发送
+        
+        Returns:
+            至少一个渠道发送成功或已写入队列返回 True（避免部分渠道失败时应用重复通知）
+        """
+        direct = list(self.channels)
+        if self.delivery_queue is not None:
+            direct = []
+            for channel in self.channels:
+                try:
+                    self.delivery_queue.enqueue(channel, subject, content, to, category)
+                except Exception as e:
+                    # 暂存文件不可写（如磁盘已满）时退回同步发送
+                    self.logger.warning(f"写入发送队列失败: {e}，{channel} 改为直接发送")
+                    direct.append(channel)
+            if len(direct) < len(self.channels):
+                if direct:
+                    self.fan_out(subject, content, to, category, channels=direct)
+                return True
+        if len(direct) == 1:
+            return self.deliver(direct[0], subject, content, to, category)
+        return any(self.fan_out(subject, content, to, category, channels=direct).values())
+    
+    def fan_out(self, subject: str, content: str, to: str | None = None, category: str | None = None,
+                channels: Optional[List[str]] = None) -> Dict[str, bool]:
+        """立即把一条通知并行发送到多个渠道（不经过合并器和发送队列）
+        
+        Args:
+            subject: 主题
+            content: 内容
+            to: 收件人
+            category: 通知类别
+            channels: 操作名称列表，默认为全部通知渠道
+            
+        Returns:
+            {渠道: 是否发送成功}
+        """
+        channels = list(channels or self.channels)
+        if len(channels) == 1:
+            return {channels[0]: self.deliver(channels[0], subject, content, to, category)}
+        with self._fan_out_lock:
+            if self._fan_out_executor is None:
+                self._fan_out_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fan-out")
+            futures = {
+                channel: self._fan_out_executor.submit(self.deliver, channel, subject, content, to, category)
+                for channel in channels
+            }
+        results = {}
+        for channel, future in futures.items():
+            try:
+                results[channel] = future.result()
+            except Exception as e:
+                self.logger.error(f"{channel} 发送异常: {e}")
+                results[channel] = False
+        return results
+
+    def close(self) -> None:
+        """发送暂存待合并的通知，停止发送队列的投递线程，并释放所有操作持有的资源（如空闲的 SMTP 连接）"""
+        if self.coalescer is not None:
+            self.coalescer.flush()
+        if self.delivery_queue is not None:
+            self.delivery_queue.stop()
+        with self._fan_out_lock:
+            executor, self._fan_out_executor = self._fan_out_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for name, operation in list(self.operations.items()):
+            try:
+                operation.close()
+            except Exception as e:
+                self.logger.warning(f"关闭操作 {name} 失败: {e}")
+    
+    def get_notification_stats(self) -> Dict[str, object]:
+        """获取通知合并、发送队列、发件账户与 Webhook 的统计
+        
+        Returns:
+            {"coalescer": 合并统计, "queue": 队列统计, "senders": 各发件账户的统计与额度,
+             "webhooks": {操作名: 推送统计}}，未启用的部分为空
+        """
+        stats: Dict[str, object] = {"coalescer": {}, "queue": {}, "senders": [], "webhooks": {}}
+        if self.coalescer is not None:
+            stats["coalescer"] = self.coalescer.get_stats()
+        if self.delivery_queue is not None:
+            stats["queue"] = dict(self.delivery_queue.stats, pending=self.delivery_queue.pending)
+        email = self.operations.get("email")
+        if isinstance(email, EmailOperation):
+            stats["senders"] = email.get_stats()
+        stats["webhooks"] = {
+            name: dict(operation.stats) for name, operation in self.operations.items()
+            if isinstance(operation, WebhookOperation)
+        }
+        return stats
 
 
 # 全局操作管理器实例
@@ -0,0 +1,194 @@
+"""UESTC 服务系统 - 限流器
+令牌桶限流，用于 IDAS 登录及各主机请求速率控制。支持进程内和基于 SQLite 文件的跨进程共享，
+突发请求按预约顺序排队等待（可设置最长等待时间），而不是直接失败后引发重试风暴
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+
+class RateLimiter(ABC):
+    """令牌桶限流器基类。
+
+    采用预约模式：令牌不足时先扣减（令牌数可为负），调用方睡眠到自己的预约时刻再执行，
+    因此并发请求会被均匀摊开，且无需轮询。
+    """
+
+    # 预约是否可能阻塞（如等待其他进程的文件锁），为 True 时异步版本在线程池中预约
+    BLOCKING_RESERVE = False
+
+    def __init__(self, rate: float, capacity: float):
+        """初始化限流器
+
+        Args:
+            rate: 令牌补充速率（个/秒）
+            capacity: 桶容量（允许的最大突发数）
+        """
+        if rate <= 0:
+            raise ValueError("令牌补充速率必须大于 0")
+        if capacity <= 0:
+            raise ValueError("桶容量必须大于 0")
+        self.rate = rate
+        self.capacity = capacity
+
+    @abstractmethod
+    def _reserve(self, tokens: float, max_wait: Optional[float]) -> Optional[float]:
+        """预约令牌
+
+        Args:
+            tokens: 需要的令牌数
+            max_wait: 最长等待时间（秒），None 表示不限
+
+        Returns:
+            需要等待的秒数（0 表示立即可用）；等待时间超过 max_wait 时返回 None，且不扣减令牌
+        """
+        pass
+
+    def _refill(self, tokens: float, updated_at: float, now: float) -> float:
+        """按经过的时间补充令牌"""
+        return min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+    def _take(self, current: float, tokens: float, max_wait: Optional[float]) -> tuple[float, Optional[float]]:
+        """在当前令牌数上执行预约
+
+        Returns:
+            (扣减后的令牌数, 等待秒数)；超过 max_wait 时等待秒数为 None，令牌数不变
+        """
+        if current >= tokens:
+            return current - tokens, 0.0
+        wait = (tokens - current) / self.rate
+        if max_wait is not None and wait > max_wait:
+            return current, None
+        return current - tokens, wait
+
+    def acquire(self, tokens: float = 1, max_wait: Optional[float] = None) -> bool:
+        """获取令牌，必要时阻塞等待
+
+        Args:
+            tokens: 需要的令牌数
+            max_wait: 最长等待时间（秒），None 表示一直等待
+
+        Returns:
+            获取成功返回 True；预计等待超过 max_wait 时立即返回 False
+        """
+        wait = self._reserve(tokens, max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    async def aacquire(self, tokens: float = 1, max_wait: Optional[float] = None) -> bool:
+        """acquire() 的异步版本，等待期间不阻塞事件循环"""
+        if self.BLOCKING_RESERVE:
+            wait = await asyncio.to_thread(self._reserve, tokens, max_wait)
+        else:
+            wait = self._reserve(tokens, max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+
+class TokenBucket(RateLimiter):
+    """进程内令牌桶（线程安全）"""
+
+    def __init__(self, rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float, max_wait: Optional[float]) -> Optional[float]:
+        with self._lock:
+            now = time.monotonic()
+            current = self._refill(self._tokens, self._updated_at, now)
+            self._tokens, wait = self._take(current, tokens, max_wait)
+            self._updated_at = now
+            return wait
+
+
+class SQLiteTokenBucket(RateLimiter):
+    """基于 SQLite 文件的令牌桶，同一文件的多个进程共享同一个桶"""
+
+    # BEGIN IMMEDIATE 在其他进程持有写锁时最多等待 30 秒
+    BLOCKING_RESERVE = True
+
+    def __init__(self, db_path: str, name: str, rate: float, capacity: float):
+        """初始化跨进程令牌桶
+
+        Args:
+            db_path: SQLite 数据库文件路径
+            name: 桶名称（同一数据库中可存放多个桶）
+            rate: 令牌补充速率（个/秒）
+            capacity: 桶容量
+        """
+        super().__init__(rate, capacity)
+        self.db_path = db_path
+        self.name = name
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _reserve(self, tokens: float, max_wait: Optional[float]) -> Optional[float]:
+        with self._lock:
+            cursor = self._conn.cursor()
+            # BEGIN IMMEDIATE 获取写锁，保证多个进程间的读-改-写是原子的
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = cursor.execute(
+                    "SELECT tokens, updated_at FROM token_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                current = self._refill(row[0], row[1], now) if row else float(self.capacity)
+                remaining, wait = self._take(current, tokens, max_wait)
+                cursor.execute(
+                    "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    (self.name, remaining, now),
+                )
+                cursor.execute("COMMIT")
+                return wait
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        self._conn.close()
+
+
+# 全局限流器注册表：同名限流器在进程内共享
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, rate: float, capacity: float, db_path: Optional[str] = None) -> RateLimiter:
+    """获取（首次调用时创建）指定名称的限流器
+
+    Args:
+        name: 限流器名称，如 "login"、"host:idas.uestc.edu.cn"
+        rate: 令牌补充速率（个/秒）
+        capacity: 桶容量
+        db_path: SQLite 文件路径；提供时创建跨进程令牌桶，否则为进程内令牌桶
+
+    Returns:
+        RateLimiter 实例
+    """
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            if db_path:
+                _rate_limiters[name] = SQLiteTokenBucket(db_path, name, rate, capacity)
+            else:
+                _rate_limiters[name] = TokenBucket(rate, capacity)
+        return _rate_limiters[name]
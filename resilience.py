@@ -0,0 +1,228 @@
+"""UESTC 服务系统 - 重试退避与熔断
+失败重试按指数退避并加随机抖动，避免大量任务在同一时刻重试；
+每个上游主机一个熔断器，主机持续出错时快速拒绝请求，半开状态下只放行一个探测请求
+"""
+
+import math
+import random
+import threading
+from typing import Dict, Optional
+import requests
+from clock import get_clock
+
+
+class RetryPolicy:
+    """指数退避重试策略（带抖动）。
+
+    第 n 次连续失败后的等待时间为 min(max_delay, base_delay * multiplier ** (n - 1))，
+    再按 jitter 比例随机缩短：jitter=0.5 时实际等待在 [50%, 100%] 之间均匀分布。
+    """
+
+    def __init__(self, base_delay: float = 60, max_delay: float = 3600, multiplier: float = 2,
+                 jitter: float = 0.5):
+        """初始化重试策略
+
+        Args:
+            base_delay: 首次失败后的等待时间（秒）
+            max_delay: 等待时间上限（秒）
+            multiplier: 每次连续失败后等待时间的倍数
+            jitter: 随机缩短的最大比例（0 ~ 1），0 表示不抖动
+        """
+        if base_delay <= 0 or max_delay < base_delay:
+            raise ValueError("重试等待时间必须大于 0，且上限不小于首次等待时间")
+        if multiplier < 1:
+            raise ValueError("退避倍数不能小于 1")
+        if not 0 <= jitter <= 1:
+            raise ValueError("抖动比例必须在 0 到 1 之间")
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def backoff(self, failures: int) -> float:
+        """计算不含抖动的等待时间
+
+        Args:
+            failures: 连续失败次数（>= 1）
+
+        Returns:
+            等待秒数
+        """
+        # 先用对数比较指数，避免连续失败次数很大时溢出
+        exponent = max(failures - 1, 0)
+        if self.multiplier > 1 and exponent * math.log(self.multiplier) >= math.log(self.max_delay / self.base_delay):
+            return self.max_delay
+        return min(self.max_delay, self.base_delay * self.multiplier ** exponent)
+
+    def delay(self, failures: int) -> float:
+        """计算第 failures 次连续失败后的等待时间（含抖动）
+
+        Args:
+            failures: 连续失败次数（>= 1）
+
+        Returns:
+            等待秒数
+        """
+        delay = self.backoff(failures)
+        return delay * (1 - self.jitter * random.random())
+
+    def get_description(self) -> str:
+        """获取策略描述"""
+        return (f"指数退避 {self.base_delay:g}s × {self.multiplier:g}^n，"
+                f"上限 {self.max_delay:g}s，抖动 {self.jitter:.0%}")
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """熔断器打开，请求被快速拒绝"""
+
+
+class CircuitBreaker:
+    """单个上游主机的熔断器（线程安全）。
+
+    - closed：正常放行，连续失败达到 failure_threshold 次后打开
+    - open：拒绝所有请求，打开时长按 RetryPolicy 随连续打开次数指数增长
+    - half_open：打开时长结束后只放行一个探测请求，成功则关闭，失败则再次打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_policy: Optional[RetryPolicy] = None,
+                 probe_timeout: float = 60):
+        """初始化熔断器
+
+        Args:
+            name: 熔断器名称（通常为主机名）
+            failure_threshold: 连续失败多少次后打开
+            reset_policy: 打开时长策略，默认首次 30 秒、最长 10 分钟
+            probe_timeout: 半开探测请求的最长等待时间（秒），超时未报告结果时允许新的探测
+        """
+        if failure_threshold <= 0:
+            raise ValueError("熔断阈值必须大于 0")
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_policy = reset_policy or RetryPolicy(base_delay=30, max_delay=600)
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        # 连续打开次数（决定打开时长），关闭后清零
+        self._trips = 0
+        self._open_until = 0.0
+        self._probe_started: Optional[float] = None
+        # 统计：被拒绝的请求数、打开次数
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        """当前状态（open 状态到期后视为 half_open）"""
+        with self._lock:
+            if self._state == self.OPEN and get_clock().time() >= self._open_until:
+                return self.HALF_OPEN
+            return self._state
+
+    @property
+    def open_until(self) -> float:
+        """打开状态的结束时间戳（未打开时为 0）"""
+        return self._open_until if self._state == self.OPEN else 0.0
+
+    def is_open(self) -> bool:
+        """是否处于打开状态且未到探测时间（不改变状态，供调度器快速判断）"""
+        with self._lock:
+            return self._state == self.OPEN and get_clock().time() < self._open_until
+
+    def allow(self) -> bool:
+        """请求前调用：判断是否放行（半开状态下只放行一个探测请求）
+
+        Returns:
+            放行返回 True，否则返回 False
+        """
+        with self._lock:
+            now = get_clock().time()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if now < self._open_until:
+                    self.rejected += 1
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_started = None
+            # 半开：同一时间只有一个探测请求
+            if self._probe_started is not None and now - self._probe_started < self.probe_timeout:
+                self.rejected += 1
+                return False
+            self._probe_started = now
+            return True
+
+    def release(self) -> None:
+        """放行的请求未产生可判断的结果（如限流排队超时、已过截止时间、请求构造错误）时调用，
+        释放半开状态的探测名额，下一个请求即可探测，而不必等待 probe_timeout"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_started = None
+
+    def record_success(self) -> None:
+        """请求成功后调用"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trips = 0
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        """请求失败（连接错误、超时、5xx）后调用"""
+        with self._lock:
+            if self._state == self.OPEN:
+                # 打开前发出的请求迟到的失败，不再延长打开时间
+                return
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._trip()
+
+    def _trip(self) -> None:
+        """打开熔断器（调用方需持有锁）"""
+        self._trips += 1
+        self.opened += 1
+        self._state = self.OPEN
+        self._open_until = get_clock().time() + self.reset_policy.delay(self._trips)
+        self._probe_started = None
+        self._failures = 0
+
+    def snapshot(self) -> dict:
+        """获取熔断器状态快照"""
+        state = self.state
+        return {
+            "state": state,
+            "open_for": round(max(self._open_until - get_clock().time(), 0), 1) if state == self.OPEN else 0.0,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+# 各主机的熔断器（未设置的主机不熔断）
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def set_circuit_breaker(host: str, breaker: Optional[CircuitBreaker]) -> None:
+    """设置主机的熔断器
+
+    Args:
+        host: 主机名，如 "idas.uestc.edu.cn"
+        breaker: 熔断器，传 None 取消熔断
+    """
+    if breaker is None:
+        _circuit_breakers.pop(host, None)
+    else:
+        _circuit_breakers[host] = breaker
+
+
+def get_circuit_breaker(host: str) -> Optional[CircuitBreaker]:
+    """获取主机的熔断器，未设置返回 None"""
+    return _circuit_breakers.get(host)
+
+
+def get_circuit_breakers() -> Dict[str, CircuitBreaker]:
+    """获取所有已设置的熔断器 {主机: 熔断器}"""
+    return dict(_circuit_breakers)
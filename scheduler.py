@@ -1,12 +1,35 @@
 """UESTC 服务系统 - 任务调度器
-支持为各个应用模块设置不同的定时策略
+支持为各个应用模块设置不同的定时策略。当前时间统一从 clock.get_clock() 读取，
+替换为虚拟时钟后可由 simulation.SchedulerSimulation 快速回放
 """
 
+import contextvars
+import copy
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import queue
 import time
 import threading
-from typing import Optional, Callable, Dict, List
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Optional, Callable, Dict, Iterable, List, Set, Tuple
 from abc import ABC, abstractmethod
+from clock import get_clock
+from lease import Fence, LeaseCoordinator, LeaseLostError, SQLiteLeaseStore, fenced
 from logger import get_logger
+from metrics import Histogram
+from resilience import RetryPolicy, get_circuit_breaker
+from scheduler_state import SchedulerStateStore
+from transport import request_deadline
+
+
+def _stable_fraction(*parts) -> float:
+    """根据参数计算 [0, 1) 内的稳定哈希值（跨进程、跨重启一致）"""
+    key = "\x1f".join(str(part) for part in parts).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big") / 2 ** 64
 
 
 class SchedulePolicy(ABC):
@@ -24,6 +47,49 @@ class SchedulePolicy(ABC):
         """
         pass
     
+    def next_run_time(self, last_run_time: Optional[float]) -> float:
+        """计算下次应运行的时间戳
+        
+        默认实现基于 should_run()：当前应运行则返回现在，否则 60 秒后再判断。
+        子类应覆盖此方法给出精确时间，调度器据此休眠到期。
+        
+        Args:
+            last_run_time: 上次运行的时间戳，首次运行为 None
+            
+        Returns:
+            下次运行的时间戳
+        """
+        now = get_clock().time()
+        if self.should_run(last_run_time):
+            return now
+        return now + 60
+    
+    def for_task(self, task_name: str) -> 'SchedulePolicy':
+        """获取用于指定任务的策略实例（调度器添加任务时调用）
+        
+        需要按任务名错峰的策略返回绑定了任务名的副本，默认返回自身。
+        
+        Args:
+            task_name: 任务名称
+            
+        Returns:
+            SchedulePolicy 实例
+        """
+        return self
+    
+    def following_run_time(self, run_time: float) -> Optional[float]:
+        """按计划，在 run_time 这次运行之后的下一次运行时间（不考虑实际耗时，不改变策略状态）
+        
+        调度器据此判断任务是否超时运行（运行结束时已过了下一次运行时间）。
+        
+        Args:
+            run_time: 本次运行原定的时间戳
+            
+        Returns:
+            下一次运行的时间戳，无法确定时返回 None
+        """
+        return None
+    
     @abstractmethod
     def get_description(self) -> str:
         """获取策略描述
@@ -35,43 +101,353 @@ class SchedulePolicy(ABC):
 
 
 class IntervalPolicy(SchedulePolicy):
-    """间隔定时策略，每隔指定秒数运行一次"""
+    """间隔定时策略，每隔指定秒数运行一次。
+
+    spread=True 时按任务名哈希得到固定相位，任务在各自的时间槽
+    （相位 + k × 间隔）上运行：大量使用相同间隔的任务均匀分布在整个间隔内，
+    且不随运行耗时漂移；jitter 在每个时间槽上再叠加确定性的随机延迟。
+    """
     
-    def __init__(self, interval_seconds: int):
+    def __init__(self, interval_seconds: int, spread: bool = False, jitter: float = 0.0):
         """初始化间隔策略
         
         Args:
             interval_seconds: 间隔秒数
+            spread: 是否按任务名错峰（首次运行不再立即执行，而是等到自己的时间槽）
+            jitter: 每次运行的确定性延迟上限，占间隔的比例（0-1），仅 spread=True 时生效
         """
         if interval_seconds <= 0:
             raise ValueError("间隔秒数必须大于 0")
+        if not 0 <= jitter < 1:
+            raise ValueError("抖动比例必须在 [0, 1) 之间")
         self.interval_seconds = interval_seconds
+        self.spread = spread
+        self.jitter = jitter
+        # 绑定的任务名（for_task 设置），错峰相位和抖动由其哈希决定
+        self.task_name: Optional[str] = None
+        # 错峰相位（秒），绑定任务名时计算一次
+        self._phase = 0.0
+    
+    def for_task(self, task_name: str) -> 'IntervalPolicy':
+        """错峰时返回绑定任务名的副本"""
+        if not self.spread:
+            return self
+        bound = copy.copy(self)
+        bound.task_name = task_name
+        bound._phase = _stable_fraction(task_name, "phase") * self.interval_seconds
+        return bound
+    
+    def _slot_time(self, slot: int) -> float:
+        """第 slot 个时间槽的运行时间（相位 + 槽起点 + 抖动）"""
+        when = slot * self.interval_seconds + self._phase
+        if self.jitter:
+            when += _stable_fraction(self.task_name, "jitter", slot) * self.jitter * self.interval_seconds
+        return when
+    
+    def _next_slot_time(self, after: float) -> float:
+        """严格晚于 after 的下一个时间槽运行时间"""
+        slot = math.floor((after - self._phase) / self.interval_seconds)
+        # 抖动小于一个间隔，最多再看两个槽
+        for candidate in (slot, slot + 1, slot + 2):
+            when = self._slot_time(candidate)
+            if when > after:
+                return when
+        return self._slot_time(slot + 3)
     
     def should_run(self, last_run_time: Optional[float]) -> bool:
         """判断是否应该运行（首次运行或距上次运行超过间隔时间）"""
+        if self.spread:
+            return self.next_run_time(last_run_time) <= get_clock().time()
         if last_run_time is None:
             return True
-        return time.time() - last_run_time >= self.interval_seconds
+        return get_clock().time() - last_run_time >= self.interval_seconds
+    
+    def next_run_time(self, last_run_time: Optional[float]) -> float:
+        """首次立即运行，之后为上次运行时间加间隔；错峰时为下一个时间槽"""
+        if self.spread:
+            if last_run_time is None:
+                return self._next_slot_time(get_clock().time())
+            return self._next_slot_time(last_run_time)
+        if last_run_time is None:
+            return get_clock().time()
+        return last_run_time + self.interval_seconds
+    
+    def following_run_time(self, run_time: float) -> Optional[float]:
+        """下一个时间槽，未错峰时为一个间隔之后"""
+        if self.spread:
+            return self._next_slot_time(run_time)
+        return run_time + self.interval_seconds
     
     def get_description(self) -> str:
         """获取策略描述"""
         minutes = self.interval_seconds // 60
         seconds = self.interval_seconds % 60
         if minutes > 0:
-            return f"每 {minutes} 分 {seconds} 秒"
+            description = f"每 {minutes} 分 {seconds} 秒"
+        else:
+            description = f"每 {seconds} 秒"
+        if self.spread:
+            description += "（按任务名错峰）"
+        return description
+
+
+class CronExpressionPolicy(SchedulePolicy):
+    """Cron 表达式定时策略。
+
+    支持标准 5 字段表达式「分 时 日 月 周」：* 、a-b、*/n、a-b/n、逗号列表，
+    月份和星期可用英文缩写（jan、mon 等），星期 0 和 7 均表示周日；
+    日和周同时受限时满足其一即可（与 cron 一致）。下次触发时间逐字段跳转直接算出，无需轮询。
+
+    进程停止期间错过的触发按 catch_up 处理：
+    - skip: 丢弃错过的触发，等待下一次
+    - once: 立即补执行一次
+    - all: 按顺序补执行每一次错过的触发（最多 max_catch_up 次）
+
+    spread_seconds > 0 时，每个任务的触发时间按任务名哈希固定延后 [0, spread_seconds) 秒，
+    使大量相同表达式的任务分散开。
+    """
+    
+    CATCH_UP_MODES = ("skip", "once", "all")
+    
+    # 各字段的取值范围
+    _FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+    _FIELD_NAMES = ("分钟", "小时", "日", "月", "星期")
+    _MONTH_NAMES = {name: i + 1 for i, name in enumerate(
+        ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"))}
+    _WEEKDAY_NAMES = {name: i for i, name in enumerate(("sun", "mon", "tue", "wed", "thu", "fri", "sat"))}
+    
+    # 查找下次触发时间的最大跳转次数（表达式永远无法触发时，如 2 月 30 日）
+    _MAX_JUMPS = 2000
+    
+    def __init__(self, expression: str, catch_up: str = "skip", max_catch_up: int = 100,
+                 spread_seconds: float = 0):
+        """初始化 Cron 表达式策略
+        
+        Args:
+            expression: 5 字段 cron 表达式，如 "*/10 8-22 * * mon-fri"
+            catch_up: 错过触发的处理方式（skip / once / all）
+            max_catch_up: all 模式下最多补执行的次数
+            spread_seconds: 按任务名错峰的最大延后秒数，0 表示不错峰
+            
+        Raises:
+            ValueError: 表达式或参数不合法
+        """
+        if catch_up not in self.CATCH_UP_MODES:
+            raise ValueError(f"不支持的补执行方式: {catch_up}")
+        if spread_seconds < 0:
+            raise ValueError("错峰秒数不能为负")
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron 表达式应包含 5 个字段: {expression}")
+        
+        self.expression = expression
+        self.catch_up = catch_up
+        self.max_catch_up = max_catch_up
+        self.spread_seconds = spread_seconds
+        # 绑定任务名后的固定延后秒数
+        self.offset = 0.0
+        
+        minutes, hours, days, months, weekdays = (
+            self._parse_field(field, index) for index, field in enumerate(fields)
+        )
+        # 星期 7 等同于 0（周日）
+        weekdays = sorted({day % 7 for day in weekdays})
+        self.minutes: List[int] = minutes
+        self.hours: List[int] = hours
+        self.days: List[int] = days
+        self.months: List[int] = months
+        self.weekdays: List[int] = weekdays
+        self._day_restricted = fields[2] != "*"
+        self._weekday_restricted = fields[4] != "*"
+        
+        # 上一次返回的触发时间，以及已确认执行过的触发时间（all 模式按触发时间逐个补执行）
+        self._scheduled_fire: Optional[float] = None
+        self._consumed_fire: Optional[float] = None
+        self._caught_up = 0
+        
+        # 校验表达式可以触发
+        self.next_fire(get_clock().time())
+    
+    def _parse_field(self, field: str, index: int) -> List[int]:
+        """解析单个字段为排序后的取值列表"""
+        low, high = self._FIELD_RANGES[index]
+        names = self._MONTH_NAMES if index == 3 else self._WEEKDAY_NAMES if index == 4 else {}
+        
+        def value_of(token: str) -> int:
+            token = token.lower()
+            if token in names:
+                return names[token]
+            if not token.isdigit():
+                raise ValueError(f"{self._FIELD_NAMES[index]}字段取值不合法: {token}")
+            value = int(token)
+            if not low <= value <= high:
+                raise ValueError(f"{self._FIELD_NAMES[index]}字段取值超出范围 {low}-{high}: {value}")
+            return value
+        
+        values = set()
+        for part in field.split(","):
+            range_part, _, step_part = part.partition("/")
+            step = int(step_part) if step_part else 1
+            if step <= 0:
+                raise ValueError(f"{self._FIELD_NAMES[index]}字段步长必须大于 0: {part}")
+            if range_part == "*":
+                start, end = low, high
+            elif "-" in range_part:
+                start_token, end_token = range_part.split("-", 1)
+                start, end = value_of(start_token), value_of(end_token)
+                if start > end:
+                    raise ValueError(f"{self._FIELD_NAMES[index]}字段范围不合法: {part}")
+            else:
+                start = value_of(range_part)
+                end = high if step_part else start
+            values.update(range(start, end + 1, step))
+        return sorted(values)
+    
+    def _day_matches(self, day: "datetime.date") -> bool:
+        """判断日期是否满足日/周字段（二者都受限时满足其一即可）"""
+        day_ok = day.day in self.days
+        # date.weekday() 周一为 0，cron 周日为 0
+        weekday_ok = (day.weekday() + 1) % 7 in self.weekdays
+        if self._day_restricted and self._weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+    
+    def next_fire(self, after: float) -> float:
+        """计算指定时间之后的下一次触发时间
+        
+        Args:
+            after: 时间戳
+            
+        Returns:
+            严格晚于 after 的下一次触发时间戳
+            
+        Raises:
+            ValueError: 表达式永远无法触发
+        """
+        import bisect
+        import datetime
+        
+        current = datetime.datetime.fromtimestamp(after).replace(second=0, microsecond=0)
+        current += datetime.timedelta(minutes=1)
+        
+        for _ in range(self._MAX_JUMPS):
+            # 月份不匹配：跳到下一个允许月份的 1 日 00:00
+            if current.month not in self.months:
+                index = bisect.bisect_left(self.months, current.month)
+                if index < len(self.months):
+                    current = current.replace(month=self.months[index], day=1, hour=0, minute=0)
+                else:
+                    current = current.replace(year=current.year + 1, month=self.months[0], day=1, hour=0, minute=0)
+                continue
+            # 日期不匹配：跳到下一天 00:00
+            if not self._day_matches(current.date()):
+                current = (current + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            # 小时不匹配：跳到下一个允许的小时，否则下一天
+            if current.hour not in self.hours:
+                index = bisect.bisect_left(self.hours, current.hour)
+                if index < len(self.hours):
+                    current = current.replace(hour=self.hours[index], minute=0)
+                else:
+                    current = (current + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            # 分钟不匹配：跳到下一个允许的分钟，否则下一小时
+            if current.minute not in self.minutes:
+                index = bisect.bisect_left(self.minutes, current.minute)
+                if index < len(self.minutes):
+                    current = current.replace(minute=self.minutes[index])
+                else:
+                    current = current.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+            return current.timestamp()
+        
+        raise ValueError(f"Cron 表达式无法触发: {self.expression}")
+    
+    def for_task(self, task_name: str) -> 'CronExpressionPolicy':
+        """返回该任务专用的副本（补执行状态按任务保存，同一实例可用于多个任务），错峰时绑定固定延后"""
+        bound = copy.copy(self)
+        bound._scheduled_fire = None
+        bound._consumed_fire = None
+        bound._caught_up = 0
+        if self.spread_seconds:
+            bound.offset = _stable_fraction(task_name, "phase") * self.spread_seconds
+        return bound
+    
+    def _first_run_base(self, now: float) -> float:
+        """没有运行记录时计算触发时间的起点，默认只等待未来的触发"""
+        return now
+    
+    def _plan(self, last_run_time: Optional[float]) -> Tuple[float, Optional[float], int]:
+        """计算下次触发时间（不改变策略状态）
+        
+        Returns:
+            (未延后的触发时间, 已执行的触发时间, 连续补执行次数)
+        """
+        # 在未延后的时间轴上计算触发，返回前再加上错峰延后
+        now = get_clock().time() - self.offset
+        consumed, caught_up = self._consumed_fire, self._caught_up
+        if last_run_time is not None:
+            last_run_time -= self.offset
+        if last_run_time is None:
+            base = self._first_run_base(now)
+        else:
+            # 上次返回的触发时间之后已经运行过，说明该触发已执行
+            if self._scheduled_fire is not None and last_run_time >= self._scheduled_fire:
+                consumed = self._scheduled_fire
+            if consumed is not None and consumed <= last_run_time:
+                base = consumed
+            else:
+                base = last_run_time
+        
+        due = self.next_fire(base)
+        if due <= now:
+            if self.catch_up == "skip":
+                due = self.next_fire(now)
+            elif self.catch_up == "once":
+                due = now
+            elif caught_up >= self.max_catch_up:
+                due = self.next_fire(now)
+            else:
+                caught_up += 1
         else:
-            return f"每 {seconds} 秒"
+            caught_up = 0
+        return due, consumed, caught_up
+    
+    def next_run_time(self, last_run_time: Optional[float]) -> float:
+        """计算下次运行时间，错过的触发按 catch_up 处理（调度器安排任务时调用，会记录补执行进度）"""
+        due, self._consumed_fire, self._caught_up = self._plan(last_run_time)
+        self._scheduled_fire = due
+        return due + self.offset
+    
+    def following_run_time(self, run_time: float) -> Optional[float]:
+        """run_time 之后的下一次触发时间"""
+        return self.next_fire(run_time - self.offset) + self.offset
+    
+    def should_run(self, last_run_time: Optional[float]) -> bool:
+        """判断是否已到下次运行时间（只读，查询状态不会消耗补执行次数）"""
+        due, _, _ = self._plan(last_run_time)
+        return due + self.offset <= get_clock().time()
+    
+    def get_description(self) -> str:
+        """获取策略描述"""
+        catch_up = {"skip": "跳过错过的触发", "once": "错过时补执行一次", "all": "逐个补执行错过的触发"}
+        description = f"Cron {self.expression}（{catch_up[self.catch_up]}）"
+        if self.spread_seconds:
+            description += f"（按任务名错峰 {self.spread_seconds:.0f} 秒内）"
+        return description
 
 
-class CronPolicy(SchedulePolicy):
-    """Cron 定时策略，按特定时间点运行"""
+class CronPolicy(CronExpressionPolicy):
+    """每日定时策略，在每天的指定时间运行（首次启动时若今天已过该时间则立即运行一次）"""
     
-    def __init__(self, hour: int, minute: int):
-        """初始化 Cron 策略
+    def __init__(self, hour: int, minute: int, catch_up: str = "once", spread_seconds: float = 0):
+        """初始化每日定时策略
         
         Args:
             hour: 小时（0-23）
             minute: 分钟（0-59）
+            catch_up: 错过触发的处理方式，默认补执行一次
+            spread_seconds: 按任务名错峰的最大延后秒数，0 表示不错峰
         """
         if not (0 <= hour <= 23):
             raise ValueError("小时必须在 0-23 之间")
@@ -79,33 +455,27 @@ class CronPolicy(SchedulePolicy):
             raise ValueError("分钟必须在 0-59 之间")
         self.hour = hour
         self.minute = minute
+        super().__init__(f"{minute} {hour} * * *", catch_up=catch_up, spread_seconds=spread_seconds)
     
-    def should_run(self, last_run_time: Optional[float]) -> bool:
-        """判断是否应该在指定时间运行"""
+    def _first_run_base(self, now: float) -> float:
+        """从今天零点起算：今天的触发时间已过时按错过处理"""
         import datetime
-        now = datetime.datetime.now()
-        current_time = (now.hour, now.minute)
-        target_time = (self.hour, self.minute)
-        
-        if current_time < target_time:
-            return False
-        
-        if last_run_time is None:
-            return True
-        
-        # 检查距上次运行是否已超过 1 小时（防止重复运行）
-        last_run = datetime.datetime.fromtimestamp(last_run_time)
-        return (now - last_run).total_seconds() > 3600
+        midnight = datetime.datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        return midnight.timestamp() - 1
     
     def get_description(self) -> str:
         """获取策略描述"""
-        return f"每天 {self.hour:02d}:{self.minute:02d}"
+        description = f"每天 {self.hour:02d}:{self.minute:02d}"
+        if self.spread_seconds:
+            description += f"（按任务名错峰 {self.spread_seconds:.0f} 秒内）"
+        return description
 
 
 class ScheduledTask:
     """定时任务"""
     
-    def __init__(self, name: str, task_func: Callable[[], bool], policy: SchedulePolicy, retry_callback: Optional[Callable[[], bool]] = None):
+    def __init__(self, name: str, task_func: Callable[[], bool], policy: SchedulePolicy, retry_callback: Optional[Callable[[], bool]] = None,
+                 hosts: Iterable[str] = (), timeout: Optional[float] = None, shard: Optional[str] = None):
         """初始化定时任务
         
         Args:
@@ -113,12 +483,38 @@ class ScheduledTask:
             task_func: 任务函数，返回 bool 表示执行是否成功
             policy: 定时策略
             retry_callback: 失败时的重试回调函数（如重新登录）
+            hosts: 任务访问的主机，用于限制同一主机的并发任务数
+            timeout: 单次执行（含重试）的时限（秒），None 表示不限
+            shard: 任务所属的分片（通常为账户用户名），多节点部署时只有持有该分片租约的节点执行
         """
+        if timeout is not None and timeout <= 0:
+            raise ValueError("任务时限必须大于 0")
         self.name = name
         self.task_func = task_func
         self.policy = policy
         self.retry_callback = retry_callback
+        # 排序后按固定顺序获取主机并发名额，避免相互等待
+        self.hosts: Tuple[str, ...] = tuple(sorted(set(hosts)))
+        self.timeout = timeout
+        self.shard = shard
+        # 超时次数（累计）
+        self.timeout_count = 0
+        # 到期但未执行的次数（依赖的主机已熔断，或上次超时的执行仍未退出）
+        self.skip_count = 0
+        # 运行结束时已过了下一次原定运行时间的次数
+        self.overrun_count = 0
+        # 启动延迟（实际启动 - 原定时间）与运行耗时的分布（秒）
+        self.lag = Histogram()
+        self.duration = Histogram()
         self.last_run_time: Optional[float] = None
+        # 连续失败次数，成功后清零
+        self.failure_count = 0
+        # 调度器为任务安排的下次运行时间
+        self.next_run_time: Optional[float] = None
+        # 本次运行原定的时间（出堆时记录，用于统计启动延迟）
+        self.due_time: Optional[float] = None
+        # 本次运行所依据的分片租约（发送与状态写入以其防护令牌为条件）
+        self.fence: Optional[Fence] = None
         self.logger = get_logger()
     
     def execute(self) -> bool:
@@ -132,6 +528,9 @@ class ScheduledTask:
 
         Returns:
             任务执行成功返回 True，失败返回 False
+
+        Raises:
+            LeaseLostError: 任务所属分片的租约已由其他节点接管
         """
         try:
             # ── 首次尝试：告警抑制 ──
@@ -141,18 +540,18 @@ class ScheduledTask:
                     suppression.discard()  # 成功 → 丢弃所有内部 warning
 
             if result:
-                self.last_run_time = time.time()
+                self.last_run_time = get_clock().time()
                 return True
 
             # ── 首次失败，尝试重新登录后重试 ──
-            if self.retry_callback:
+            if self.retry_callback and not self._skip_retry_if_tripped():
                 self.logger.info(f"任务 {self.name} 失败，尝试重新登录后重试...")
                 if self.retry_callback():
                     self.logger.info(f"重新登录成功，重新执行任务 {self.name}")
                     # 第二次尝试：不抑制，告警走正常聚合管道
                     result = self.task_func()
                     if result:
-                        self.last_run_time = time.time()
+                        self.last_run_time = get_clock().time()
                         suppression.discard()  # 重试成功 → 丢弃首次告警
                         return True
                     else:
@@ -162,64 +561,365 @@ class ScheduledTask:
                     suppression.flush(self.logger)  # 重新登录失败 → 释放首次告警
                     self.logger.error(f"重新登录失败，任务 {self.name} 无法重试")
             else:
-                # 无重试回调 → 首次告警直接释放
+                # 无重试回调或依赖的主机已熔断 → 首次告警直接释放
                 suppression.flush(self.logger)
 
             return False
 
+        except LeaseLostError:
+            # 分片已由其他节点接管：不重试，由调度器作为跳过处理
+            raise
         except Exception as e:
             # 首次尝试抛异常（suppress_alerts 的 __exit__ 已自动 flush 首次告警）
             self.logger.error(f"任务 {self.name} 执行异常: {e}")
 
-            # 异常后也尝试重试
-            if self.retry_callback:
+            # 异常后也尝试重试（依赖的主机已熔断时不再重新登录）
+            if self.retry_callback and not self._skip_retry_if_tripped():
                 try:
                     self.logger.info(f"任务 {self.name} 异常，尝试重新登录后重试...")
                     if self.retry_callback():
                         self.logger.info(f"重新登录成功，重新执行任务 {self.name}")
                         result = self.task_func()
                         if result:
-                            self.last_run_time = time.time()
+                            self.last_run_time = get_clock().time()
                             return True
+                except LeaseLostError:
+                    raise
                 except Exception as retry_e:
                     self.logger.error(f"任务 {self.name} 重试时发生异常: {retry_e}")
 
             return False
     
+    def open_breakers(self) -> List[str]:
+        """获取任务依赖的主机中熔断器处于打开状态的主机"""
+        open_hosts = []
+        for host in self.hosts:
+            breaker = get_circuit_breaker(host)
+            if breaker is not None and breaker.is_open():
+                open_hosts.append(host)
+        return open_hosts
+    
+    def _skip_retry_if_tripped(self) -> bool:
+        """依赖的主机已熔断时跳过重新登录重试（避免在上游故障期间反复登录放大负载）"""
+        open_hosts = self.open_breakers()
+        if open_hosts:
+            self.logger.info(f"任务 {self.name} 失败，主机 {', '.join(open_hosts)} 已熔断，不再重新登录重试")
+        return bool(open_hosts)
+    
     def should_run_now(self) -> bool:
-        """判断是否应该立即运行任务"""
+        """判断是否应该立即运行任务（已由调度器安排时以安排的时间为准）"""
+        if self.next_run_time is not None:
+            return self.next_run_time <= get_clock().time()
         return self.policy.should_run(self.last_run_time)
 
 
 class Scheduler:
-    """任务调度器，管理和运行所有定时任务"""
+    """任务调度器，管理和运行所有定时任务。
+
+    任务按下次运行时间放入最小堆，主循环在 Event 上休眠到最早的到期时间，
+    添加/删除任务或停止调度器时立即唤醒。空闲时不轮询，任务数量对空闲开销无影响。
+
+    max_workers > 1 时任务提交到线程池并发执行，执行结果经完成队列交回主循环，
+    主循环不等待任务结束。同名任务不会重叠执行；设置了主机并发上限时，
+    主机名额已满的任务暂缓，待其他任务结束后再尝试。
+
+    设置了时限的任务为其中的 HTTP 请求设置同样的截止时间（见 transport.request_deadline），
+    并提交到复用线程的时限执行器执行（线程池模式同样如此）：到期仍未结束时调度器不再等待，
+    记为失败、释放并发与主机名额并照常安排重试；被放弃的执行在下一次请求时因截止时间已过而退出，
+    退出前同名任务跳过。放弃执行后改用新的时限执行器，卡住的线程不占用后续任务的名额。
+
+    失败的任务按 retry_policy 指数退避（带抖动）后重试；任务依赖的主机熔断器打开时，
+    到期任务直接跳过（不计为失败），推迟到熔断器允许探测时再运行。
+
+    每个任务统计启动延迟和运行耗时的直方图，以及超时运行和跳过次数，
+    通过 get_status() / get_metrics() 查看；设置 metrics_path 后定期导出为 JSON 文件。
+    启动延迟持续偏高、利用率接近 1 时，说明并发任务数不足。
+
+    提供 lease_coordinator 时，多个节点注册同样的任务，属于某个分片的任务只在持有该分片租约的节点上执行，
+    其余节点到期时直接跳过（不计次数、不写状态），每 check_interval 秒再检查一次归属。
+    任务在其分片租约的防护令牌下执行（见 lease.fenced），租约易主后的发送与状态写入被拒绝；
+    分片任务的状态在每次运行后立即写入（状态存储须为租约文件）。交出分片前等待分片上的任务结束并写入状态，
+    获得分片时从状态存储重新读取任务记录，续接原节点的节奏。
+    """
+    
+    # 单次休眠上限（秒），防止系统时间跳变后长时间不重新计算到期时间
+    MAX_SLEEP = 300
+    # 任务启动次数按秒统计的保留时长（秒）
+    LOAD_WINDOW = 3600
+    # 调度状态落盘的最长间隔（秒）
+    STATE_FLUSH_INTERVAL = 5
+    # 任务到达时限后额外等待其自行结束的时间（秒），之后放弃等待
+    TIMEOUT_GRACE = 1
+    # 调度指标导出的间隔（秒）
+    METRICS_EXPORT_INTERVAL = 60
     
-    def __init__(self, retry_callback: Optional[Callable[[], bool]] = None):
+    def __init__(self, retry_callback: Optional[Callable[[], bool]] = None, max_workers: int = 1,
+                 host_limits: Optional[Dict[str, int]] = None, state_store: Optional[SchedulerStateStore] = None,
+                 task_timeout: Optional[float] = None, retry_policy: Optional[RetryPolicy] = None,
+                 metrics_path: Optional[str] = None, lease_coordinator: Optional[LeaseCoordinator] = None):
         """初始化调度器
         
         Args:
             retry_callback: 任务失败时的重试回调函数（如重新登录）
+            max_workers: 同时执行的任务数上限，1 表示在调度线程中依次执行
+            host_limits: 各主机同时执行的任务数上限，如 {"eamsapp.uestc.edu.cn": 2}
+            state_store: 调度状态存储；提供时添加任务会恢复上次的运行记录，任务结束后保存
+            task_timeout: 任务单次执行的默认时限（秒），None 表示不限
+            retry_policy: 失败任务的重试退避策略，None 表示固定在 check_interval 后重试
+            metrics_path: 调度指标的 JSON 导出路径，None 表示不导出
+            lease_coordinator: 多节点分片租约协调器，None 表示单节点运行（执行全部任务）
         """
+        if max_workers <= 0:
+            raise ValueError("并发任务数必须大于 0")
         self.tasks: Dict[str, ScheduledTask] = {}
         self.logger = get_logger()
         self.running = False
         self.scheduler_thread: Optional[threading.Thread] = None
         self.retry_callback = retry_callback
+        self.max_workers = max_workers
+        self.task_timeout = task_timeout
+        self.retry_policy = retry_policy
+        # 失败任务的重试间隔，以及有待发告警时的检查间隔（start() 时设置）
+        self.check_interval = 60
+        
+        # (下次运行时间, 序号, 任务)；任务被删除或重新安排后，旧条目出堆时丢弃
+        self._heap: List[Tuple[float, int, ScheduledTask]] = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        
+        # 并发执行状态
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._completions: "queue.SimpleQueue[Tuple[ScheduledTask, Optional[bool]]]" = queue.SimpleQueue()
+        self._running_names: Set[str] = set()
+        # 因主机名额已满而暂缓的任务，有任务结束时重新入堆
+        self._blocked: List[ScheduledTask] = []
+        self._host_semaphores: Dict[str, threading.BoundedSemaphore] = {
+            host: threading.BoundedSemaphore(limit) for host, limit in (host_limits or {}).items()
+        }
+        # 限时执行任务的线程池（按需创建，空闲线程复用），及超时后被放弃、尚未结束的执行 {任务名: Future}
+        self._timeout_executor: Optional[ThreadPoolExecutor] = None
+        self._timeout_executor_lock = threading.Lock()
+        self._abandoned: Dict[str, Future] = {}
+        
+        # 每秒启动的任务数 {秒级时间戳: 次数}，用于负载直方图
+        self._start_counts: Dict[int, int] = {}
+        self._start_counts_lock = threading.Lock()
+        
+        self.state_store = state_store
+        self._last_state_flush = time.monotonic()
+        
+        # 调度指标的统计起点（各任务的直方图在 get_metrics() 时合计）
+        self._metrics_since = get_clock().time()
+        self.metrics_path = metrics_path
+        self._last_metrics_export = time.monotonic()
+        
+        # 各分片正在执行的任务数（从开始到写入状态），交出分片前据此等待
+        self._shard_runs: Dict[str, int] = {}
+        
+        self.lease_coordinator = lease_coordinator
+        if lease_coordinator is not None:
+            lease_store = lease_coordinator.store
+            if (state_store is not None and isinstance(lease_store, SQLiteLeaseStore)
+                    and os.path.abspath(lease_store.db_path) != os.path.abspath(state_store.db_path)):
+                raise ValueError("启用租约协调时调度状态须保存在租约文件中（状态写入以防护令牌为条件）")
+            lease_coordinator.on_change = self._on_lease_change
+            lease_coordinator.in_flight = self._shard_busy
+    
+    def _schedule(self, task: ScheduledTask, when: float) -> None:
+        """将任务安排在指定时间运行（调用方需持有 self._lock）"""
+        task.next_run_time = when
+        heapq.heappush(self._heap, (when, next(self._counter), task))
     
-    def add_task(self, name: str, task_func: Callable[[], bool], policy: SchedulePolicy) -> None:
-        """添加定时任务
+    def _retry_delay(self, task: ScheduledTask) -> float:
+        """失败任务距下次重试的等待时间"""
+        if self.retry_policy is None:
+            return self.check_interval
+        return self.retry_policy.delay(task.failure_count)
+    
+    def _breaker_wait_until(self, task: ScheduledTask) -> Optional[float]:
+        """任务依赖的已打开熔断器中最晚允许探测的时间，没有打开的熔断器返回 None"""
+        until = None
+        for host in task.open_breakers():
+            breaker_until = get_circuit_breaker(host).open_until
+            until = breaker_until if until is None else max(until, breaker_until)
+        return until
+    
+    def _owns(self, task: ScheduledTask) -> bool:
+        """本节点是否负责执行该任务（未启用租约或任务不属于任何分片时总是 True）"""
+        if self.lease_coordinator is None or task.shard is None:
+            return True
+        return self.lease_coordinator.owns(task.shard)
+    
+    def _fence(self, task: ScheduledTask) -> Optional[Fence]:
+        """任务所属分片当前的租约（未启用租约、任务不属于任何分片或本节点未持有时为 None）"""
+        if self.lease_coordinator is None or task.shard is None:
+            return None
+        return self.lease_coordinator.fence(task.shard)
+    
+    def _shard_busy(self, shard: str) -> bool:
+        """分片上是否有正在执行（或尚未写入状态）的任务"""
+        with self._lock:
+            return self._shard_runs.get(shard, 0) > 0
+    
+    def _reschedule(self, task: ScheduledTask, success: Optional[bool]) -> None:
+        """任务执行后安排下次运行
+
+        失败的任务按重试策略退避；因熔断跳过（success 为 None）的任务不计失败，
+        推迟到熔断器允许探测时运行。因分片不归本节点而跳过的任务同样按 None 处理，但不写入状态存储。
+        """
+        if success is None:
+            when = task.policy.next_run_time(task.last_run_time)
+            when = max(when, self._breaker_wait_until(task) or get_clock().time() + self.check_interval)
+        else:
+            task.failure_count = 0 if success else task.failure_count + 1
+            when = task.policy.next_run_time(task.last_run_time)
+            if not success:
+                when = max(when, get_clock().time() + self._retry_delay(task))
+        fence, task.fence = task.fence, None
+        with self._lock:
+            if self.tasks.get(task.name) is not task:
+                return
+            self._schedule(task, when)
+        if self.state_store is not None and (success is not None or self._owns(task)):
+            if success is None:
+                fence = self._fence(task)
+            self.state_store.update(task.name, task.last_run_time, when, task.failure_count, fence=fence)
+            if fence is not None:
+                # 分片任务的状态立即写入，接管的节点读到的总是最新记录
+                self.flush_state(force=True)
+    
+    def _restore_state(self, task: ScheduledTask) -> float:
+        """从状态存储恢复任务的运行记录，返回首次运行时间"""
+        state = self.state_store.get(task.name) if self.state_store is not None else None
+        if state is None:
+            return task.policy.next_run_time(None)
+        return self._resume_time(task, state)
+    
+    @staticmethod
+    def _resume_time(task: ScheduledTask, state: Tuple[Optional[float], Optional[float], int]) -> float:
+        """按保存的状态设置任务的运行记录，返回下次运行时间"""
+        task.last_run_time, saved_next, task.failure_count = state
+        # 按上次成功运行时间续接原有节奏（错过的 Cron 触发按 catch_up 处理）
+        when = task.policy.next_run_time(task.last_run_time)
+        if task.failure_count and saved_next is not None:
+            # 失败待重试的任务保持原定的重试时间
+            when = max(when, saved_next)
+        return when
+    
+    def _on_lease_change(self, shard: str, owned: bool) -> None:
+        """分片归属变化（在租约协调线程中调用）"""
+        if not owned:
+            # 交出分片前写入最新状态，接管的节点据此续接
+            self.flush_state(force=True)
+            return
+        if self.state_store is None:
+            return
+        for task in [task for task in list(self.tasks.values()) if task.shard == shard]:
+            state = self.state_store.reload(task.name)
+            if state is None:
+                continue
+            with self._lock:
+                # 正在执行或等待主机名额的任务结束后自然重新安排
+                if self.tasks.get(task.name) is not task or task.next_run_time is None:
+                    continue
+                self._schedule(task, self._resume_time(task, state))
+        self._wakeup.set()
+    
+    def flush_state(self, force: bool = False) -> None:
+        """将调度状态写入存储（未到落盘间隔且 force 为 False 时跳过）"""
+        if self.state_store is None or not self.state_store.dirty:
+            return
+        if not force and time.monotonic() - self._last_state_flush < self.STATE_FLUSH_INTERVAL:
+            return
+        self._last_state_flush = time.monotonic()
+        try:
+            self.state_store.flush()
+        except Exception as e:
+            self.logger.warning(f"调度状态保存失败: {e}")
+    
+    def _pop_due_task(self) -> Tuple[Optional[ScheduledTask], Optional[float]]:
+        """取出一个已到期的任务
+        
+        Returns:
+            (到期任务, None)；没有到期任务时返回 (None, 最早的到期时间)，堆为空时为 (None, None)
+        """
+        with self._lock:
+            while self._heap:
+                when, _, task = self._heap[0]
+                # 跳过已删除、被覆盖或已重新安排的旧条目
+                if self.tasks.get(task.name) is not task or task.next_run_time != when:
+                    heapq.heappop(self._heap)
+                    continue
+                if when > get_clock().time():
+                    return None, when
+                heapq.heappop(self._heap)
+                task.next_run_time = None
+                task.due_time = when
+                return task, None
+            return None, None
+    
+    def add_task(self, name: str, task_func: Callable[[], bool], policy: SchedulePolicy,
+                 hosts: Iterable[str] = (), retry_callback: Optional[Callable[[], bool]] = None,
+                 timeout: Optional[float] = None, shard: Optional[str] = None) -> None:
+        """添加定时任务（调度器运行中也可添加，立即生效）
         
         Args:
             name: 任务名称（唯一标识）
             task_func: 任务函数
             policy: 定时策略
+            hosts: 任务访问的主机，用于主机并发限制
+            retry_callback: 该任务的重试回调，默认使用调度器的重试回调
+            timeout: 单次执行的时限（秒），默认使用调度器的 task_timeout
+            shard: 任务所属的分片，启用租约协调时只在持有该分片的节点执行
         """
         if name in self.tasks:
             self.logger.warning(f"任务 '{name}' 已存在，将被覆盖")
         
-        task = ScheduledTask(name, task_func, policy, self.retry_callback)
-        self.tasks[name] = task
-        self.logger.info(f"已添加定时任务: {name} ({policy.get_description()})")
+        # 错峰策略按任务名绑定相位
+        policy = policy.for_task(name)
+        task = ScheduledTask(name, task_func, policy, retry_callback or self.retry_callback, hosts,
+                             timeout if timeout is not None else self.task_timeout, shard)
+        if shard is not None and self.lease_coordinator is not None:
+            self.lease_coordinator.register(shard)
+        when = self._restore_state(task)
+        with self._lock:
+            self.tasks[name] = task
+            self._schedule(task, when)
+        self._wakeup.set()
+        if task.last_run_time is not None:
+            self.logger.info(
+                f"已添加定时任务: {name} ({policy.get_description()})，已恢复运行记录，"
+                f"下次运行: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))}"
+            )
+        else:
+            self.logger.info(f"已添加定时任务: {name} ({policy.get_description()})")
+    
+    def remove_task(self, name: str) -> bool:
+        """删除定时任务（正在执行的任务会执行完毕，但不再安排下次运行）
+        
+        Args:
+            name: 任务名称
+            
+        Returns:
+            删除成功返回 True，任务不存在返回 False
+        """
+        with self._lock:
+            task = self.tasks.pop(name, None)
+            # 大量删除后压缩堆，避免残留条目占用内存
+            if len(self._heap) > 2 * len(self.tasks) + 64:
+                self._heap = [
+                    entry for entry in self._heap
+                    if self.tasks.get(entry[2].name) is entry[2] and entry[2].next_run_time == entry[0]
+                ]
+                heapq.heapify(self._heap)
+        if task is None:
+            return False
+        if self.state_store is not None:
+            self.state_store.delete(name)
+        self._wakeup.set()
+        self.logger.info(f"已删除定时任务: {name}")
+        return True
     
     def get_task(self, name: str) -> Optional[ScheduledTask]:
         """获取定时任务
@@ -236,83 +936,406 @@ class Scheduler:
         """启动调度器（非阻塞，在后台线程运行）
         
         Args:
-            check_interval: 检查任务的间隔秒数
+            check_interval: 失败任务的重试间隔秒数，以及有待发告警时的检查间隔
         """
         if self.running:
             self.logger.warning("调度器已在运行")
             return
         
+        self.check_interval = check_interval
         self.running = True
+        self._wakeup.clear()
+        if self.max_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scheduler-task")
+        if self.lease_coordinator is not None:
+            # 先完成一轮分片分配，避免启动时到期的任务全部因未持有租约而跳过
+            self.lease_coordinator.start()
         self.scheduler_thread = threading.Thread(
             target=self._run_loop,
-            args=(check_interval,),
             daemon=True
         )
         self.scheduler_thread.start()
-        self.logger.success(f"调度器已启动（检查间隔: {check_interval}秒）")
+        self.logger.success(
+            f"调度器已启动（失败重试间隔: {check_interval}秒，并发任务数: {self.max_workers}）"
+        )
     
-    def _run_loop(self, check_interval: int) -> None:
-        """调度器主循环
-        
+    def _acquire_hosts(self, task: ScheduledTask, blocking: bool) -> bool:
+        """获取任务所需的主机并发名额，非阻塞模式下获取失败时释放已获取的名额"""
+        acquired = []
+        for host in task.hosts:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                continue
+            if not semaphore.acquire(blocking=blocking):
+                for held in acquired:
+                    held.release()
+                return False
+            acquired.append(semaphore)
+        return True
+    
+    def _release_hosts(self, task: ScheduledTask) -> None:
+        """释放任务占用的主机并发名额"""
+        for host in task.hosts:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is not None:
+                semaphore.release()
+    
+    def _try_start(self, task: ScheduledTask, blocking_hosts: bool = False) -> bool:
+        """标记任务开始执行：同名任务正在执行或主机名额已满时返回 False"""
+        with self._lock:
+            if task.name in self._running_names:
+                return False
+            self._running_names.add(task.name)
+        if not self._acquire_hosts(task, blocking_hosts):
+            with self._lock:
+                self._running_names.discard(task.name)
+            return False
+        if task.shard is not None:
+            with self._lock:
+                self._shard_runs[task.shard] = self._shard_runs.get(task.shard, 0) + 1
+        return True
+    
+    def _record_start(self) -> None:
+        """记录一次任务启动（按秒计数，超出统计窗口的记录被清理）"""
+        second = int(get_clock().time())
+        with self._start_counts_lock:
+            self._start_counts[second] = self._start_counts.get(second, 0) + 1
+            if len(self._start_counts) > self.LOAD_WINDOW:
+                cutoff = second - self.LOAD_WINDOW
+                for key in [key for key in self._start_counts if key <= cutoff]:
+                    del self._start_counts[key]
+    
+    def _execute(self, task: ScheduledTask) -> Optional[bool]:
+        """执行任务（已通过 _try_start），任务抛出的异常视为失败
+
         Args:
-            check_interval: 检查间隔
+            task: 任务
+
+        Returns:
+            成功返回 True，失败返回 False；分片不归本节点或依赖的主机已熔断而跳过返回 None
         """
+        if not self._owns(task):
+            return None
+        
+        open_hosts = task.open_breakers()
+        if open_hosts:
+            task.skip_count += 1
+            self.logger.info(f"主机 {', '.join(open_hosts)} 已熔断，跳过任务 {task.name}")
+            return None
+        
+        abandoned = self._abandoned.get(task.name)
+        if abandoned is not None:
+            if not abandoned.done():
+                # 跳过而非失败：用 info 记录，避免每次到期都触发告警邮件
+                task.skip_count += 1
+                self.logger.info(f"任务 {task.name} 上次超时的执行仍未退出，本次跳过")
+                return None
+            self._abandoned.pop(task.name, None)
+        
+        task.fence = self._fence(task)
+        self._record_start()
+        started = get_clock().time()
+        if task.due_time is not None:
+            task.lag.observe(started - task.due_time)
+        self.logger.info(f"执行任务: {task.name}")
+        try:
+            with fenced(task.fence):
+                if task.timeout is None:
+                    return task.execute()
+                return self._execute_with_timeout(task)
+        except LeaseLostError as e:
+            # 分片已由其他节点接管：本次执行作废，不计失败、不写状态
+            self.logger.info(f"任务 {task.name} 放弃执行: {e}")
+            return None
+        except Exception as e:
+            self.logger.error(f"任务 {task.name} 执行异常: {e}")
+            return False
+        finally:
+            self._record_run(task, started, get_clock().time())
+    
+    def _record_run(self, task: ScheduledTask, started: float, finished: float) -> None:
+        """记录一次运行的耗时，运行结束时已过了下一次原定运行时间则记为超时运行"""
+        duration = finished - started
+        task.duration.observe(duration)
+        if task.due_time is None:
+            return
+        following = task.policy.following_run_time(task.due_time)
+        if following is not None and finished > following:
+            task.overrun_count += 1
+            self.logger.info(f"任务 {task.name} 运行 {duration:.1f} 秒，已超过下一次运行时间（超时运行）")
+    
+    def _get_timeout_executor(self) -> ThreadPoolExecutor:
+        """获取限时执行器（线程按需创建，空闲线程复用；同时执行的任务不超过 max_workers）"""
+        with self._timeout_executor_lock:
+            if self._timeout_executor is None:
+                self._timeout_executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="scheduler-timeout"
+                )
+            return self._timeout_executor
+    
+    def _retire_timeout_executor(self, executor: ThreadPoolExecutor) -> None:
+        """执行被放弃后换用新的限时执行器：卡住的线程留在旧执行器中，不占用后续任务的名额，
+        旧执行器中其他正在执行的任务照常结束，之后线程退出"""
+        with self._timeout_executor_lock:
+            if self._timeout_executor is executor:
+                self._timeout_executor = None
+        executor.shutdown(wait=False)
+    
+    def _execute_with_timeout(self, task: ScheduledTask) -> Optional[bool]:
+        """提交到限时执行器执行任务，超过时限后放弃等待并视为失败（未能开始执行时跳过，返回 None）"""
+        
+        def _target() -> bool:
+            with request_deadline(task.timeout):
+                return bool(task.execute())
+        
+        # 在执行线程中沿用当前的租约上下文
+        executor = self._get_timeout_executor()
+        future = executor.submit(contextvars.copy_context().run, _target)
+        try:
+            return future.result(task.timeout + self.TIMEOUT_GRACE)
+        except FutureTimeoutError:
+            if future.cancel():
+                # 一直在排队、未开始执行：不计超时，本次跳过
+                task.skip_count += 1
+                self.logger.info(f"任务 {task.name} 等待执行线程超过时限，本次跳过")
+                return None
+            task.timeout_count += 1
+            self._abandoned[task.name] = future
+            self._retire_timeout_executor(executor)
+            self.logger.error(f"任务 {task.name} 超过时限 {task.timeout:g} 秒仍未结束，已放弃等待")
+            return False
+    
+    def _finish(self, task: ScheduledTask, success: Optional[bool]) -> None:
+        """任务结束：释放并发名额，记录结果并安排下次运行（success 为 None 表示因熔断跳过）"""
+        self._release_hosts(task)
+        with self._lock:
+            self._running_names.discard(task.name)
+            blocked, self._blocked = self._blocked, []
+        if success:
+            self.logger.success(f"任务 {task.name} 完成")
+        elif success is not None:
+            self.logger.info(f"任务 {task.name} 失败")
+        self._reschedule(task, success)
+        if task.shard is not None:
+            with self._lock:
+                runs = self._shard_runs.get(task.shard, 0) - 1
+                if runs > 0:
+                    self._shard_runs[task.shard] = runs
+                else:
+                    self._shard_runs.pop(task.shard, None)
+        
+        # 主机名额已释放，暂缓的任务重新入堆立即尝试
+        if blocked:
+            now = get_clock().time()
+            with self._lock:
+                for waiting in blocked:
+                    if self.tasks.get(waiting.name) is waiting and waiting.next_run_time is None:
+                        self._schedule(waiting, now)
+        self._wakeup.set()
+    
+    def _on_task_done(self, task: ScheduledTask, future: Future) -> None:
+        """线程池任务完成回调：结果放入完成队列并唤醒主循环"""
+        try:
+            success = future.result()
+        except Exception as e:
+            self.logger.error(f"任务 {task.name} 执行异常: {e}")
+            success = False
+        self._completions.put((task, success))
+        self._wakeup.set()
+    
+    def _drain_completions(self) -> None:
+        """处理已完成任务的结果"""
+        while True:
+            try:
+                task, success = self._completions.get_nowait()
+            except queue.Empty:
+                return
+            self._finish(task, success)
+    
+    def _dispatch(self, task: ScheduledTask) -> None:
+        """分派到期任务：提交到线程池或在当前线程执行"""
+        if not self._try_start(task):
+            # 同名任务正在执行或主机名额已满，等待其他任务结束后再尝试
+            with self._lock:
+                self._blocked.append(task)
+            return
+        
+        if self._executor is None:
+            self._finish(task, self._execute(task))
+            return
+        
+        try:
+            future = self._executor.submit(self._execute, task)
+        except RuntimeError as e:
+            # 线程池已关闭（调度器正在停止）
+            self.logger.warning(f"任务 {task.name} 提交失败: {e}")
+            self._finish(task, False)
+            return
+        future.add_done_callback(lambda f, t=task: self._on_task_done(t, f))
+    
+    def _run_loop(self) -> None:
+        """调度器主循环：执行到期任务，然后休眠到下一个到期时间或被唤醒"""
         self.logger.info(f"调度器主循环启动，管理 {len(self.tasks)} 个任务")
         
         try:
             while self.running:
-                for task_name, task in self.tasks.items():
-                    if task.should_run_now():
-                        self.logger.info(f"执行任务: {task_name}")
-                        if task.execute():
-                            self.logger.success(f"任务 {task_name} 完成")
-                        else:
-                            self.logger.info(f"任务 {task_name} 失败")
-
+                # 先清除唤醒标志再检查堆，之后的添加/删除/完成/停止都会使 wait 立即返回
+                self._wakeup.clear()
+                self._drain_completions()
+                
+                # 并发已满时不取出任务，等待任务完成后被唤醒
+                next_due = None
+                if len(self._running_names) < self.max_workers:
+                    task, next_due = self._pop_due_task()
+                    if task is not None:
+                        self._dispatch(task)
+                        continue
+                
                 # 定期检查待发聚合告警，避免无限滞留
                 self.logger.tick()
-
-                time.sleep(check_interval)
+                self.flush_state()
+                self._export_metrics_if_due()
+                
+                timeout = self.MAX_SLEEP
+                if next_due is not None:
+                    timeout = min(timeout, max(next_due - get_clock().time(), 0))
+                if self.logger.pending_alerts:
+                    timeout = min(timeout, self.check_interval)
+                if self.state_store is not None and self.state_store.dirty:
+                    timeout = min(timeout, self.STATE_FLUSH_INTERVAL)
+                if self.metrics_path:
+                    timeout = min(timeout, self.METRICS_EXPORT_INTERVAL)
+                self._wakeup.wait(timeout)
         
         except Exception as e:
             self.logger.error(f"调度器异常: {e}")
         finally:
+            self.flush_state(force=True)
+            self._export_metrics_if_due(force=True)
             self.logger.info("调度器已停止")
     
+    def _wait_for_running(self, timeout: float) -> None:
+        """等待正在执行的任务结束并处理其结果（最多 timeout 秒）"""
+        deadline = time.monotonic() + timeout
+        while True:
+            self._drain_completions()
+            with self._lock:
+                running = len(self._running_names)
+            if not running:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.logger.info(f"仍有 {running} 个任务未结束，不再等待")
+                return
+            self._wakeup.wait(min(remaining, 0.1))
+            self._wakeup.clear()
+    
     def stop(self) -> None:
-        """停止调度器"""
+        """停止调度器（立即唤醒主循环，不再分派新任务；已在执行的任务继续运行至结束）
+
+        启用租约协调时先等待正在执行的任务结束并写入状态，再交出分片。
+        """
         if not self.running:
             self.logger.warning("调度器未在运行")
             return
         
         self.running = False
+        self._wakeup.set()
         if self.scheduler_thread:
             self.scheduler_thread.join(timeout=5)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        with self._timeout_executor_lock:
+            if self._timeout_executor is not None:
+                self._timeout_executor.shutdown(wait=False)
+                self._timeout_executor = None
+        if self.lease_coordinator is not None:
+            self._wait_for_running(self.lease_coordinator.drain_timeout)
+        self.flush_state(force=True)
+        if self.lease_coordinator is not None:
+            # 主动离开，其他节点无需等待租约过期即可接管
+            self.lease_coordinator.stop()
         self.logger.info("调度器已停止")
     
     def run_once_blocking(self) -> int:
-        """同步运行所有就绪的任务一次（阻塞式）
+        """运行所有就绪的任务一次，等待全部结束（阻塞式）
+        
+        max_workers > 1 时就绪任务并发执行，主机名额已满的任务等待名额。
         
         Returns:
             成功执行的任务数量
         """
         self.logger.info("开始执行所有就绪任务（同步模式）")
-        success_count = 0
-
-        for task_name, task in self.tasks.items():
-            if task.should_run_now():
-                self.logger.info(f"执行任务: {task_name}")
-                if task.execute():
-                    success_count += 1
-                    self.logger.success(f"任务 {task_name} 完成")
-                else:
-                    self.logger.info(f"任务 {task_name} 失败")
+        if self.lease_coordinator is not None and not self.running:
+            # 未启动调度器时先分配一次分片，只执行本节点持有的分片
+            self.lease_coordinator.tick()
+        ready = [task for task in list(self.tasks.values()) if task.should_run_now()]
+        
+        def _run(task: ScheduledTask) -> Optional[bool]:
+            if not self._try_start(task, blocking_hosts=True):
+                self.logger.info(f"任务 {task.name} 正在执行，跳过")
+                return False
+            task.due_time = task.next_run_time
+            success = self._execute(task)
+            self._finish(task, success)
+            return success
+        
+        if self.max_workers > 1 and len(ready) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scheduler-once") as executor:
+                results = list(executor.map(_run, ready))
+        else:
+            results = [_run(task) for task in ready]
+        success_count = sum(1 for ok in results if ok)
 
         # 检查是否有待发聚合告警
         self.logger.tick()
+        self.flush_state(force=True)
 
         return success_count
     
+    @staticmethod
+    def _summarize_load(counts: Dict[int, int], horizon: float) -> dict:
+        """将每秒任务数汇总为直方图"""
+        histogram: Dict[int, int] = {}
+        for count in counts.values():
+            histogram[count] = histogram.get(count, 0) + 1
+        total = sum(counts.values())
+        return {
+            "total": total,
+            "peak_per_second": max(counts.values(), default=0),
+            "mean_per_second": round(total / horizon, 3) if horizon > 0 else 0.0,
+            # {每秒任务数: 出现该任务数的秒数}，不含空闲的秒
+            "histogram": dict(sorted(histogram.items())),
+        }
+    
+    def get_load_histogram(self, horizon: float = 3600) -> Dict[str, dict]:
+        """获取任务负载的每秒分布，用于确认错峰效果
+        
+        Args:
+            horizon: 统计时长（秒）：已安排的运行统计未来 horizon 秒，实际启动统计过去 horizon 秒
+            
+        Returns:
+            {"scheduled": 已安排的运行, "observed": 实际启动}，各含 total、peak_per_second、
+            mean_per_second 和 histogram（{每秒任务数: 秒数}）
+        """
+        now = get_clock().time()
+        scheduled: Dict[int, int] = {}
+        for task in list(self.tasks.values()):
+            when = task.next_run_time
+            if when is not None and when <= now + horizon:
+                second = int(max(when, now))
+                scheduled[second] = scheduled.get(second, 0) + 1
+        
+        cutoff = now - horizon
+        with self._start_counts_lock:
+            observed = {second: count for second, count in self._start_counts.items() if second >= cutoff}
+        
+        return {
+            "scheduled": self._summarize_load(scheduled, horizon),
+            "observed": self._summarize_load(observed, horizon),
+        }
+    
     def get_status(self) -> Dict[str, dict]:
         """获取所有任务的状态
         
@@ -321,14 +1344,119 @@ class Scheduler:
         """
         import datetime
         status = {}
-        for task_name, task in self.tasks.items():
+        for task_name, task in list(self.tasks.items()):
             last_run = (
                 datetime.datetime.fromtimestamp(task.last_run_time).strftime('%Y-%m-%d %H:%M:%S')
                 if task.last_run_time else "从未运行"
             )
+            if task_name in self._running_names:
+                next_run = "执行中"
+            elif task.next_run_time:
+                next_run = datetime.datetime.fromtimestamp(task.next_run_time).strftime('%Y-%m-%d %H:%M:%S')
+            else:
+                next_run = "等待主机名额"
             status[task_name] = {
                 "policy": task.policy.get_description(),
                 "last_run": last_run,
+                "next_run": next_run,
+                "running": task_name in self._running_names,
+                "owned": self._owns(task),
+                "failure_count": task.failure_count,
+                "timeout_count": task.timeout_count,
+                "skip_count": task.skip_count,
+                "overrun_count": task.overrun_count,
+                "lag": task.lag.summary(),
+                "duration": task.duration.summary(),
                 "should_run_now": task.should_run_now()
             }
         return status
+    
+    def get_metrics(self) -> dict:
+        """获取调度指标（可直接序列化为 JSON）
+        
+        Returns:
+            字典，包含：
+            - generated_at / uptime_seconds: 生成时间戳及统计时长（秒）
+            - max_workers / running / overdue: 并发上限、正在执行数、已到期但未开始的任务数
+            - utilization: 任务运行总耗时 / (统计时长 × 并发上限)
+            - totals: 运行、失败中的任务、超时运行、跳过、超时次数合计
+            - lag / duration: 全部任务合计的启动延迟和运行耗时直方图
+            - tasks: 各任务的运行次数、延迟与耗时摘要、超时运行 / 跳过 / 超时次数
+        """
+        now = get_clock().time()
+        uptime = max(now - self._metrics_since, 0.0)
+        running = set(self._running_names)
+        tasks = {}
+        totals = {"runs": 0, "failing_tasks": 0, "overruns": 0, "skipped": 0, "timeouts": 0}
+        lag, duration = Histogram(), Histogram()
+        overdue = 0
+        for name, task in list(self.tasks.items()):
+            lag.merge(task.lag)
+            duration.merge(task.duration)
+            if name not in running and task.next_run_time is not None and task.next_run_time <= now:
+                overdue += 1
+            totals["runs"] += task.duration.count
+            totals["failing_tasks"] += 1 if task.failure_count else 0
+            totals["overruns"] += task.overrun_count
+            totals["skipped"] += task.skip_count
+            totals["timeouts"] += task.timeout_count
+            tasks[name] = {
+                "runs": task.duration.count,
+                "failure_count": task.failure_count,
+                "overruns": task.overrun_count,
+                "skipped": task.skip_count,
+                "timeouts": task.timeout_count,
+                "lag": task.lag.summary(),
+                "duration": task.duration.summary(),
+            }
+        busy = duration.sum
+        return {
+            "generated_at": round(now, 3),
+            "uptime_seconds": round(uptime, 3),
+            "max_workers": self.max_workers,
+            "running": len(running),
+            "overdue": overdue,
+            "utilization": round(busy / (uptime * self.max_workers), 4) if uptime > 0 else 0.0,
+            "totals": totals,
+            "lag": lag.snapshot(),
+            "duration": duration.snapshot(),
+            "tasks": tasks,
+        }
+    
+    def reset_metrics(self) -> None:
+        """清空调度指标，从现在开始重新统计"""
+        for task in list(self.tasks.values()):
+            task.lag = Histogram()
+            task.duration = Histogram()
+            task.overrun_count = 0
+            task.skip_count = 0
+            task.timeout_count = 0
+        self._metrics_since = get_clock().time()
+    
+    def export_metrics(self, path: Optional[str] = None) -> None:
+        """将调度指标写入 JSON 文件（先写临时文件再替换，读取方不会读到半个文件）
+        
+        Args:
+            path: 导出路径，默认使用 metrics_path
+        """
+        path = path or self.metrics_path
+        if not path:
+            return
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.get_metrics(), f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+    
+    def _export_metrics_if_due(self, force: bool = False) -> None:
+        """到导出间隔时导出调度指标（未设置 metrics_path 时跳过）"""
+        if not self.metrics_path:
+            return
+        if not force and time.monotonic() - self._last_metrics_export < self.METRICS_EXPORT_INTERVAL:
+            return
+        self._last_metrics_export = time.monotonic()
+        try:
+            self.export_metrics()
+        except Exception as e:
+            self.logger.warning(f"调度指标导出失败: {e}")
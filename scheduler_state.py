@@ -0,0 +1,182 @@
+"""UESTC 服务系统 - 调度状态持久化
+将各任务的上次运行时间、连续失败次数和下次运行时间保存到 SQLite 文件，
+进程重启后恢复，使任务沿用原有节奏，而不是在启动时一齐执行
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from lease import Fence, ensure_lease_tables
+
+# (上次成功运行时间, 下次运行时间, 连续失败次数)
+TaskState = Tuple[Optional[float], Optional[float], int]
+
+
+class SchedulerStateStore:
+    """任务调度状态存储。
+
+    启动时一次性读入全部记录，之后的查询走内存；更新先记入待写缓冲，
+    由调度器定期调用 flush() 在一个事务中批量写入，避免每次任务结束都同步落盘。
+    多个进程可共用同一文件：各自的任务名不同，或由租约保证同一任务同时只有一个进程写入（见 lease.py）。
+    启用租约时本文件即租约文件，分片任务的更新以防护令牌为条件写入，租约已易主的更新被丢弃。
+    """
+
+    def __init__(self, db_path: str):
+        """初始化状态存储
+
+        Args:
+            db_path: SQLite 数据库文件路径，所在目录不存在时自动创建
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        # WAL 模式下写入不阻塞其他进程读取，NORMAL 同步级别只在检查点时 fsync
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_state ("
+            "name TEXT PRIMARY KEY, last_run_time REAL, next_run_time REAL, "
+            "failure_count INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+        )
+        ensure_lease_tables(self._conn)
+        self._states: Dict[str, TaskState] = {
+            name: (last_run, next_run, failures)
+            for name, last_run, next_run, failures in self._conn.execute(
+                "SELECT name, last_run_time, next_run_time, failure_count FROM task_state"
+            )
+        }
+        # 待写入的更新 {任务名: 状态}，状态为 None 表示删除
+        self._pending: Dict[str, Optional[TaskState]] = {}
+        # 待写入更新所依据的租约 {任务名: 租约}
+        self._fences: Dict[str, Fence] = {}
+
+    def get(self, name: str) -> Optional[TaskState]:
+        """获取任务的已保存状态
+
+        Args:
+            name: 任务名称
+
+        Returns:
+            (上次成功运行时间, 下次运行时间, 连续失败次数)，没有记录返回 None
+        """
+        with self._lock:
+            return self._states.get(name)
+
+    def update(self, name: str, last_run_time: Optional[float], next_run_time: Optional[float],
+               failure_count: int, fence: Optional[Fence] = None) -> None:
+        """记录任务状态（写入缓冲，flush() 时落盘）
+
+        Args:
+            name: 任务名称
+            last_run_time: 上次成功运行时间
+            next_run_time: 下次运行时间
+            failure_count: 连续失败次数
+            fence: 产生此状态的执行所依据的租约，提供时仅在租约仍有效时写入
+        """
+        state = (last_run_time, next_run_time, failure_count)
+        with self._lock:
+            self._states[name] = state
+            self._pending[name] = state
+            if fence is not None:
+                self._fences[name] = fence
+            else:
+                self._fences.pop(name, None)
+
+    def delete(self, name: str) -> None:
+        """删除任务状态（写入缓冲，flush() 时落盘）"""
+        with self._lock:
+            self._states.pop(name, None)
+            self._pending[name] = None
+            self._fences.pop(name, None)
+
+    def reload(self, name: str) -> Optional[TaskState]:
+        """从数据库重新读取任务状态（多个节点共用同一文件时，读取其他节点写入的最新记录）
+
+        本进程有未落盘的更新时以本地为准。
+
+        Args:
+            name: 任务名称
+
+        Returns:
+            (上次成功运行时间, 下次运行时间, 连续失败次数)，没有记录返回 None
+        """
+        with self._lock:
+            if name in self._pending:
+                return self._states.get(name)
+            row = self._conn.execute(
+                "SELECT last_run_time, next_run_time, failure_count FROM task_state WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                self._states.pop(name, None)
+                return None
+            self._states[name] = (row[0], row[1], row[2])
+            return self._states[name]
+
+    @property
+    def dirty(self) -> bool:
+        """是否有未落盘的更新"""
+        return bool(self._pending)
+
+    def flush(self) -> int:
+        """将缓冲的更新在一个事务中写入数据库（租约已易主的更新被丢弃，之后 reload() 读取新持有者的记录）
+
+        Returns:
+            写入的记录数
+        """
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            fences, self._fences = self._fences, {}
+            now = time.time()
+            upserts = [
+                (name, state[0], state[1], state[2], now)
+                for name, state in pending.items() if state is not None and name not in fences
+            ]
+            fenced_upserts = [
+                (name, state[0], state[1], state[2], now, *fences[name].params())
+                for name, state in pending.items() if state is not None and name in fences
+            ]
+            deletes = [(name,) for name, state in pending.items() if state is None]
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.executemany(
+                    "INSERT OR REPLACE INTO task_state "
+                    "(name, last_run_time, next_run_time, failure_count, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    upserts,
+                )
+                rejected = []
+                for row in fenced_upserts:
+                    cursor.execute(
+                        "INSERT OR REPLACE INTO task_state "
+                        "(name, last_run_time, next_run_time, failure_count, updated_at) "
+                        f"SELECT ?, ?, ?, ?, ? WHERE {Fence.SQL_CONDITION}",
+                        row,
+                    )
+                    if cursor.rowcount == 0:
+                        rejected.append(row[0])
+                cursor.executemany("DELETE FROM task_state WHERE name = ?", deletes)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                # 写入失败时放回缓冲，期间的新更新优先
+                pending.update(self._pending)
+                self._pending = pending
+                fences.update(self._fences)
+                self._fences = fences
+                raise
+            for name in rejected:
+                # 本地状态已过时，下次 get/reload 以数据库为准
+                if name not in self._pending:
+                    self._states.pop(name, None)
+            return len(pending) - len(rejected)
+
+    def close(self) -> None:
+        """写入剩余更新并关闭数据库连接"""
+        self.flush()
+        self._conn.close()
@@ -0,0 +1,214 @@
+"""UESTC 服务系统 - 发送额度
+每个发件账户一份发送额度：每分钟速率（令牌桶）和每日配额。
+每日配额按优先级保留余量，普通通知和汇总邮件用不完全部配额，保证额度紧张时告警邮件仍能发出
+"""
+
+import datetime
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+from rate_limiter import RateLimiter, get_rate_limiter
+
+# 优先级：告警 > 普通通知 > 汇总邮件
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+# 各优先级不可使用的每日配额比例（为更高优先级保留）
+DEFAULT_RESERVE = {PRIORITY_HIGH: 0.0, PRIORITY_NORMAL: 0.1, PRIORITY_LOW: 0.2}
+
+
+class SendBudget:
+    """单个发件账户的发送额度（线程安全）。
+
+    每日计数按本地日期归零；提供 db_path 时计数保存在 SQLite 文件中（与限流状态共用同一文件即可），
+    重启和多个进程之间共享，速率令牌桶同样跨进程共享。
+    """
+
+    def __init__(self, name: str, per_minute: Optional[float] = None, daily_quota: Optional[int] = None,
+                 burst: Optional[float] = None, reserve: Optional[Dict[str, float]] = None,
+                 db_path: Optional[str] = None):
+        """初始化发送额度
+
+        Args:
+            name: 额度名称，通常为 "SMTP 服务器:发件邮箱"
+            per_minute: 每分钟发送上限，None 表示不限
+            daily_quota: 每日发送上限，None 表示不限
+            burst: 允许的突发发送数，默认等于 per_minute
+            reserve: 各优先级不可使用的每日配额比例，默认见 DEFAULT_RESERVE
+            db_path: SQLite 文件路径，提供时每日计数和速率跨进程共享
+        """
+        if per_minute is not None and per_minute <= 0:
+            raise ValueError("每分钟发送上限必须大于 0")
+        if daily_quota is not None and daily_quota <= 0:
+            raise ValueError("每日发送上限必须大于 0")
+        self.name = name
+        self.per_minute = per_minute
+        self.daily_quota = daily_quota
+        self.reserve = dict(DEFAULT_RESERVE, **(reserve or {}))
+        self.limiter: Optional[RateLimiter] = None
+        if per_minute is not None:
+            self.limiter = get_rate_limiter(f"smtp:{name}", per_minute / 60, burst or per_minute, db_path)
+        self._lock = threading.Lock()
+        self._day = self._today()
+        self._sent_today = 0
+        # 被限额拒绝的次数（累计）
+        self.rejected = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_path and daily_quota is not None:
+            directory = os.path.dirname(os.path.abspath(db_path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS send_quota (name TEXT NOT NULL, day TEXT NOT NULL, "
+                "count INTEGER NOT NULL, PRIMARY KEY (name, day))"
+            )
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.date.today().isoformat()
+
+    def limit_for(self, priority: str) -> Optional[int]:
+        """某优先级当日可用的配额上限，None 表示不限"""
+        if self.daily_quota is None:
+            return None
+        return int(self.daily_quota * (1 - self.reserve.get(priority, 0.0)))
+
+    def _take_daily(self, priority: str) -> bool:
+        """占用一次当日配额（调用方需持有 self._lock）"""
+        limit = self.limit_for(priority)
+        if limit is None:
+            return True
+        today = self._today()
+        if self._conn is None:
+            if today != self._day:
+                self._day, self._sent_today = today, 0
+            if self._sent_today >= limit:
+                return False
+            self._sent_today += 1
+            return True
+
+        cursor = self._conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            row = cursor.execute(
+                "SELECT count FROM send_quota WHERE name = ? AND day = ?", (self.name, today)
+            ).fetchone()
+            count = row[0] if row else 0
+            if count >= limit:
+                cursor.execute("COMMIT")
+                return False
+            cursor.execute(
+                "INSERT OR REPLACE INTO send_quota (name, day, count) VALUES (?, ?, ?)", (self.name, today, count + 1)
+            )
+            # 旧日期的计数不再需要
+            cursor.execute("DELETE FROM send_quota WHERE name = ? AND day < ?", (self.name, today))
+            cursor.execute("COMMIT")
+            return True
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def _return_daily(self) -> None:
+        """归还一次当日配额（调用方需持有 self._lock）"""
+        if self.daily_quota is None:
+            return
+        if self._conn is None:
+            self._sent_today = max(self._sent_today - 1, 0)
+            return
+        cursor = self._conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(
+                "UPDATE send_quota SET count = MAX(count - 1, 0) WHERE name = ? AND day = ?", (self.name, self._today())
+            )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def acquire(self, priority: str = PRIORITY_NORMAL, max_wait: float = 0) -> bool:
+        """占用一次发送额度
+
+        Args:
+            priority: 优先级（PRIORITY_HIGH / PRIORITY_NORMAL / PRIORITY_LOW）
+            max_wait: 速率达到上限时最长等待时间（秒）
+
+        Returns:
+            获得额度返回 True；当日配额已用完或需要等待超过 max_wait 返回 False（不占用额度）
+        """
+        with self._lock:
+            if not self._take_daily(priority):
+                self.rejected += 1
+                return False
+        if self.limiter is not None and not self.limiter.acquire(max_wait=max_wait):
+            with self._lock:
+                self._return_daily()
+                self.rejected += 1
+            return False
+        return True
+
+    def refund(self) -> None:
+        """发送失败时归还当日配额（速率令牌不归还）"""
+        with self._lock:
+            self._return_daily()
+
+    def used_today(self) -> int:
+        """当日已使用的配额"""
+        with self._lock:
+            if self._conn is None:
+                return self._sent_today if self._day == self._today() else 0
+            row = self._conn.execute(
+                "SELECT count FROM send_quota WHERE name = ? AND day = ?", (self.name, self._today())
+            ).fetchone()
+            return row[0] if row else 0
+
+    def load(self) -> float:
+        """当日配额使用比例（0 ~ 1），未设置每日配额时为 0"""
+        if self.daily_quota is None:
+            return 0.0
+        return self.used_today() / self.daily_quota
+
+    def snapshot(self) -> dict:
+        """获取额度状态：per_minute、daily_quota、used_today、rejected"""
+        return {
+            "per_minute": self.per_minute,
+            "daily_quota": self.daily_quota,
+            "used_today": self.used_today(),
+            "rejected": self.rejected,
+        }
+
+
+# 通知类别对应的发送优先级，其余类别为 PRIORITY_NORMAL
+CATEGORY_PRIORITIES = {"alert": PRIORITY_HIGH, "digest": PRIORITY_LOW}
+
+# 常见邮件服务商的默认额度 {SMTP 服务器: (每分钟上限, 每日上限)}，为保守估计值，以服务商实际限制为准，
+# 可用 set_provider_limits() 覆盖或补充
+_provider_limits: Dict[str, Tuple[Optional[float], Optional[int]]] = {
+    "smtp.163.com": (15, 200),
+    "smtp.126.com": (15, 200),
+    "smtp.qq.com": (20, 500),
+    "smtp.gmail.com": (20, 500),
+}
+
+
+def priority_for(category: Optional[str]) -> str:
+    """获取通知类别对应的发送优先级（告警为高，不含告警和成绩提醒的汇总邮件为低）"""
+    return CATEGORY_PRIORITIES.get(category or "", PRIORITY_NORMAL)
+
+
+def set_provider_limits(host: str, per_minute: Optional[float], daily_quota: Optional[int]) -> None:
+    """设置某个 SMTP 服务器的默认额度
+
+    Args:
+        host: SMTP 服务器
+        per_minute: 每分钟发送上限，None 表示不限
+        daily_quota: 每日发送上限，None 表示不限
+    """
+    _provider_limits[host] = (per_minute, daily_quota)
+
+
+def get_provider_limits(host: str) -> Tuple[Optional[float], Optional[int]]:
+    """获取某个 SMTP 服务器的默认额度 (每分钟上限, 每日上限)，未知服务器不限"""
+    return _provider_limits.get(host, (None, None))
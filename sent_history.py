@@ -0,0 +1,85 @@
+"""UESTC 服务系统 - 已发送记录
+记录各账户已发送过提醒的条目（如成绩校验值），保存在 SQLite 文件中（与调度状态、租约共用同一文件），
+重启或分片由其他节点接管后不重复发送
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional, Set
+from lease import Fence, ensure_lease_tables
+
+
+class SentHistoryStore:
+    """已发送记录存储（线程安全）。
+
+    记录按范围（通常为"应用:用户名"）区分；写入可附带租约，
+    租约已易主时不写入（与租约同一文件时以防护令牌为条件，见 lease.Fence）。
+    """
+
+    def __init__(self, db_path: str):
+        """初始化已发送记录存储
+
+        Args:
+            db_path: SQLite 数据库文件路径，所在目录不存在时自动创建
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sent_history ("
+            "scope TEXT NOT NULL, key TEXT NOT NULL, sent_at REAL NOT NULL, PRIMARY KEY (scope, key))"
+        )
+        ensure_lease_tables(self._conn)
+
+    def load(self, scope: str) -> Set[str]:
+        """读取某范围的全部已发送记录
+
+        Args:
+            scope: 记录范围
+
+        Returns:
+            已发送条目的集合
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM sent_history WHERE scope = ?", (scope,)).fetchall()
+        return {row[0] for row in rows}
+
+    def add(self, scope: str, keys: Iterable[str], fence: Optional[Fence] = None) -> bool:
+        """在一个事务中写入已发送记录
+
+        Args:
+            scope: 记录范围
+            keys: 已发送的条目
+            fence: 本次发送所依据的租约，提供时仅在租约仍有效时写入
+
+        Returns:
+            写入成功返回 True；租约已易主返回 False（不写入）
+        """
+        now = time.time()
+        rows = [(scope, key, now) for key in keys]
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                if fence is not None:
+                    valid = cursor.execute(f"SELECT {Fence.SQL_CONDITION}", fence.params()).fetchone()[0]
+                    if not valid:
+                        cursor.execute("ROLLBACK")
+                        return False
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO sent_history (scope, key, sent_at) VALUES (?, ?, ?)", rows
+                )
+                cursor.execute("COMMIT")
+                return True
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        self._conn.close()
@@ -2,19 +2,42 @@
 管理账户、日志、操作层和应用模块
 """
 
+import asyncio
+import functools
 import os
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from UESTCAccount import UESTCAccount
+from session_store import SessionStore
+from account_pool import UESTCAccountPool
+from transport import get_transport_stats, set_host_rate_limiter, HOST_POLICIES
+from rate_limiter import RateLimiter, get_rate_limiter
+from resilience import CircuitBreaker, RetryPolicy, get_circuit_breakers, set_circuit_breaker
 from logger import get_logger
-from operations import get_operation_manager, EmailOperation
+from operations import get_operation_manager, EmailOperation, Operation, WebhookOperation
 from application import Application
+from lease import LeaseCoordinator, SQLiteLeaseStore
+from notification_coalescer import NotificationCoalescer
+from notification_queue import NotificationQueue
 from scheduler import Scheduler, SchedulePolicy, IntervalPolicy
+from scheduler_state import SchedulerStateStore
+from sent_history import SentHistoryStore
 
 
 class UESTCServiceSystem:
     """UESTC 定时服务系统核心框架"""
     
-    def __init__(self, username: str, password: str, email_config: Dict[str, str], multi_factor_fingerprint: str | None = None):
+    def __init__(self, username: str, password: str, email_config: Dict[str, str], multi_factor_fingerprint: str | None = None,
+                 session_store: SessionStore | None = None, max_live_sessions: int = 64,
+                 login_limiter: RateLimiter | None = None, login_mode: str = "full",
+                 scheduler_workers: int = 1, host_concurrency: int = 0,
+                 scheduler_state: SchedulerStateStore | None = None, task_timeout: float | None = 300,
+                 retry_policy: RetryPolicy | None = None, metrics_path: str | None = None,
+                 lease_coordinator: LeaseCoordinator | None = None,
+                 notification_queue: NotificationQueue | None = None,
+                 notification_coalescer: NotificationCoalescer | None = None,
+                 email_operation: EmailOperation | None = None,
+                 notification_channels: Dict[str, Operation] | None = None,
+                 history_store: SentHistoryStore | None = None):
         """初始化服务系统
 
         Args:
@@ -22,39 +45,80 @@ class UESTCServiceSystem:
             password: UESTC 密码
             email_config: 邮件配置字典，包含 'user', 'password', 'to' 键
             multi_factor_fingerprint: 两步认证信任浏览器指纹，传 None 表示不启用
+            session_store: 会话持久化存储，传 None 表示不启用
+            max_live_sessions: 账户池同时存活的 HTTP 会话上限
+            login_limiter: 所有账户共享的登录限流器，传 None 表示不限流
+            login_mode: 登录模式（full / concurrent / lean）
+            scheduler_workers: 调度器同时执行的任务数，1 表示依次执行
+            host_concurrency: 每个主机同时执行的任务数上限，0 表示不限
+            scheduler_state: 调度状态存储，重启后恢复各任务的运行记录，传 None 表示不启用
+            task_timeout: 定时任务单次执行的默认时限（秒），超时记为失败，传 None 表示不限
+            retry_policy: 失败任务的重试退避策略，传 None 表示固定间隔重试
+            metrics_path: 调度指标（启动延迟、运行耗时、超时运行等）的 JSON 导出路径，传 None 表示不导出
+            lease_coordinator: 多节点租约协调器，各账户的任务只在持有该账户租约的节点执行，传 None 表示单节点运行
+            notification_queue: 通知发送队列，邮件写入队列后由后台线程投递和重试，传 None 表示同步发送
+            notification_coalescer: 通知合并器，按类别窗口把同一收件人的邮件合并为汇总邮件，传 None 表示不合并
+            email_operation: 邮件操作（可含多个发件账户及发送额度），传 None 表示按 email_config 创建
+            notification_channels: 邮件之外的通知渠道 {操作名: 操作}（如 Webhook），通知并行发送到邮件和这些渠道
+            history_store: 应用已发送记录的存储（如成绩提醒），传 None 表示各应用使用本地历史文件
         """
         self.logger = get_logger("UESTCServiceSystem")
         self.operation_manager = get_operation_manager()
 
-        # 账户层：初始化共享账户
-        self.account = UESTCAccount(
+        # 账户层：账户池统一管理会话，默认账户即为共享账户
+        self.account_pool = UESTCAccountPool(
+            max_live_sessions=max_live_sessions,
+            session_store=session_store,
+            log_func=self.logger.info,
+            login_limiter=login_limiter,
+            login_mode=login_mode,
+        )
+        self.account: UESTCAccount = self.account_pool.add(
             username=username,
             password=password,
-            log_func=self.logger.info,
             multi_factor_fingerprint=multi_factor_fingerprint,
         )
         
         # 操作层：注册邮件操作
-        email_op = EmailOperation(
+        email_op = email_operation or EmailOperation(
             email_user=email_config.get('user', ''),
             email_pass=email_config.get('password', ''),
             email_to=email_config.get('to', '')
         )
         self.operation_manager.register_operation("email", email_op)
+        if notification_channels:
+            for name, operation in notification_channels.items():
+                self.operation_manager.register_operation(name, operation)
+            self.operation_manager.set_channels(["email", *notification_channels])
+        if notification_queue is not None:
+            self.operation_manager.set_delivery_queue(notification_queue)
+        if notification_coalescer is not None:
+            self.operation_manager.set_coalescer(notification_coalescer)
         
-        # 配置日志告警处理器
+        # 配置日志告警处理器（告警邮件优先占用发送额度）
         self.logger.set_error_alert_handler(
-            lambda subject, content: self.operation_manager.send_email(subject, content)
+            lambda subject, content: self.operation_manager.send_email(subject, content, category="alert")
         )
         self.logger.set_warning_alert_handler(
-            lambda subject, content: self.operation_manager.send_email(subject, content)
+            lambda subject, content: self.operation_manager.send_email(subject, content, category="alert")
         )
         
-        # 应用层：注册的应用列表
+        # 应用层：注册的应用列表，及应用共用的已发送记录存储
         self.applications: List[Application] = []
+        self.history_store = history_store
         
-        # 调度层：任务调度器（传入重新登录的回调函数）
-        self.scheduler = Scheduler(retry_callback=self.login)
+        # 调度层：任务调度器（传入单飞重新登录的回调函数）
+        host_limits = {host: host_concurrency for host in HOST_POLICIES} if host_concurrency > 0 else None
+        self.scheduler = Scheduler(
+            retry_callback=self.relogin,
+            max_workers=scheduler_workers,
+            host_limits=host_limits,
+            state_store=scheduler_state,
+            task_timeout=task_timeout,
+            retry_policy=retry_policy,
+            metrics_path=metrics_path,
+            lease_coordinator=lease_coordinator,
+        )
         
         # 应用定时配置：{应用名称: 定时策略}
         self.app_schedules: Dict[str, SchedulePolicy] = {}
@@ -94,6 +158,57 @@ class UESTCServiceSystem:
             self.logger.error("账户登录失败")
             return False
     
+    def add_account(self, username: str, password: str, multi_factor_fingerprint: str | None = None) -> UESTCAccount:
+        """向账户池添加额外的账户（多账户模式）
+        
+        Args:
+            username: UESTC 用户名
+            password: UESTC 密码
+            multi_factor_fingerprint: 两步认证信任浏览器指纹
+            
+        Returns:
+            UESTCAccount 实例
+        """
+        return self.account_pool.add(
+            username=username,
+            password=password,
+            multi_factor_fingerprint=multi_factor_fingerprint,
+        )
+    
+    def relogin(self, account: UESTCAccount | None = None) -> bool:
+        """任务失败时的重新登录回调
+        
+        先探测会话是否仍然有效，失效时才重新登录；多个任务同时失败时共享同一次登录。
+        
+        Args:
+            account: 需要重新登录的账户，默认为共享账户
+        
+        Returns:
+            会话可用返回 True，否则返回 False
+        """
+        account = account or self.account
+        if account.refresh_login():
+            return True
+        self.logger.error(f"账户 {account.username} 重新登录失败")
+        return False
+    
+    def restore_or_login(self) -> bool:
+        """启动时登录：优先恢复持久化的会话，失败时再执行完整登录
+        
+        Returns:
+            登录成功返回 True，失败返回 False
+        """
+        if self.account.restore_session():
+            self.logger.success("已恢复保存的会话，跳过登录")
+            return True
+        return self.login()
+    
+    @staticmethod
+    def _run_application(app: Application) -> bool:
+        """运行应用，期间其账户的会话不会被账户池回收"""
+        with app.account.pinned_session():
+            return app.run()
+    
     def run_all_applications(self) -> int:
         """运行所有已注册的应用模块
         
@@ -110,7 +225,7 @@ class UESTCServiceSystem:
         for app in self.applications:
             try:
                 self.logger.info(f"运行应用: {app.name}")
-                if app.run():
+                if self._run_application(app):
                     success_count += 1
                     self.logger.success(f"应用 {app.name} 运行成功")
                 else:
@@ -120,11 +235,41 @@ class UESTCServiceSystem:
         
         return success_count
     
+    async def run_all_applications_async(self, concurrency: int = 100) -> int:
+        """在单个事件循环中并发运行所有已注册的应用模块
+        
+        Args:
+            concurrency: 同时运行的应用数量上限
+            
+        Returns:
+            成功运行的应用数量
+        """
+        if not self.applications:
+            self.logger.warning("未注册任何应用模块")
+            return 0
+        
+        self.logger.info(f"开始并发运行 {len(self.applications)} 个应用模块...")
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _run(app: Application) -> bool:
+            async with semaphore:
+                try:
+                    if await app.run_async():
+                        self.logger.success(f"应用 {app.name} 运行成功")
+                        return True
+                    self.logger.warning(f"应用 {app.name} 运行失败")
+                except Exception as e:
+                    self.logger.error(f"应用 {app.name} 执行异常: {e}")
+                return False
+        
+        results = await asyncio.gather(*(_run(app) for app in self.applications))
+        return sum(1 for ok in results if ok)
+    
     def start_scheduler(self, check_interval: int = 60) -> None:
         """启动定时调度器
         
         Args:
-            check_interval: 调度检查间隔（秒）
+            check_interval: 失败任务的重试间隔（秒）
         """
         if not self.applications:
             self.logger.warning("未注册任何应用模块，无法启动调度器")
@@ -134,14 +279,24 @@ class UESTCServiceSystem:
         for app in self.applications:
             # 如果未设置定时策略，使用默认策略（每小时执行一次）
             policy = self.app_schedules.get(app.name, IntervalPolicy(3600))
-            self.scheduler.add_task(app.name, app.run, policy)
+            # 每个任务失败时重新登录其所属账户
+            self.scheduler.add_task(
+                app.name, functools.partial(self._run_application, app), policy,
+                hosts=app.HOSTS,
+                retry_callback=functools.partial(self.relogin, app.account),
+                timeout=app.TIMEOUT,
+                shard=app.account.username,
+            )
         
-        # 启动调度器
+        # 启动调度器（stop_scheduler 之后再次启动时同时恢复通知投递）
+        self.operation_manager.start()
         self.scheduler.start(check_interval=check_interval)
     
     def stop_scheduler(self) -> None:
-        """停止定时调度器"""
+        """停止定时调度器，回收账户池中的会话（Cookie 写入会话存储），并关闭空闲的 SMTP 连接"""
         self.scheduler.stop()
+        self.account_pool.release_all()
+        self.operation_manager.close()
     
     def get_scheduler_status(self) -> Dict[str, dict]:
         """获取调度器状态
@@ -151,16 +306,127 @@ class UESTCServiceSystem:
         """
         return self.scheduler.get_status()
     
+    def get_transport_stats(self) -> Dict[str, dict]:
+        """获取各主机的连接统计（请求数、新建连接数、复用数）
+        
+        Returns:
+            按主机区分的连接统计
+        """
+        return get_transport_stats().snapshot()
+    
+    def get_circuit_status(self) -> Dict[str, dict]:
+        """获取各主机熔断器的状态
+        
+        Returns:
+            {主机: {"state", "open_for", "opened", "rejected"}} 字典
+        """
+        return {host: breaker.snapshot() for host, breaker in get_circuit_breakers().items()}
+    
+    def get_scheduler_load(self, horizon: float = 3600) -> Dict[str, dict]:
+        """获取调度器的每秒任务数分布（已安排的运行与实际启动）
+        
+        Args:
+            horizon: 统计时长（秒）
+            
+        Returns:
+            负载直方图，见 Scheduler.get_load_histogram
+        """
+        return self.scheduler.get_load_histogram(horizon)
+    
+    def get_notification_stats(self) -> Dict[str, object]:
+        """获取通知合并（含节省的发送次数）与发送队列的统计
+        
+        Returns:
+            统计字典，见 OperationManager.get_notification_stats
+        """
+        return self.operation_manager.get_notification_stats()
+    
+    def get_scheduler_metrics(self) -> dict:
+        """获取调度指标（启动延迟与运行耗时直方图、超时运行与跳过次数、利用率）
+        
+        Returns:
+            调度指标，见 Scheduler.get_metrics
+        """
+        return self.scheduler.get_metrics()
+    
+    @staticmethod
+    def _configure_circuit_breakers() -> None:
+        """根据环境变量为各主机配置熔断器（CIRCUIT_BREAKER_THRESHOLD 为 0 时不启用）"""
+        threshold = int(os.getenv('CIRCUIT_BREAKER_THRESHOLD', '') or 5)
+        if threshold <= 0:
+            return
+        reset_max = float(os.getenv('CIRCUIT_BREAKER_MAX_OPEN', '') or 600)
+        for host in HOST_POLICIES:
+            set_circuit_breaker(host, CircuitBreaker(
+                host, failure_threshold=threshold,
+                reset_policy=RetryPolicy(base_delay=min(30, reset_max), max_delay=reset_max),
+            ))
+    
+    @staticmethod
+    def _configure_lease_coordinator() -> LeaseCoordinator | None:
+        """根据环境变量创建多节点租约协调器，未设置 LEASE_DB 时返回 None"""
+        db_path = os.getenv('LEASE_DB', '')
+        if not db_path:
+            return None
+        lease_ttl = float(os.getenv('LEASE_TTL', '') or 30)
+        return LeaseCoordinator(SQLiteLeaseStore(db_path), node_id=os.getenv('NODE_ID', '') or None, lease_ttl=lease_ttl)
+    
     @staticmethod
-    def from_environment() -> 'UESTCServiceSystem':
+    def _configure_rate_limits() -> RateLimiter | None:
+        """根据环境变量配置限流器
+        
+        Returns:
+            登录限流器，未配置时返回 None
+        """
+        db_path = os.getenv('RATE_LIMIT_DB', '') or None
+        
+        host_rate = float(os.getenv('HOST_RATE_PER_SECOND', '') or 0)
+        if host_rate > 0:
+            for host in HOST_POLICIES:
+                set_host_rate_limiter(
+                    host, get_rate_limiter(f"host:{host}", host_rate, max(host_rate, 1), db_path)
+                )
+        
+        login_rate = float(os.getenv('LOGIN_RATE_PER_MINUTE', '') or 0)
+        if login_rate <= 0:
+            return None
+        login_burst = float(os.getenv('LOGIN_RATE_BURST', '') or 3)
+        return get_rate_limiter("login", login_rate / 60, login_burst, db_path)
+    
+    @staticmethod
+    def from_environment(username: Optional[str] = None, password: Optional[str] = None,
+                         multi_factor_fingerprint: Optional[str] = None) -> 'UESTCServiceSystem':
         """从环境变量创建服务系统实例
         
+        Args:
+            username: UESTC 用户名，提供时代替 UESTC_USERNAME（多进程模式由监督器传入）
+            password: UESTC 密码，提供时代替 UESTC_PASSWORD
+            multi_factor_fingerprint: 两步认证信任浏览器指纹，提供时代替 MULTIFACTOR_BROWSER_FINGERPRINT
+        
         需要的环境变量：
         - UESTC_USERNAME: UESTC 用户名
         - UESTC_PASSWORD: UESTC 密码
         - EMAIL_USER: 邮箱地址
         - EMAIL_PASSWORD: 邮箱授权码
         - EMAIL_TO: 收件邮箱
+        - SESSION_STORE_KEY / SESSION_STORE_DIR: 会话持久化（可选）
+        - MAX_LIVE_SESSIONS: 账户池活跃会话上限（可选，默认 64）
+        - LOGIN_RATE_PER_MINUTE / LOGIN_RATE_BURST: 登录限流（可选）
+        - HOST_RATE_PER_SECOND: 各主机请求限流（可选）
+        - RATE_LIMIT_DB: 限流状态文件，设置后多个进程共享限流（可选）
+        - LOGIN_MODE: 登录模式（可选，默认 full）
+        - SCHEDULER_WORKERS / HOST_CONCURRENCY: 调度器并发任务数及每个主机的并发上限（可选）
+        - SCHEDULER_STATE_DB: 调度状态文件，设置后重启时恢复各任务的运行记录，成绩等已发送记录也保存在其中（可选）
+        - TASK_TIMEOUT: 定时任务单次执行的时限秒数（可选，默认 300，0 表示不限）
+        - SCHEDULER_METRICS_FILE: 调度指标 JSON 导出路径（可选）
+        - RETRY_BACKOFF_MAX: 失败任务指数退避重试的最长间隔秒数（可选，默认 3600）
+        - CIRCUIT_BREAKER_THRESHOLD / CIRCUIT_BREAKER_MAX_OPEN: 主机熔断阈值及最长熔断秒数（可选，默认 5 / 600，阈值为 0 表示不启用）
+        - NOTIFY_COALESCE: 通知合并规则，如 balance=3600,grades=0（可选，见 NotificationCoalescer.from_environment）
+        - NOTIFY_SPOOL_DB / NOTIFY_WORKERS / NOTIFY_MAX_ATTEMPTS / NOTIFY_DEAD_LETTER_FILE: 通知发送队列（可选，见 NotificationQueue.from_environment）
+        - EMAIL_SMTP_HOST / EMAIL_SMTP_PORT / EMAIL_RATE_PER_MINUTE / EMAIL_DAILY_QUOTA / EMAIL_SENDERS_FILE / EMAIL_SENDER_SELECTION: 发件服务器、发送额度及多个发件账户（可选，见 EmailOperation.from_environment）
+        - WEBHOOK_URLS / WEBHOOK_FORMAT / WEBHOOK_BATCH_SIZE / WEBHOOK_BATCH_WINDOW / WEBHOOK_CONCURRENCY: Webhook 通知渠道（可选，见 WebhookOperation.from_environment）
+        - LEASE_DB / NODE_ID / LEASE_TTL: 多节点租约文件、本节点 ID 及租约秒数（可选，设置 LEASE_DB 后各账户只由一个节点执行，
+          调度状态与已发送记录改为保存在租约文件中）
         
         Returns:
             UESTCServiceSystem 实例
@@ -172,12 +438,21 @@ class UESTCServiceSystem:
         
         load_dotenv()
         
-        username = os.getenv('UESTC_USERNAME', '')
-        password = os.getenv('UESTC_PASSWORD', '')
+        username = username or os.getenv('UESTC_USERNAME', '')
+        password = password or os.getenv('UESTC_PASSWORD', '')
         email_user = os.getenv('EMAIL_USER', '')
         email_pass = os.getenv('EMAIL_PASSWORD', '')
         email_to = os.getenv('EMAIL_TO', '')
-        multi_factor_fingerprint = os.getenv('MULTIFACTOR_BROWSER_FINGERPRINT', '')
+        multi_factor_fingerprint = multi_factor_fingerprint or os.getenv('MULTIFACTOR_BROWSER_FINGERPRINT', '')
+        max_live_sessions = int(os.getenv('MAX_LIVE_SESSIONS', '') or 64)
+        login_mode = os.getenv('LOGIN_MODE', '') or 'full'
+        scheduler_workers = int(os.getenv('SCHEDULER_WORKERS', '') or 1)
+        host_concurrency = int(os.getenv('HOST_CONCURRENCY', '') or 0)
+        # 启用租约时调度状态与已发送记录保存在租约文件中，写入以防护令牌为条件
+        scheduler_state_db = os.getenv('LEASE_DB', '') or os.getenv('SCHEDULER_STATE_DB', '')
+        task_timeout = float(os.getenv('TASK_TIMEOUT', '') or 300)
+        retry_backoff_max = float(os.getenv('RETRY_BACKOFF_MAX', '') or 3600)
+        metrics_path = os.getenv('SCHEDULER_METRICS_FILE', '') or None
 
         # 验证必要配置
         missing = []
@@ -195,6 +470,8 @@ class UESTCServiceSystem:
         if missing:
             raise RuntimeError(f"缺少环境变量: {', '.join(missing)}")
 
+        UESTCServiceSystem._configure_circuit_breakers()
+
         return UESTCServiceSystem(
             username=username,
             password=password,
@@ -204,4 +481,20 @@ class UESTCServiceSystem:
                 'to': email_to
             },
             multi_factor_fingerprint=multi_factor_fingerprint or None,
+            session_store=SessionStore.from_environment(),
+            max_live_sessions=max_live_sessions,
+            login_limiter=UESTCServiceSystem._configure_rate_limits(),
+            login_mode=login_mode,
+            scheduler_workers=scheduler_workers,
+            host_concurrency=host_concurrency,
+            scheduler_state=SchedulerStateStore(scheduler_state_db) if scheduler_state_db else None,
+            task_timeout=task_timeout or None,
+            retry_policy=RetryPolicy(base_delay=min(60, retry_backoff_max), max_delay=retry_backoff_max),
+            metrics_path=metrics_path,
+            lease_coordinator=UESTCServiceSystem._configure_lease_coordinator(),
+            notification_queue=NotificationQueue.from_environment(),
+            notification_coalescer=NotificationCoalescer.from_environment(),
+            email_operation=EmailOperation.from_environment(email_user, email_pass, email_to),
+            notification_channels=WebhookOperation.from_environment(),
+            history_store=SentHistoryStore(scheduler_state_db) if scheduler_state_db else None,
         )
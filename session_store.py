@@ -0,0 +1,193 @@
+"""UESTC 服务系统 - 会话持久化存储
+将各账户的 Cookie 加密保存到磁盘，进程重启后可直接恢复会话，避免重复走完整的 IDAS 登录流程
+"""
+
+import hashlib
+import json
+import os
+import time
+from http.cookiejar import Cookie, CookieJar
+from typing import List, Optional
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+
+class SessionStore:
+    """加密的 Cookie 存储，每个账户对应一个文件。
+
+    文件格式：MAGIC(4) + nonce(12) + tag(16) + AES-256-GCM 密文。
+    密文内容为 JSON：{"username": ..., "saved_at": ..., "cookies": [...]}。
+    """
+
+    MAGIC = b"USS1"
+    KDF_SALT = b"UESTCService.session_store"
+    KDF_ITERATIONS = 100_000
+
+    def __init__(self, directory: str, secret: str, max_age: int = 7 * 24 * 3600):
+        """初始化会话存储
+
+        Args:
+            directory: 存储目录，不存在时自动创建
+            secret: 加密口令，用于派生 AES 密钥
+            max_age: 会话最长保留时间（秒），超过后视为失效
+        """
+        if not secret:
+            raise ValueError("会话存储口令不能为空")
+        self.directory = directory
+        self.max_age = max_age
+        # 密钥只在初始化时派生一次，避免每个账户都付出 KDF 开销
+        self._key = hashlib.pbkdf2_hmac(
+            "sha256", secret.encode("utf-8"), self.KDF_SALT, self.KDF_ITERATIONS
+        )
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path_for(self, username: str) -> str:
+        """获取账户对应的存储文件路径（文件名不暴露学号）"""
+        digest = hashlib.sha256(username.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"{digest}.session")
+
+    @staticmethod
+    def _serialize_cookie(cookie: Cookie) -> dict:
+        """将 Cookie 对象转换为可 JSON 序列化的字典"""
+        return {
+            "version": cookie.version,
+            "name": cookie.name,
+            "value": cookie.value,
+            "port": cookie.port,
+            "port_specified": cookie.port_specified,
+            "domain": cookie.domain,
+            "domain_specified": cookie.domain_specified,
+            "domain_initial_dot": cookie.domain_initial_dot,
+            "path": cookie.path,
+            "path_specified": cookie.path_specified,
+            "secure": cookie.secure,
+            "expires": cookie.expires,
+            "discard": cookie.discard,
+            "comment": cookie.comment,
+            "comment_url": cookie.comment_url,
+            "rest": dict(getattr(cookie, "_rest", {})),
+            "rfc2109": cookie.rfc2109,
+        }
+
+    @staticmethod
+    def dump_cookies(jar: CookieJar) -> List[dict]:
+        """导出 CookieJar 中的全部 Cookie"""
+        return [SessionStore._serialize_cookie(c) for c in jar]
+
+    @staticmethod
+    def load_cookies(jar: CookieJar, cookies: List[dict]) -> None:
+        """将导出的 Cookie 写回 CookieJar"""
+        for item in cookies:
+            jar.set_cookie(Cookie(**item))
+
+    def _encrypt(self, data: bytes) -> bytes:
+        cipher = AES.new(self._key, AES.MODE_GCM, nonce=get_random_bytes(12))
+        ciphertext, tag = cipher.encrypt_and_digest(data)
+        return self.MAGIC + cipher.nonce + tag + ciphertext
+
+    def _decrypt(self, blob: bytes) -> bytes:
+        if not blob.startswith(self.MAGIC):
+            raise ValueError("会话文件格式不正确")
+        nonce = blob[4:16]
+        tag = blob[16:32]
+        ciphertext = blob[32:]
+        cipher = AES.new(self._key, AES.MODE_GCM, nonce=nonce)
+        return cipher.decrypt_and_verify(ciphertext, tag)
+
+    def save(self, username: str, jar: CookieJar) -> None:
+        """加密保存账户的 Cookie（先写临时文件再原子替换）
+
+        Args:
+            username: 账户用户名
+            jar: 待保存的 CookieJar
+        """
+        self.save_cookies(username, self.dump_cookies(jar))
+
+    def save_cookies(self, username: str, cookies: List[dict]) -> None:
+        """加密保存已导出的 Cookie 列表
+
+        Args:
+            username: 账户用户名
+            cookies: dump_cookies() 的返回值
+        """
+        payload = json.dumps({
+            "username": username,
+            "saved_at": time.time(),
+            "cookies": cookies,
+        }).encode("utf-8")
+
+        path = self._path_for(username)
+        tmp_path = f"{path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self._encrypt(payload))
+        os.replace(tmp_path, path)
+
+    def load(self, username: str) -> Optional[List[dict]]:
+        """读取账户保存的 Cookie
+
+        Args:
+            username: 账户用户名
+
+        Returns:
+            Cookie 字典列表；不存在、已过期或解密失败时返回 None
+        """
+        path = self._path_for(username)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                data = json.loads(self._decrypt(f.read()))
+        except Exception:
+            # 口令变更或文件损坏，直接作废
+            self.delete(username)
+            return None
+
+        if data.get("username") != username:
+            return None
+        if time.time() - data.get("saved_at", 0) > self.max_age:
+            self.delete(username)
+            return None
+        return data.get("cookies", [])
+
+    def restore(self, username: str, jar: CookieJar) -> bool:
+        """将保存的 Cookie 恢复到 CookieJar
+
+        Args:
+            username: 账户用户名
+            jar: 目标 CookieJar
+
+        Returns:
+            有可用的保存记录返回 True，否则返回 False
+        """
+        cookies = self.load(username)
+        if not cookies:
+            return False
+        self.load_cookies(jar, cookies)
+        return True
+
+    def delete(self, username: str) -> None:
+        """删除账户保存的会话"""
+        try:
+            os.remove(self._path_for(username))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def from_environment() -> Optional['SessionStore']:
+        """根据环境变量创建会话存储（可选功能）
+
+        需要的环境变量：
+        - SESSION_STORE_KEY: 加密口令，未设置则不启用会话存储
+        - SESSION_STORE_DIR: 存储目录（可选，默认 session_cache）
+
+        Returns:
+            SessionStore 实例，未启用时返回 None
+        """
+        secret = os.getenv('SESSION_STORE_KEY', '')
+        if not secret:
+            return None
+        directory = os.getenv('SESSION_STORE_DIR', '') or "session_cache"
+        return SessionStore(directory, secret)
+
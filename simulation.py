@@ -0,0 +1,112 @@
+"""UESTC 服务系统 - 调度模拟
+在虚拟时钟上驱动调度器：没有到期任务时直接把时间推进到下一个到期时间，
+因此可以在几秒内回放一周的调度，统计各任务的触发次数、启动延迟和调度器自身的开销
+"""
+
+import time
+from typing import Dict, List, Optional
+from clock import VirtualClock, use_clock
+from logger import get_logger
+from scheduler import Scheduler
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """计算已排序序列的分位数（最近秩法）"""
+    if not sorted_values:
+        return 0.0
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class SchedulerSimulation:
+    """调度器的虚拟时间回放。
+
+    模拟期间全局时钟被替换为虚拟时钟，任务在当前线程依次执行（调度器需为 max_workers=1）。
+    任务函数可调用 get_clock().sleep(秒数) 模拟耗时，之后到期的任务会相应延后启动。
+    日志告警的聚合窗口同样按虚拟时间计算。
+    """
+
+    def __init__(self, scheduler: Scheduler, clock: Optional[VirtualClock] = None, quiet: bool = True):
+        """初始化模拟
+
+        Args:
+            scheduler: 待模拟的调度器（不要调用 start()）
+            clock: 虚拟时钟，默认从当前系统时间开始
+            quiet: 模拟期间是否丢弃日志输出（告警聚合照常进行）
+        """
+        if scheduler.max_workers != 1:
+            raise ValueError("模拟仅支持依次执行的调度器（max_workers=1）")
+        self.scheduler = scheduler
+        self.clock = clock or VirtualClock()
+        self.quiet = quiet
+        self.logger = get_logger()
+        # 调度指标从虚拟时间起点开始统计
+        with use_clock(self.clock):
+            scheduler.reset_metrics()
+        # 各任务的累计触发次数
+        self.fire_counts: Dict[str, int] = {}
+        # 各次启动相对原定时间的延迟（虚拟秒）
+        self.latencies: List[float] = []
+
+    def run(self, duration: float) -> dict:
+        """模拟运行指定的虚拟时长（可多次调用，接着上次结束的时间继续）
+
+        Args:
+            duration: 虚拟时长（秒）
+
+        Returns:
+            本次运行的统计：virtual_seconds、wall_seconds、fires、overhead_us_per_fire、
+            latency（mean / p50 / p99 / max，虚拟秒），以及 fires_per_task（min / max / mean，累计值）。
+            延迟和耗时的直方图、超时运行次数等见 scheduler.get_metrics()（需在 use_clock(clock) 内调用）
+        """
+        scheduler = self.scheduler
+        clock = self.clock
+        logger = self.logger
+        start_latencies = len(self.latencies)
+        fires = 0
+
+        previous_sink = logger.record_sink
+        if self.quiet:
+            logger.set_record_sink(lambda level, msg: None)
+        wall_start = time.perf_counter()
+        try:
+            with use_clock(clock):
+                end = clock.time() + duration
+                while True:
+                    task, next_due = scheduler._pop_due_task()
+                    if task is None:
+                        if next_due is None or next_due > end:
+                            break
+                        clock.advance_to(next_due)
+                        continue
+                    self.latencies.append(clock.time() - task.due_time)
+                    self.fire_counts[task.name] = self.fire_counts.get(task.name, 0) + 1
+                    fires += 1
+                    scheduler._dispatch(task)
+                    if logger.pending_alerts:
+                        logger.tick()
+                clock.advance_to(end)
+                logger.tick()
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            logger.set_record_sink(previous_sink)
+
+        latencies = sorted(self.latencies[start_latencies:])
+        counts = [self.fire_counts.get(name, 0) for name in scheduler.tasks]
+        return {
+            "virtual_seconds": duration,
+            "wall_seconds": round(wall_seconds, 3),
+            "fires": fires,
+            "overhead_us_per_fire": round(wall_seconds / fires * 1e6, 2) if fires else 0.0,
+            "fires_per_task": {
+                "min": min(counts, default=0),
+                "max": max(counts, default=0),
+                "mean": round(sum(counts) / len(counts), 2) if counts else 0.0,
+            },
+            "latency": {
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                "p50": round(_percentile(latencies, 0.5), 3),
+                "p99": round(_percentile(latencies, 0.99), 3),
+                "max": round(latencies[-1], 3) if latencies else 0.0,
+            },
+        }
@@ -0,0 +1,427 @@
+"""UESTC 服务系统 - 多进程监督器
+将多个账户按一致性哈希分配到 N 个工作进程，每个进程运行各自账户的应用和调度器；
+工作进程崩溃后自动重启，日志和告警统一回传主进程输出和发送
+"""
+
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Dict, List, Optional
+from logger import get_logger
+from operations import get_operation_manager, EmailOperation, WebhookOperation
+from notification_queue import NotificationQueue
+
+# 应用注册函数：(服务系统, 账户, 该账户的收件邮箱) -> None，需为模块级函数以便传给子进程
+AppFactory = Callable[[Any, Any, Optional[str]], None]
+
+
+class HashRing:
+    """一致性哈希环。
+
+    每个节点在环上放置多个虚拟节点；节点数变化时只有少量账户需要迁移，
+    账户的会话存储、限流状态等随之留在原进程。
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 128):
+        """初始化哈希环
+
+        Args:
+            nodes: 节点名称列表
+            replicas: 每个节点的虚拟节点数
+        """
+        if not nodes:
+            raise ValueError("哈希环至少需要一个节点")
+        self._ring: List[tuple] = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._keys = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def get_node(self, key: str) -> str:
+        """获取键所属的节点
+
+        Args:
+            key: 键（如用户名）
+
+        Returns:
+            节点名称
+        """
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+def load_accounts(path: str) -> List[Dict[str, str]]:
+    """从 JSON 文件读取账户列表
+
+    文件格式为账户对象数组，每个对象包含 username、password，
+    可选 multi_factor_fingerprint、email_to。
+
+    Args:
+        path: 账户文件路径
+
+    Returns:
+        账户字典列表
+
+    Raises:
+        ValueError: 文件格式不正确
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        accounts = json.load(f)
+    if not isinstance(accounts, list):
+        raise ValueError("账户文件应为 JSON 数组")
+    usernames = set()
+    for entry in accounts:
+        if not isinstance(entry, dict) or not entry.get("username") or not entry.get("password"):
+            raise ValueError("每个账户都需要 username 和 password")
+        if entry["username"] in usernames:
+            raise ValueError(f"账户重复: {entry['username']}")
+        usernames.add(entry["username"])
+    return accounts
+
+
+class _EventSender:
+    """工作进程向主进程发送日志/告警事件（每个进程独占一条管道，进程崩溃不影响其他进程）"""
+
+    def __init__(self, worker_name: str, conn: Connection):
+        self.worker_name = worker_name
+        self._conn = conn
+        self._lock = threading.Lock()
+
+    def send(self, kind: str, *payload: str) -> bool:
+        with self._lock:
+            try:
+                self._conn.send((kind, self.worker_name) + payload)
+                return True
+            except (BrokenPipeError, OSError):
+                return False
+
+
+def _worker_main(worker_name: str, accounts: List[Dict[str, str]], app_factory: AppFactory,
+                 conn: Connection, stop_conn: Connection, check_interval: int) -> None:
+    """工作进程入口：为分配到的账户注册应用并运行调度器，直到收到停止信号"""
+    from service_system import UESTCServiceSystem
+
+    # Ctrl+C 由主进程统一处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # 日志交给主进程输出；告警在本进程聚合后交给主进程发送
+    events = _EventSender(worker_name, conn)
+    logger = get_logger()
+    logger.set_record_sink(lambda level, msg: events.send("log", level, msg))
+
+    def forward_alert(subject: str, content: str) -> bool:
+        return events.send("alert", subject, content)
+
+    spool_path = os.getenv('NOTIFY_SPOOL_DB', '')
+    if spool_path:
+        # 各工作进程使用各自的通知暂存队列（以及默认的死信文件），文件名加上进程名
+        root, ext = os.path.splitext(spool_path)
+        os.environ['NOTIFY_SPOOL_DB'] = f"{root}-{worker_name}{ext}"
+
+    primary = accounts[0]
+    system = UESTCServiceSystem.from_environment(
+        username=primary["username"],
+        password=primary["password"],
+        multi_factor_fingerprint=primary.get("multi_factor_fingerprint"),
+    )
+    logger.set_error_alert_handler(forward_alert)
+    logger.set_warning_alert_handler(forward_alert)
+    if system.scheduler.metrics_path:
+        # 各工作进程分别导出调度指标，文件名加上进程名
+        root, ext = os.path.splitext(system.scheduler.metrics_path)
+        system.scheduler.metrics_path = f"{root}-{worker_name}{ext}"
+    if system.scheduler.lease_coordinator is not None:
+        # 同一台机器上的各工作进程是不同的租约节点
+        coordinator = system.scheduler.lease_coordinator
+        coordinator.node_id = f"{coordinator.node_id}-{worker_name}"
+
+    for entry in accounts:
+        if entry is primary:
+            account = system.account
+        else:
+            account = system.add_account(
+                entry["username"], entry["password"], entry.get("multi_factor_fingerprint")
+            )
+        app_factory(system, account, entry.get("email_to"))
+        if not account.restore_or_login():
+            logger.error(f"账户 {entry['username']} 登录失败，将在任务失败重试时再次尝试")
+
+    system.start_scheduler(check_interval=check_interval)
+    try:
+        # 主进程关闭停止管道（正常停止或主进程意外退出）时，poll 返回 True
+        stop_conn.poll(None)
+    finally:
+        system.stop_scheduler()
+        logger.flush_errors()
+
+
+class Supervisor:
+    """多进程监督器"""
+
+    # 工作进程持续运行超过此时间（秒）后，重启退避清零
+    STABLE_UPTIME = 300
+    # 重启退避上限（秒）
+    MAX_RESTART_DELAY = 60
+
+    def __init__(self, accounts: List[Dict[str, str]], num_workers: int, app_factory: AppFactory,
+                 check_interval: int = 30):
+        """初始化监督器
+
+        Args:
+            accounts: 账户字典列表（见 load_accounts）
+            num_workers: 工作进程数
+            app_factory: 应用注册函数，在工作进程中为每个账户调用
+            check_interval: 工作进程调度器的失败重试间隔（秒）
+        """
+        if num_workers <= 0:
+            raise ValueError("工作进程数必须大于 0")
+        self.accounts = accounts
+        self.app_factory = app_factory
+        self.check_interval = check_interval
+        self.logger = get_logger()
+        self.operation_manager = get_operation_manager()
+
+        worker_names = [f"worker-{i}" for i in range(num_workers)]
+        self.ring = HashRing(worker_names)
+        # 工作进程 -> 分配到的账户（没有账户的进程不启动）
+        self.assignments: Dict[str, List[Dict[str, str]]] = {}
+        for entry in accounts:
+            self.assignments.setdefault(self.ring.get_node(entry["username"]), []).append(entry)
+
+        # spawn 启动：子进程不继承主进程的线程和连接状态
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: Dict[str, multiprocessing.Process] = {}
+        self._started_at: Dict[str, float] = {}
+        # 各工作进程事件管道的读端 -> 工作进程名称
+        self._readers: Dict[Connection, str] = {}
+        self._readers_lock = threading.Lock()
+        # 各工作进程停止管道的写端（不使用共享 Event：进程崩溃在等待中会使其失效）
+        self._stop_writers: Dict[str, Connection] = {}
+        self._restart_delays: Dict[str, float] = {}
+        # 待重启的工作进程 -> 重启时间
+        self._pending_restarts: Dict[str, float] = {}
+        self._collector: Optional[threading.Thread] = None
+        self.running = False
+        self.restarts = 0
+
+    def _spawn(self, worker_name: str) -> None:
+        """启动工作进程"""
+        reader, writer = self._context.Pipe(duplex=False)
+        stop_reader, stop_writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            name=worker_name,
+            args=(worker_name, self.assignments[worker_name], self.app_factory,
+                  writer, stop_reader, self.check_interval),
+            daemon=False,
+        )
+        process.start()
+        # 主进程关闭事件管道写端和停止管道读端，工作进程退出后事件管道收到 EOF
+        writer.close()
+        stop_reader.close()
+        self._stop_writers[worker_name] = stop_writer
+        with self._readers_lock:
+            self._readers[reader] = worker_name
+        self._processes[worker_name] = process
+        self._started_at[worker_name] = time.time()
+        self.logger.info(f"已启动 {worker_name}（PID {process.pid}，{len(self.assignments[worker_name])} 个账户）")
+
+    def _collect_events(self) -> None:
+        """收集工作进程回传的日志和告警，直到停止且所有管道关闭"""
+        while True:
+            with self._readers_lock:
+                readers = list(self._readers)
+            if not readers:
+                if not self.running:
+                    break
+                time.sleep(0.2)
+                continue
+            for reader in wait(readers, timeout=0.5):
+                try:
+                    event = reader.recv()
+                except (EOFError, OSError):
+                    with self._readers_lock:
+                        self._readers.pop(reader, None)
+                    reader.close()
+                    continue
+                self._handle_event(event)
+
+    def _handle_event(self, event: tuple) -> None:
+        """输出工作进程的日志，发送工作进程的聚合告警"""
+        kind, worker_name = event[0], event[1]
+        if kind == "log":
+            _, _, level, msg = event
+            self.logger.log(f"[{worker_name}] {msg}", level)
+        elif kind == "alert":
+            _, _, subject, content = event
+            self.operation_manager.send_email(f"{subject}（{worker_name}）", content, category="alert")
+
+    def start(self) -> None:
+        """启动所有工作进程及日志收集线程"""
+        self.running = True
+        self._collector = threading.Thread(target=self._collect_events, daemon=True)
+        self._collector.start()
+        for worker_name in self.assignments:
+            self._spawn(worker_name)
+        self.logger.success(
+            f"监督器已启动：{len(self.accounts)} 个账户分配到 {len(self.assignments)} 个工作进程"
+        )
+
+    def poll(self, timeout: float = 1.0) -> None:
+        """等待工作进程退出事件，崩溃的进程按退避时间重启
+
+        Args:
+            timeout: 最长等待时间（秒）
+        """
+        sentinels = {process.sentinel: name for name, process in self._processes.items() if process.is_alive()}
+        now = time.time()
+        if self._pending_restarts:
+            timeout = min(timeout, max(min(self._pending_restarts.values()) - now, 0))
+        if sentinels:
+            ready = wait(list(sentinels), timeout=timeout)
+        else:
+            time.sleep(timeout)
+            ready = []
+        if not self.running:
+            return
+
+        now = time.time()
+        for sentinel in ready:
+            worker_name = sentinels[sentinel]
+            process = self._processes[worker_name]
+            process.join()
+            self._stop_writers.pop(worker_name).close()
+            if now - self._started_at[worker_name] >= self.STABLE_UPTIME:
+                self._restart_delays[worker_name] = 0
+            delay = min(max(self._restart_delays.get(worker_name, 0) * 2, 1), self.MAX_RESTART_DELAY)
+            self._restart_delays[worker_name] = delay
+            self._pending_restarts[worker_name] = now + delay
+            self.logger.error(f"{worker_name} 异常退出（退出码 {process.exitcode}），{delay:.0f} 秒后重启")
+
+        for worker_name, restart_at in list(self._pending_restarts.items()):
+            if restart_at <= now:
+                del self._pending_restarts[worker_name]
+                self.restarts += 1
+                self._spawn(worker_name)
+
+    def run_forever(self) -> None:
+        """启动并监督工作进程，直到 KeyboardInterrupt"""
+        self.start()
+        try:
+            while self.running:
+                self.poll()
+        except KeyboardInterrupt:
+            self.logger.info("收到停止信号，正在关闭工作进程...")
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 15) -> None:
+        """通知所有工作进程退出，超时未退出的强制终止
+
+        Args:
+            timeout: 等待工作进程退出的时间（秒）
+        """
+        if not self.running:
+            return
+        self.running = False
+        for stop_writer in self._stop_writers.values():
+            stop_writer.close()
+        self._stop_writers.clear()
+        deadline = time.time() + timeout
+        for worker_name, process in self._processes.items():
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                self.logger.warning(f"{worker_name} 未按时退出，强制终止")
+                process.terminate()
+                process.join(5)
+        if self._collector:
+            self._collector.join(timeout=5)
+        self.operation_manager.close()
+        self.logger.info("监督器已停止")
+
+    def get_status(self) -> Dict[str, dict]:
+        """获取各工作进程的状态
+
+        Returns:
+            {工作进程: {"pid", "alive", "accounts", "uptime"}} 字典
+        """
+        now = time.time()
+        return {
+            worker_name: {
+                "pid": process.pid,
+                "alive": process.is_alive(),
+                "accounts": [entry["username"] for entry in self.assignments[worker_name]],
+                "uptime": round(now - self._started_at[worker_name]),
+            }
+            for worker_name, process in self._processes.items()
+        }
+
+    @staticmethod
+    def from_environment(app_factory: AppFactory, check_interval: int = 30) -> 'Supervisor':
+        """从环境变量创建监督器，并为主进程注册告警邮件
+
+        需要的环境变量：
+        - ACCOUNTS_FILE: 账户文件（JSON）
+        - WORKER_PROCESSES: 工作进程数
+        - EMAIL_USER / EMAIL_PASSWORD / EMAIL_TO: 告警邮件配置
+        - EMAIL_SMTP_HOST / EMAIL_RATE_PER_MINUTE / EMAIL_SENDERS_FILE 等: 发件服务器、发送额度及多个发件账户（可选，见 EmailOperation.from_environment）
+        - WEBHOOK_URLS 等: 告警同时推送到的 Webhook（可选，见 WebhookOperation.from_environment）
+
+        Args:
+            app_factory: 应用注册函数
+            check_interval: 工作进程调度器的失败重试间隔（秒）
+
+        Returns:
+            Supervisor 实例
+
+        Raises:
+            RuntimeError: 缺少必要的环境变量
+        """
+        from dotenv import load_dotenv
+
+        load_dotenv()
+
+        accounts_file = os.getenv('ACCOUNTS_FILE', '')
+        num_workers = int(os.getenv('WORKER_PROCESSES', '') or 0)
+        email_user = os.getenv('EMAIL_USER', '')
+        email_pass = os.getenv('EMAIL_PASSWORD', '')
+        email_to = os.getenv('EMAIL_TO', '')
+
+        missing = [name for name, value in (
+            ('ACCOUNTS_FILE', accounts_file),
+            ('WORKER_PROCESSES', num_workers),
+            ('EMAIL_USER', email_user),
+            ('EMAIL_PASSWORD', email_pass),
+            ('EMAIL_TO', email_to),
+        ) if not value]
+        if missing:
+            raise RuntimeError(f"缺少环境变量: {', '.join(missing)}")
+
+        logger = get_logger()
+        operation_manager = get_operation_manager()
+        operation_manager.register_operation("email", EmailOperation.from_environment(email_user, email_pass, email_to))
+        webhooks = WebhookOperation.from_environment()
+        if webhooks:
+            for name, operation in webhooks.items():
+                operation_manager.register_operation(name, operation)
+            operation_manager.set_channels(["email", *webhooks])
+        notification_queue = NotificationQueue.from_environment()
+        if notification_queue is not None:
+            operation_manager.set_delivery_queue(notification_queue)
+        logger.set_error_alert_handler(
+            lambda subject, content: operation_manager.send_email(subject, content, category="alert")
+        )
+        logger.set_warning_alert_handler(
+            lambda subject, content: operation_manager.send_email(subject, content, category="alert")
+        )
+
+        return Supervisor(load_accounts(accounts_file), num_workers, app_factory, check_interval)
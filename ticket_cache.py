@@ -0,0 +1,189 @@
+"""UESTC 服务系统 - 服务票据缓存
+按 CAS service 缓存各业务系统的访问凭据（如 EAMS bearer token），避免每次都走完整的 CAS 重定向链
+"""
+
+import asyncio
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class ServiceTicketCache:
+    """带 TTL 的服务票据缓存。
+
+    - 未过期的票据直接返回，过期或被作废后重新获取
+    - 业务接口返回 401 等鉴权失败时，调用方应 invalidate() 后重新获取
+    - 同一 service 的并发获取只会执行一次（单飞，同步与异步调用方共享同一次获取）
+
+    票据可以是任意值（如 bearer token；只需记录"已完成 CAS 跳转"时为 True）。
+    """
+
+    def __init__(self, default_ttl: float = 1800):
+        """初始化票据缓存
+
+        Args:
+            default_ttl: 默认有效期（秒）
+        """
+        self.default_ttl = default_ttl
+        self._entries: Dict[str, Tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+        # 进行中的获取 {缓存键: 结果}，获取结束即删除
+        self._fetches: Dict[str, Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def service_key(url: str) -> str:
+        """获取缓存键：CAS 登录 URL 取其 service 参数，其他 URL 原样使用
+
+        Args:
+            url: CAS 登录 URL 或 service URL
+
+        Returns:
+            缓存键
+        """
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        if 'service' in params:
+            return params['service'][0]
+        return url
+
+    def _lookup(self, key: str) -> Any:
+        """查找未过期的票据（调用方需持有 self._lock）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        return value
+
+    def peek(self, url: str) -> Any:
+        """查看缓存中的票据，不触发获取
+
+        Args:
+            url: CAS 登录 URL 或 service URL
+
+        Returns:
+            未过期的票据，不存在返回 None
+        """
+        with self._lock:
+            return self._lookup(self.service_key(url))
+
+    def put(self, url: str, value: Any, ttl: Optional[float] = None) -> None:
+        """写入票据
+
+        Args:
+            url: CAS 登录 URL 或 service URL
+            value: 票据值
+            ttl: 有效期（秒），默认使用 default_ttl
+        """
+        expires_at = time.time() + (ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            self._entries[self.service_key(url)] = (value, expires_at)
+
+    def _join(self, key: str) -> Tuple[Any, Optional[Future], bool]:
+        """查找票据，未命中时加入或发起获取
+
+        Returns:
+            (命中的票据, 进行中的获取, 是否由调用方发起获取)；命中时后两项为 (None, False)
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value, None, False
+            pending = self._fetches.get(key)
+            if pending is not None:
+                # 共享进行中的获取结果
+                self.hits += 1
+                return None, pending, False
+            pending = self._fetches[key] = Future()
+            self.misses += 1
+            return None, pending, True
+
+    def _complete(self, key: str, url: str, pending: Future, value: Any, ttl: Optional[float]) -> None:
+        """获取结束：缓存成功的结果，唤醒等待的调用方，并删除进行中的记录"""
+        if value is not None:
+            self.put(url, value, ttl)
+        with self._lock:
+            if self._fetches.get(key) is pending:
+                del self._fetches[key]
+        pending.set_result(value)
+
+    def get(self, url: str, fetch: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """获取票据：命中缓存直接返回，否则调用 fetch 获取并缓存
+
+        Args:
+            url: CAS 登录 URL 或 service URL
+            fetch: 票据获取函数，失败返回 None 或 False（失败结果不缓存）
+            ttl: 有效期（秒），默认使用 default_ttl
+
+        Returns:
+            票据，获取失败返回 None
+        """
+        key = self.service_key(url)
+        value, pending, leader = self._join(key)
+        if pending is None:
+            return value
+        if not leader:
+            return pending.result()
+
+        value = None
+        try:
+            value = fetch() or None
+        finally:
+            self._complete(key, url, pending, value, ttl)
+        return value
+
+    async def aget(self, url: str, fetch: Callable[[], Awaitable[Any]], ttl: Optional[float] = None) -> Any:
+        """get() 的异步版本（与同步调用方共享进行中的获取）
+
+        Args:
+            url: CAS 登录 URL 或 service URL
+            fetch: 异步票据获取函数，失败返回 None 或 False
+            ttl: 有效期（秒），默认使用 default_ttl
+
+        Returns:
+            票据，获取失败返回 None
+        """
+        key = self.service_key(url)
+        value, pending, leader = self._join(key)
+        if pending is None:
+            return value
+        if not leader:
+            # shield：等待方被取消时不影响进行中的获取
+            return await asyncio.shield(asyncio.wrap_future(pending))
+
+        value = None
+        try:
+            value = await fetch() or None
+        finally:
+            self._complete(key, url, pending, value, ttl)
+        return value
+
+    def invalidate(self, url: str) -> None:
+        """作废指定 service 的票据（如业务接口返回 401）"""
+        with self._lock:
+            self._entries.pop(self.service_key(url), None)
+
+    def clear(self) -> None:
+        """清空所有票据（如重新登录后）"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取缓存统计信息
+
+        Returns:
+            包含缓存条目数、命中次数、未命中次数的字典
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
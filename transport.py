@@ -0,0 +1,321 @@
+"""UESTC 服务系统 - 传输层
+为账户会话提供按主机区分的连接池、重试与超时策略，并统计连接新建/复用次数。
+调度器为任务设置的截止时间按线程传递到此处，每次连接/读取的超时不会超过剩余时间，
+截止时间已过后发起的请求直接失败
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, TypeVar
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from rate_limiter import RateLimiter
+from resilience import CircuitOpenError, get_circuit_breaker
+
+
+class HostPolicy:
+    """单个主机的连接池、重试与超时策略"""
+
+    def __init__(self, pool_maxsize: int = 4, max_retries: int = 2, backoff_factor: float = 0.5,
+                 connect_timeout: float = 5, read_timeout: float = 15, pool_block: bool = False,
+                 rate_limit_max_wait: float = 30):
+        """初始化主机策略
+
+        Args:
+            pool_maxsize: 每个会话对该主机保留的最大连接数
+            max_retries: 连接错误及 502/503/504 的重试次数（仅幂等请求）
+            backoff_factor: 重试退避系数
+            connect_timeout: 默认连接超时（秒），调用方未指定 timeout 时生效
+            read_timeout: 默认读取超时（秒），调用方未指定 timeout 时生效
+            pool_block: 连接池耗尽时是否阻塞等待（False 则临时新建连接）
+            rate_limit_max_wait: 主机限流排队的最长等待时间（秒）
+        """
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_block = pool_block
+        self.rate_limit_max_wait = rate_limit_max_wait
+
+    def build_retry(self) -> Retry:
+        """生成 urllib3 重试配置（POST 等非幂等请求不重试，避免重复提交登录表单）"""
+        return Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+            raise_on_status=False,
+        )
+
+
+# 账户会话涉及的三个主机及其默认策略；其他主机使用 DEFAULT_POLICY
+HOST_POLICIES: Dict[str, HostPolicy] = {
+    "idas.uestc.edu.cn": HostPolicy(pool_maxsize=4, max_retries=1, read_timeout=15),
+    "eamsapp.uestc.edu.cn": HostPolicy(pool_maxsize=4, max_retries=2, read_timeout=15),
+    "online.uestc.edu.cn": HostPolicy(pool_maxsize=4, max_retries=2, read_timeout=10),
+}
+DEFAULT_POLICY = HostPolicy()
+
+# 各主机的请求限流器（未设置的主机不限流）
+_host_rate_limiters: Dict[str, RateLimiter] = {}
+
+
+class HostRateLimited(requests.exceptions.RequestException):
+    """主机请求限流排队超时"""
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """当前线程的请求截止时间已过"""
+
+
+# 当前线程的请求截止时间（time.monotonic() 时间戳）
+_deadline_local = threading.local()
+
+T = TypeVar("T")
+
+
+def get_request_deadline() -> Optional[float]:
+    """获取当前线程的请求截止时间（monotonic 时间戳），未设置返回 None"""
+    return getattr(_deadline_local, "deadline", None)
+
+
+def remaining_time() -> Optional[float]:
+    """获取距当前线程请求截止时间的剩余秒数，未设置返回 None"""
+    deadline = get_request_deadline()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextmanager
+def request_deadline(timeout: Optional[float]) -> Iterator[None]:
+    """在当前线程内为之后的所有请求设置截止时间（可嵌套，取更早的截止时间）
+
+    Args:
+        timeout: 距现在的秒数，None 表示不额外限制
+    """
+    previous = get_request_deadline()
+    deadline = previous
+    if timeout is not None:
+        candidate = time.monotonic() + timeout
+        deadline = candidate if previous is None else min(previous, candidate)
+    _deadline_local.deadline = deadline
+    try:
+        yield
+    finally:
+        _deadline_local.deadline = previous
+
+
+def propagate_deadline(func: Callable[..., T]) -> Callable[..., T]:
+    """包装函数，使其在其他线程（如线程池）中执行时沿用调用方线程当前的截止时间"""
+    deadline = get_request_deadline()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = get_request_deadline()
+        _deadline_local.deadline = deadline
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _deadline_local.deadline = previous
+
+    return wrapper
+
+
+def _clamp_timeout(timeout, remaining: float):
+    """将请求超时限制在剩余时间内（支持单个数值和 (connect, read) 元组）"""
+    if isinstance(timeout, tuple):
+        return tuple(remaining if part is None else min(part, remaining) for part in timeout)
+    if timeout is None or isinstance(timeout, (int, float)):
+        return remaining if timeout is None else min(timeout, remaining)
+    # urllib3 Timeout 对象等其他形式保持不变
+    return timeout
+
+
+def set_host_rate_limiter(host: str, limiter: Optional[RateLimiter]) -> None:
+    """设置主机的请求限流器
+
+    Args:
+        host: 主机名，如 "idas.uestc.edu.cn"
+        limiter: 限流器，传 None 取消限流
+    """
+    if limiter is None:
+        _host_rate_limiters.pop(host, None)
+    else:
+        _host_rate_limiters[host] = limiter
+
+
+def get_host_rate_limiter(host: str) -> Optional[RateLimiter]:
+    """获取主机的请求限流器，未设置返回 None"""
+    return _host_rate_limiters.get(host)
+
+
+class TransportStats:
+    """按主机统计请求数与新建连接数（线程安全）。
+
+    复用次数 = 请求数 - 新建连接数；复用率接近 1 说明 keep-alive 生效。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[str, int] = {}
+        self._opened: Dict[str, int] = {}
+
+    def record_request(self, host: str) -> None:
+        with self._lock:
+            self._requests[host] = self._requests.get(host, 0) + 1
+
+    def record_connection(self, host: str) -> None:
+        with self._lock:
+            self._opened[host] = self._opened.get(host, 0) + 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        """获取各主机的统计快照
+
+        Returns:
+            {主机: {"requests", "opened", "reused", "reuse_ratio"}} 字典
+        """
+        with self._lock:
+            result = {}
+            for host in sorted(set(self._requests) | set(self._opened)):
+                requests_count = self._requests.get(host, 0)
+                opened = self._opened.get(host, 0)
+                reused = max(requests_count - opened, 0)
+                result[host] = {
+                    "requests": requests_count,
+                    "opened": opened,
+                    "reused": reused,
+                    "reuse_ratio": round(reused / requests_count, 3) if requests_count else 0.0,
+                }
+            return result
+
+    def reset(self) -> None:
+        """清空统计"""
+        with self._lock:
+            self._requests.clear()
+            self._opened.clear()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """按主机策略配置的 HTTPAdapter，统计请求数与新建连接数，并补充默认超时"""
+
+    def __init__(self, host: str, policy: HostPolicy, stats: TransportStats):
+        """初始化适配器
+
+        Args:
+            host: 统计用的主机名
+            policy: 主机策略
+            stats: 统计对象
+        """
+        # init_poolmanager 在父类构造中调用，需先设置属性
+        self.host = host
+        self.policy = policy
+        self.stats = stats
+        super().__init__(
+            pool_connections=1,
+            pool_maxsize=policy.pool_maxsize,
+            max_retries=policy.build_retry(),
+            pool_block=policy.pool_block,
+        )
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        stats, host = self.stats, self.host
+
+        class _CountingHTTPPool(HTTPConnectionPool):
+            def _new_conn(self):
+                stats.record_connection(host)
+                return super()._new_conn()
+
+        class _CountingHTTPSPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                stats.record_connection(host)
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPPool,
+            "https": _CountingHTTPSPool,
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = (self.policy.connect_timeout, self.policy.read_timeout)
+        max_wait = self.policy.rate_limit_max_wait
+        remaining = remaining_time()
+        if remaining is not None:
+            max_wait = min(max_wait, max(remaining, 0))
+        breaker = get_circuit_breaker(self.host)
+        if breaker is None:
+            return self._send(request, timeout, max_wait, **kwargs)
+        if not breaker.allow():
+            # 熔断打开时直接拒绝，不占用限流名额和连接
+            raise CircuitOpenError(f"主机 {self.host} 已熔断，请求被拒绝", request=request)
+        recorded = False
+        try:
+            try:
+                response = self._send(request, timeout, max_wait, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                breaker.record_failure()
+                recorded = True
+                raise
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            recorded = True
+            return response
+        finally:
+            if not recorded:
+                # 限流、截止时间等未能判断主机状态的结果：释放探测名额
+                breaker.release()
+
+    def _send(self, request, timeout, max_wait: float, **kwargs):
+        """按主机限流并把超时限制在任务截止时间内后发送请求"""
+        limiter = _host_rate_limiters.get(self.host)
+        if limiter and not limiter.acquire(max_wait=max_wait):
+            raise HostRateLimited(f"主机 {self.host} 请求限流排队超时", request=request)
+        # 限流排队之后再计算剩余时间，连接/读取超时不超过任务截止时间（urllib3 内部重试沿用同一超时）
+        remaining = remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded(f"请求 {self.host} 时任务已超过截止时间", request=request)
+            timeout = _clamp_timeout(timeout, remaining)
+        self.stats.record_request(self.host)
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def build_session(stats: Optional[TransportStats] = None) -> requests.Session:
+    """创建挂载了按主机策略适配器的会话
+
+    Args:
+        stats: 统计对象，默认使用全局统计
+
+    Returns:
+        requests.Session 实例
+    """
+    stats = stats or get_transport_stats()
+    session = requests.Session()
+    session.mount("http://", CountingHTTPAdapter("*", DEFAULT_POLICY, stats))
+    session.mount("https://", CountingHTTPAdapter("*", DEFAULT_POLICY, stats))
+    for host, policy in HOST_POLICIES.items():
+        session.mount(f"https://{host}/", CountingHTTPAdapter(host, policy, stats))
+    return session
+
+
+# 全局传输统计实例
+_global_transport_stats: Optional[TransportStats] = None
+
+
+def get_transport_stats() -> TransportStats:
+    """获取全局传输统计实例
+
+    Returns:
+        TransportStats 实例
+    """
+    global _global_transport_stats
+    if _global_transport_stats is None:
+        _global_transport_stats = TransportStats()
+    return _global_transport_stats